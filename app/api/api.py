@@ -1,12 +1,15 @@
 from fastapi import APIRouter
-from app.api.endpoints import auth, accounts, locations, areas
+from app.api.endpoints import auth, accounts, locations, areas, analytics, export
 from app.api.endpoints.animals import animals, types, locations as animals_locations
 api_router = APIRouter()
 api_router.include_router(auth.router)
 api_router.include_router(accounts.router)
 api_router.include_router(locations.router)
-animals.router.include_router(types.router)
+# раньше маршрутов животных: иначе /animals/types попадает в /animals/{animalId}
+api_router.include_router(types.router, prefix="/animals")
 api_router.include_router(animals.router)
 api_router.include_router(animals_locations.router)
 api_router.include_router(areas.router)
+api_router.include_router(analytics.router)
+api_router.include_router(export.router)
 
@@ -1,5 +1,6 @@
 from typing import List
 from fastapi import APIRouter, Depends, HTTPException, Path, Query, status
+from app.core.admission import Admission
 from app.db.db import get_db
 from app.core.auth import Authorize
 from app.schemas.user import Register, User, RegisterForAdmin
@@ -10,7 +11,7 @@ from app.models.user import User as UserModel
 router = APIRouter(tags=["Аккаунты"], prefix="/accounts")
 
 
-@router.get("/search", response_model=List[User])
+@router.get("/search", response_model=List[User], dependencies=[Depends(Admission("search"))])
 def search_accounts(
     firstName: str = None,
     lastName: str = None,
@@ -0,0 +1,31 @@
+from fastapi import APIRouter, Depends, HTTPException, Path, status
+from app.core.auth import Authorize
+from app.core.jobs import analytics_jobs
+from app.models.jobs import AnalyticsJob as AnalyticsJobTask
+from app.schemas.areas import AnalyticsJob
+
+router = APIRouter(tags=["Аналитика"], prefix="/analytics")
+
+
+def get_own_job(job_id: str, authorize: Authorize) -> AnalyticsJobTask:
+    job = analytics_jobs.get(job_id)
+    if job is None or (job.ownerId != authorize.current_user_id and not authorize.current_user.is_admin):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail="Задача не найдена")
+    return job
+
+
+@router.get("/jobs/{job_id}", response_model=AnalyticsJob)
+def get_analytics_job(
+        job_id: str = Path(...),
+        authorize: Authorize = Depends(Authorize())
+):
+    return get_own_job(job_id, authorize)
+
+
+@router.delete("/jobs/{job_id}", response_model=AnalyticsJob)
+def cancel_analytics_job(
+        job_id: str = Path(...),
+        authorize: Authorize = Depends(Authorize())
+):
+    return analytics_jobs.cancel(get_own_job(job_id, authorize).id)
@@ -1,15 +1,27 @@
+from datetime import datetime, timezone
 from typing import List
-from fastapi import APIRouter, Depends, HTTPException, Path, Query, status
+from fastapi import APIRouter, Depends, Header, HTTPException, Path, Query, Response, status
 from sqlalchemy.orm import Session
 
+from app.core.admission import Admission
+from app.core.config import settings
+from app.core.encoding import MSGPACK_RESPONSES, ResponseFormat
+from app.core.etag import etag_matches, make_etag, not_modified
+from app.core.indexes import area_index, point_index
+from app.core.trajectory import build_trajectories, track_end
+from app.core.visits import visit_batcher
 from app.crud.crud_animal import AnimalCRUD
+from app.crud.crud_area import AreaCRUD
 from app.crud.crud_point import PointCRUD
+from app.crud.crud_rollup import AreaRollupCRUD
 from app.crud.crud_types import AnimalTypeCRUD
 from app.core.auth import Authorize
 from app.db.db import get_db
 from app.models.animals import AnimalAlive, AnimalGender
-from app.schemas.animals import Animal, AnimalCreate, AnimalLocation, UpdateAnimal, UpdateAnimalLocation, UpdateAnimalType
-from app.schemas.types import ISODateTime
+from app.schemas.areas import Area
+from app.schemas.animals import Animal, AnimalCreate, AnimalLocation, Trajectory, UpdateAnimal, UpdateAnimalLocation, UpdateAnimalType, animal_from_row, animal_location_from_row
+from app.schemas.locations import Region
+from app.schemas.types import Batch, IdList, ISODateTime
 from app.crud.crud_user import UserCRUD
 router = APIRouter(tags=["Животные"], prefix="/animals")
 
@@ -60,7 +72,46 @@ def create_animal(
     return animal
 
 
-@router.get("/search", response_model=List[Animal])
+@router.get("", response_model=Batch[Animal])
+def get_animals(
+    ids: IdList = Query(...),
+    authorize: Authorize = Depends(Authorize()),
+    db: Session = Depends(get_db)
+):
+    '''Несколько животных за один запрос; ненайденные id возвращаются в missing'''
+    Batch.check_size(ids)
+    animals = [animal_from_row(row) for row in AnimalCRUD(db).get_animals_rows_by_ids(ids)]
+    return Batch.split(ids, {animal["id"]: animal for animal in animals})
+
+
+def get_trajectories(db: Session, animal_ids: list[int], startDateTime, endDateTime) -> dict[int, dict]:
+    '''Траектории существующих животных из animal_ids'''
+    animal_crud = AnimalCRUD(db)
+    death_times = animal_crud.get_death_times(animal_ids)
+    now = datetime.now(timezone.utc)
+    until = {animal_id: track_end(now, endDateTime, death_time) for animal_id, death_time in death_times.items()}
+    rows = animal_crud.get_tracks_rows(list(until), start=startDateTime, end=endDateTime)
+    return build_trajectories(rows, until, area_index.get(db))
+
+
+@router.get("/trajectories", response_model=Batch[Trajectory], responses=MSGPACK_RESPONSES,
+            dependencies=[Depends(Admission("analytics"))])
+def get_animals_trajectories(
+    ids: IdList = Query(...),
+    startDateTime: ISODateTime = None,
+    endDateTime: ISODateTime = None,
+    response_format: ResponseFormat = Depends(),
+    authorize: Authorize = Depends(Authorize()),
+    db: Session = Depends(get_db)
+):
+    '''Траектории нескольких животных за один запрос; ненайденные id возвращаются в missing'''
+    Batch.check_size(ids)
+    trajectories = get_trajectories(db, ids, startDateTime, endDateTime)
+    return response_format.response(Batch.split(ids, trajectories))
+
+
+@router.get("/search", response_model=List[Animal], responses=MSGPACK_RESPONSES,
+            dependencies=[Depends(Admission("search"))])
 def search_animals(
     startDateTime: ISODateTime = None,
     endDateTime: ISODateTime = None,
@@ -69,11 +120,12 @@ def search_animals(
     gender: AnimalGender = None,
     from_: int = Query(0, ge=0, alias="from"),
     size: int = Query(10, gt=0),
+    response_format: ResponseFormat = Depends(),
     authorize: Authorize = Depends(Authorize()),
     db: Session = Depends(get_db)
 ):
     animals_crud = AnimalCRUD(db)
-    animals = animals_crud.search_animals(
+    rows = animals_crud.search_animals_rows(
         startDateTime=startDateTime,
         endDateTime=endDateTime,
         chipperId=chipperId,
@@ -82,15 +134,51 @@ def search_animals(
         from_=from_,
         size=size
     )
-    return animals
+    return response_format.response([animal_from_row(row) for row in rows], model=Animal)
+
+
+@router.get("/within", response_model=List[Animal], dependencies=[Depends(Admission("spatial"))])
+def get_animals_within(
+    region: Region = Depends(),
+    from_: int = Query(0, ge=0, alias="from"),
+    size: int = Query(settings.WITHIN_MAX_RESULTS, gt=0, le=settings.WITHIN_MAX_RESULTS),
+    authorize: Authorize = Depends(Authorize()),
+    db: Session = Depends(get_db)
+):
+    '''Животные, текущее положение которых в прямоугольнике или круге, по возрастанию id'''
+    point_ids = region.find_point_ids(point_index.get(db))
+    return AnimalCRUD(db).get_animals_at_points(point_ids, from_=from_, size=size)
 
 
 @router.get("/{animalId}", response_model=Animal)
 def get_animal(
+    response: Response,
     animalId: int = Path(..., ge=1),
+    if_none_match: str | None = Header(default=None, include_in_schema=False),
     authorize: Authorize = Depends(Authorize()),
     db: Session = Depends(get_db)
 ):
+    animal_crud = AnimalCRUD(db)
+    version = animal_crud.get_animal_version(animalId)
+    if version is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Животное с id {animalId} не найдено"
+        )
+    etag = make_etag("animal", animalId, *version)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    response.headers["ETag"] = etag
+    return animal_crud.get_animal_by_id(animalId)
+
+
+@router.get("/{animalId}/areas", response_model=List[Area], dependencies=[Depends(Admission("spatial"))])
+def get_animal_areas(
+    animalId: int = Path(..., ge=1),
+    authorize: Authorize = Depends(Authorize()),
+    db: Session = Depends(get_db)
+):
+    '''Зоны, в которых животное находится сейчас'''
     animal_crud = AnimalCRUD(db)
     animal = animal_crud.get_animal_by_id(animalId)
     if not animal:
@@ -98,7 +186,9 @@ def get_animal(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Животное с id {animalId} не найдено"
         )
-    return animal
+    point = animal_crud.get_current_point(animal)
+    area_ids = area_index.get(db).containing(point.latitude, point.longitude)
+    return AreaCRUD(db).get_areas_by_ids(area_ids)
 
 
 @router.put("/{animalId}", response_model=Animal)
@@ -139,7 +229,8 @@ def update_animal(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=f"Точка с id {animal_data.chippingLocationId} уже является точкой чипирования животного с id {animalId}"
         )
-    return animal_crud.update_animal(
+    chipping_location_changed = animal.chippingLocationId != animal_data.chippingLocationId
+    animal = animal_crud.update_animal(
         animal=animal,
         weight=animal_data.weight,
         length=animal_data.length,
@@ -149,6 +240,9 @@ def update_animal(
         chippingLocationId=animal_data.chippingLocationId,
         lifeStatus=animal_data.lifeStatus
     )
+    if chipping_location_changed:
+        AreaRollupCRUD(db).invalidate_animal_track(animal.id, animal.chippingDateTime)
+    return animal
 
 
 @router.delete("/{animalId}", response_model=None)
@@ -214,6 +308,10 @@ def add_animal_location(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=f"Попытка добавить точку локации, в которой уже находится животное"
         )
+    if settings.VISIT_GROUP_COMMIT:
+        # пока посещение ждёт своей пачки, соединение с базой не занято
+        db.close()
+        return visit_batcher.add(animalId, pointId)
     animal_location = animal_crud.add_animal_location(
         animalId=animalId,
         locationPointId=pointId
@@ -221,6 +319,29 @@ def add_animal_location(
     return animal_location
 
 
+@router.get("/{animalId}/trajectory", response_model=Trajectory, responses=MSGPACK_RESPONSES,
+            dependencies=[Depends(Admission("search"))])
+def get_animal_trajectory(
+    animalId: int = Path(..., ge=1),
+    startDateTime: ISODateTime = None,
+    endDateTime: ISODateTime = None,
+    response_format: ResponseFormat = Depends(),
+    authorize: Authorize = Depends(Authorize()),
+    db: Session = Depends(get_db)
+):
+    '''
+    Пройденное расстояние, наибольшая скорость на участке между остановками и время остановок в точках и зонах
+    за период. Остановки - чипирование и посещения; последняя длится до конца периода
+    '''
+    trajectory = get_trajectories(db, [animalId], startDateTime, endDateTime).get(animalId)
+    if trajectory is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Животное с id {animalId} не найдено"
+        )
+    return response_format.response(trajectory)
+
+
 @router.put("/{animalId}/types", response_model=Animal)
 def update_animal_type(
     types: UpdateAnimalType,
@@ -305,13 +426,15 @@ def delete_animal_type(
     )
 
 
-@router.get("/{animalId}/locations", response_model=List[AnimalLocation])
+@router.get("/{animalId}/locations", response_model=List[AnimalLocation], responses=MSGPACK_RESPONSES,
+            dependencies=[Depends(Admission("search"))])
 def get_animal_locations(
     animalId: int = Path(..., ge=1),
     startDateTime: ISODateTime = None,
     endDateTime: ISODateTime = None,
     from_: int = Query(0, ge=0, alias="from"),
     size: int = Query(10, ge=1),
+    response_format: ResponseFormat = Depends(),
     authorize: Authorize = Depends(Authorize()),
     db: Session = Depends(get_db)
 ):
@@ -322,15 +445,14 @@ def get_animal_locations(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Животное с id {animalId} не найдено"
         )
-    locations = animal_crud.get_animal_locations(
+    rows = animal_crud.get_animal_locations_rows(
         animalId=animalId,
         startDateTime=startDateTime,
         endDateTime=endDateTime,
         from_=from_,
         size=size
     )
-
-    return locations
+    return response_format.response([animal_location_from_row(row) for row in rows], model=AnimalLocation)
 
 
 @router.post("/{animalId}/types/{typeId}", response_model=Animal, status_code=status.HTTP_201_CREATED)
@@ -422,10 +544,12 @@ def update_animal_location(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Нельзя обновлять точку локации на точку, совпадающую со следующей и/или с предыдущей точками"
         )
-    return animal_crud.update_animal_location(
+    location = animal_crud.update_animal_location(
         animalLocation=location,
         new_location_id=locationData.locationPointId
     )
+    AreaRollupCRUD(db).invalidate_animal_track(animalId, location.dateTimeOfVisitLocationPoint)
+    return location
 
 
 @router.delete("/{animalId}/locations/{visitedPointId}", response_model=None)
@@ -453,6 +577,7 @@ def delete_animal_location(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"У животного нет объекта с информацией о посещенной точке локации с visitedPointId"
         )
+    visit_date_time = visited_point.dateTimeOfVisitLocationPoint
     fist_location = animal_crud.get_first_animal_location(animalId)
     if fist_location and fist_location.id == visitedPointId:
         second_location = animal_crud.get_animal_location_by_offset(
@@ -460,6 +585,8 @@ def delete_animal_location(
         if second_location and second_location.locationPointId == animal.chippingLocationId:
             animal_crud.delete(second_location)
     animal_crud.delete(visited_point)
+    animal_crud.refresh_current_point(animalId)
+    AreaRollupCRUD(db).invalidate_animal_track(animalId, visit_date_time)
 
 
 
@@ -1,8 +1,10 @@
-from fastapi import APIRouter, Depends, HTTPException, Path, status
+from fastapi import APIRouter, Depends, Header, HTTPException, Path, Query, Response, status
+from app.core.etag import etag_matches, make_etag, not_modified
 from app.crud.crud_types import AnimalTypeCRUD
 from app.db.db import get_db
 from app.core.auth import Authorize
 from app.schemas.animals import AnimalType, AnimalTypeBase
+from app.schemas.types import Batch, IdList
 from app.models.user import User as UserModel
 from sqlalchemy.orm import Session
 
@@ -68,9 +70,23 @@ def delete_animal_type(
     animal_type_crud.delete(animal_type)
 
 
+@router.get("", response_model=Batch[AnimalType])
+def get_animal_types(
+    ids: IdList = Query(...),
+    authorize: Authorize = Depends(Authorize()),
+    db: Session = Depends(get_db)
+):
+    '''Несколько типов за один запрос; ненайденные id возвращаются в missing'''
+    Batch.check_size(ids)
+    animal_types = AnimalTypeCRUD(db).get_animal_types_by_ids(ids)
+    return Batch.split(ids, {animal_type.id: animal_type for animal_type in animal_types})
+
+
 @router.get("/{typeId}", response_model=AnimalType)
 def get_animal_type(
+    response: Response,
     typeId: int = Path(..., ge=1),
+    if_none_match: str | None = Header(default=None, include_in_schema=False),
     authorize: Authorize = Depends(Authorize()),
     db: Session = Depends(get_db)
 ):
@@ -78,4 +94,8 @@ def get_animal_type(
     if not animal_type:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                             detail="Тип животного не найден")
+    etag = make_etag("animaltype", animal_type.id, animal_type.version)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    response.headers["ETag"] = etag
     return animal_type
@@ -1,11 +1,22 @@
-from fastapi import APIRouter, Depends, HTTPException, Path, status
+from typing import List
+from fastapi import APIRouter, Depends, Header, HTTPException, Path, Query, Response, status
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from app.core.admission import Admission
 from app.core.areas import AreaValidator
+from app.core.config import settings
+from app.core.encoding import MSGPACK_RESPONSES, ResponseFormat
+from app.core.etag import etag_matches, make_etag, not_modified
+from app.core.geofence import geofence_broker, get_last_event_id
 from app.db.db import get_db
 from app.core.auth import Authorize
 from sqlalchemy.orm import Session
-from app.schemas.areas import Area, CreateArea, AreaAnalytics
+from app.core.jobs import JobLimitExceeded, analytics_jobs
+from app.schemas.areas import Area, CreateArea, AreaAnalytics, AreaAnalyticsItem, AnalyticsJob, \
+    AreaOccupancy, GeoJSONFeatureCollection, OccupancyBucket
 from app.crud.crud_area import AreaCRUD
-from app.schemas.types import ISO8601DatePattern
+from app.crud.crud_rollup import AreaRollupCRUD
+from app.schemas.types import Batch, IdList, ISO8601DatePattern
 
 router = APIRouter(tags=["Зоны"], prefix="/areas")
 
@@ -39,18 +50,110 @@ def create_area(
     )
 
 
+@router.post("/import", response_model=List[Area], status_code=status.HTTP_201_CREATED)
+def import_areas(
+        collection: GeoJSONFeatureCollection,
+        authorize: Authorize = Depends(Authorize(is_admin=True)),
+        db: Session = Depends(get_db)
+):
+    '''
+    Импорт зон из GeoJSON FeatureCollection: добавляются либо все зоны, либо ни одной.
+    Ошибки возвращаются списком с номерами объектов
+    '''
+    if len(collection.features) > settings.AREA_IMPORT_MAX_FEATURES:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"Можно импортировать не больше {settings.AREA_IMPORT_MAX_FEATURES} зон")
+    areas, errors = {}, {}
+    for index, feature in enumerate(collection.features):
+        try:
+            areas[index] = feature.to_area()
+        except ValueError as error:
+            errors[index] = str(error)
+    area_crud = AreaCRUD(db)
+    area_crud.lock_import()
+    errors.update(area_crud.check_import(areas))
+    if errors:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=[{"feature": index, "detail": errors[index]} for index in sorted(errors)])
+    area_list = [areas[index] for index in sorted(areas)]
+    area_ids = area_crud.create_areas(area_list)
+    return [Area(id=area_id, name=area.name, areaPoints=area.areaPoints) for area_id, area in zip(area_ids, area_list)]
+
+
+@router.get("/analytics", response_model=List[AreaAnalyticsItem], responses=MSGPACK_RESPONSES,
+            dependencies=[Depends(Admission("analytics"))])
+def get_areas_analytics(
+        startDate: ISO8601DatePattern,
+        endDate: ISO8601DatePattern,
+        ids: IdList = None,
+        response_format: ResponseFormat = Depends(),
+        authorize: Authorize = Depends(Authorize()),
+        db: Session = Depends(get_db)
+):
+    '''Аналитика сразу по нескольким зонам; без ids - по всем зонам'''
+    area_crud = AreaCRUD(db)
+    area_ids = area_crud.get_area_ids()
+    if ids is not None:
+        missing_ids = set(ids) - set(area_ids)
+        if missing_ids:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                                detail=f"Зона с id {min(missing_ids)} не найдена")
+        area_ids = ids
+    analytics = area_crud.get_areas_analytics(area_ids=area_ids, start_date=startDate, end_date=endDate)
+    return response_format.response(analytics, model=AreaAnalyticsItem)
+
+
+async def open_events_stream(db: Session, area_ids: List[int], after_id: int | None) -> StreamingResponse:
+    '''Поток событий зон; без after_id - только события, появившиеся после подключения'''
+    def prepare():
+        missing_ids = AreaCRUD(db).get_missing_area_ids(area_ids)
+        # поток открыт долго: соединение с базой не должно оставаться занятым до его конца
+        db.close()
+        return missing_ids, get_last_event_id() if after_id is None else after_id
+
+    missing_ids, after_id = await run_in_threadpool(prepare)
+    if missing_ids:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail=f"Зона с id {missing_ids[0]} не найдена")
+    geofence_broker.check_capacity()
+    return StreamingResponse(geofence_broker.stream(area_ids, after_id), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@router.get("/events", response_class=StreamingResponse)
+async def stream_areas_events(
+        ids: IdList = Query(...),
+        lastEventId: int = Query(None, ge=0),
+        last_event_id: int | None = Header(default=None, alias="Last-Event-ID", include_in_schema=False),
+        authorize: Authorize = Depends(Authorize()),
+        db: Session = Depends(get_db)
+):
+    '''
+    Входы животных в зоны ids и выходы из них в формате Server-Sent Events. lastEventId или заголовок
+    Last-Event-ID при переподключении - сначала отдаются сохранённые события после него
+    '''
+    Batch.check_size(ids)
+    return await open_events_stream(db, ids, last_event_id if last_event_id is not None else lastEventId)
+
+
 @router.get("/{area_id}", response_model=Area)
 def get_area(
+        response: Response,
         area_id: int = Path(..., ge=1),
+        if_none_match: str | None = Header(default=None, include_in_schema=False),
         authorize: Authorize = Depends(Authorize()),
         db: Session = Depends(get_db)
 ):
     area_crud = AreaCRUD(db)
-    area = area_crud.get_area(area_id=area_id)
-    if area is None:
+    version = area_crud.get_area_version(area_id)
+    if version is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                             detail="Зона не найдена")
-    return area
+    etag = make_etag("area", area_id, *version)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    response.headers["ETag"] = etag
+    return area_crud.get_area(area_id=area_id)
 
 
 @router.put("/{area_id}", response_model=Area)
@@ -80,6 +183,7 @@ def update_area(
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
                             detail="Зона с такими точками уже существует")
     area = area_crud.update_area(db_area=area, name=area_data.name, points=area_data.areaPoints)
+    AreaRollupCRUD(db).invalidate_area(area.id)
     return Area(
         id=area.id,
         name=area.name,
@@ -101,12 +205,13 @@ def delete_area(
     area_crud.delete(area)
 
 
-@router.get("/{area_id}/analytics", response_model=AreaAnalytics)
+@router.get("/{area_id}/analytics", response_model=AreaAnalytics, responses=MSGPACK_RESPONSES,
+            dependencies=[Depends(Admission("analytics"))])
 def get_area_analytics(
         startDate: ISO8601DatePattern,
         endDate: ISO8601DatePattern,
         area_id: int = Path(..., ge=1),
-
+        response_format: ResponseFormat = Depends(),
         authorize: Authorize = Depends(Authorize()),
         db: Session = Depends(get_db)
 ):
@@ -115,30 +220,69 @@ def get_area_analytics(
     if area is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                             detail="Зона не найдена")
-    correct_points = area_crud.get_all_points_contained_in_area(area_id=area_id, start_date=startDate, end_date=endDate)
-    analytics = area_crud.get_area_analytics(
-        correct_points=correct_points,
-        start_date=startDate,
-        end_date=endDate
-    )
-    total_quantity_animals = area_crud.get_area_analytics_animals_count(
-        start_date=startDate,
-        end_date=endDate,
-        correct_points=correct_points
-    )
-    total_animals_arrived = area_crud.get_area_analytics_animals_arrived(
-            correct_points=correct_points,
-            start_date=startDate,
-            end_date=endDate
-        )
-    return AreaAnalytics(
-        animalsAnalytics=analytics,
-        totalQuantityAnimals=total_quantity_animals,
-        totalAnimalsArrived= total_animals_arrived,
-        totalAnimalsGone=area_crud.get_area_analytics_animals_gone(
-            correct_points=correct_points,
+    analytics = area_crud.get_area_analytics(area_id=area_id, start_date=startDate, end_date=endDate)
+    return response_format.response(analytics)
+
+
+@router.get("/{area_id}/occupancy", response_model=List[AreaOccupancy], responses=MSGPACK_RESPONSES,
+            dependencies=[Depends(Admission("analytics"))])
+def get_area_occupancy(
+        startDate: ISO8601DatePattern,
+        endDate: ISO8601DatePattern,
+        area_id: int = Path(..., ge=1),
+        bucket: OccupancyBucket = OccupancyBucket.DAY,
+        response_format: ResponseFormat = Depends(),
+        authorize: Authorize = Depends(Authorize()),
+        db: Session = Depends(get_db)
+):
+    '''Сколько животных было в зоне, прибыло в неё и ушло из неё за каждый час или день периода'''
+    if startDate > endDate:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="startDate должна быть не позже endDate")
+    buckets = ((endDate - startDate).days + 1) * (24 if bucket == OccupancyBucket.HOUR else 1)
+    if buckets > settings.OCCUPANCY_MAX_BUCKETS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"Можно запросить не больше {settings.OCCUPANCY_MAX_BUCKETS} интервалов")
+    area_crud = AreaCRUD(db)
+    if area_crud.get_area(area_id=area_id) is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail="Зона не найдена")
+    occupancy = area_crud.get_area_occupancy(area_id=area_id, start_date=startDate, end_date=endDate, bucket=bucket)
+    return response_format.response(occupancy, model=AreaOccupancy)
+
+
+@router.get("/{area_id}/events", response_class=StreamingResponse)
+async def stream_area_events(
+        area_id: int = Path(..., ge=1),
+        lastEventId: int = Query(None, ge=0),
+        last_event_id: int | None = Header(default=None, alias="Last-Event-ID", include_in_schema=False),
+        authorize: Authorize = Depends(Authorize()),
+        db: Session = Depends(get_db)
+):
+    '''Входы животных в зону и выходы из неё в формате Server-Sent Events'''
+    return await open_events_stream(db, [area_id], last_event_id if last_event_id is not None else lastEventId)
+
+
+@router.post("/{area_id}/analytics/jobs", response_model=AnalyticsJob, status_code=status.HTTP_202_ACCEPTED,
+             dependencies=[Depends(Admission("analytics"))])
+def create_area_analytics_job(
+        startDate: ISO8601DatePattern,
+        endDate: ISO8601DatePattern,
+        area_id: int = Path(..., ge=1),
+        authorize: Authorize = Depends(Authorize()),
+        db: Session = Depends(get_db)
+):
+    area = AreaCRUD(db).get_area(area_id=area_id)
+    if area is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail="Зона не найдена")
+    try:
+        return analytics_jobs.submit(
+            owner_id=authorize.current_user_id,
+            area_id=area_id,
             start_date=startDate,
             end_date=endDate
         )
-
-    )
+    except JobLimitExceeded:
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                            detail="Превышено количество одновременно выполняемых расчётов аналитики")
@@ -0,0 +1,25 @@
+from fastapi import APIRouter, Depends
+from fastapi.responses import StreamingResponse
+
+from app.core.admission import Admission
+from app.core.auth import Authorize
+from app.core.export import stream_zip_snapshot
+from app.schemas.types import ISODateTime
+
+router = APIRouter(tags=["Выгрузка"], prefix="/export")
+
+
+@router.get("", response_class=StreamingResponse, dependencies=[Depends(Admission("export"))])
+def export_snapshot(
+        since: ISODateTime = None,
+        authorize: Authorize = Depends(Authorize(is_admin=True))
+):
+    '''
+    Снимок данных zip-архивом из файлов Parquet и manifest.json. С since посещения выгружаются
+    только не раньше отметки; для следующей выгрузки берётся watermark из манифеста
+    '''
+    return StreamingResponse(
+        stream_zip_snapshot(since=since),
+        media_type="application/zip",
+        headers={"Content-Disposition": 'attachment; filename="snapshot.zip"'}
+    )
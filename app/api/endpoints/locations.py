@@ -1,10 +1,18 @@
-from fastapi import APIRouter, Depends, HTTPException, Path, status
+from typing import List
+from fastapi import APIRouter, Depends, Header, HTTPException, Path, Query, Response, status
 from fastapi.responses import HTMLResponse
 from app.core.geohash import Geohash
+from app.core.admission import Admission
+from app.core.config import settings
+from app.core.etag import etag_matches, make_etag, not_modified
+from app.core.indexes import area_index, point_index
+from app.crud.crud_area import AreaCRUD
 from app.crud.crud_point import PointCRUD
 from app.db.db import get_db
 from app.core.auth import Authorize
-from app.schemas.locations import Location, LocationBase
+from app.schemas.areas import Area
+from app.schemas.locations import Location, LocationBase, NearestLocation, Region
+from app.schemas.types import Batch, IdList
 from sqlalchemy.orm import Session
 router = APIRouter(tags=["Локации животных"], prefix="/locations")
 
@@ -27,14 +35,23 @@ def create_location(
 
 @router.get("")
 def get_point_id_by_coordinates(
-    coordinates: LocationBase = Depends(),
+    latitude: float = Query(None, ge=-90, le=90),
+    longitude: float = Query(None, ge=-180, le=180),
+    ids: IdList = None,
     authorize: Authorize = Depends(Authorize()),
     db: Session = Depends(get_db)
 ):
-
+    '''id точки по координатам; с ids - несколько точек за один запрос, ненайденные id возвращаются в missing'''
+    if ids is not None:
+        Batch.check_size(ids)
+        points = PointCRUD(db).get_points_by_ids(ids)
+        return Batch[Location](**Batch.split(ids, {point.id: point for point in points}))
+    if latitude is None or longitude is None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="Нужно указать либо ids, либо latitude и longitude")
     point = PointCRUD(db).get_point_by_coordinates(
-        latitude=coordinates.latitude,
-        longitude=coordinates.longitude
+        latitude=latitude,
+        longitude=longitude
     )
     if not point:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
@@ -65,9 +82,45 @@ def get_geohashv3(
     return Geohash(latitude=coordinates.latitude, longitude=coordinates.longitude).encode_v3()
 
 
+@router.get("/nearest", response_model=List[NearestLocation], dependencies=[Depends(Admission("spatial"))])
+def get_nearest_locations(
+    coordinates: LocationBase = Depends(),
+    k: int = Query(1, ge=1, le=settings.NEAREST_MAX_K),
+    maxDistance: float = Query(None, gt=0),
+    authorize: Authorize = Depends(Authorize()),
+    db: Session = Depends(get_db)
+):
+    '''Ближайшие точки по расстоянию на сфере; maxDistance - в метрах'''
+    nearest = point_index.get(db).nearest(
+        latitude=coordinates.latitude,
+        longitude=coordinates.longitude,
+        k=k,
+        max_distance=maxDistance
+    )
+    return [
+        NearestLocation(id=point_id, latitude=latitude, longitude=longitude, distance=distance)
+        for point_id, latitude, longitude, distance in nearest
+    ]
+
+
+@router.get("/within", response_model=List[Location], dependencies=[Depends(Admission("spatial"))])
+def get_locations_within(
+    region: Region = Depends(),
+    from_: int = Query(0, ge=0, alias="from"),
+    size: int = Query(settings.WITHIN_MAX_RESULTS, gt=0, le=settings.WITHIN_MAX_RESULTS),
+    authorize: Authorize = Depends(Authorize()),
+    db: Session = Depends(get_db)
+):
+    '''Точки в прямоугольнике или круге, по возрастанию id'''
+    point_ids = region.find_point_ids(point_index.get(db))
+    return PointCRUD(db).get_points_by_ids(point_ids[from_:from_ + size])
+
+
 @router.get("/{pointId}", response_model=Location)
 def get_locations(
+    response: Response,
     pointId: int = Path(..., ge=1),
+    if_none_match: str | None = Header(default=None, include_in_schema=False),
     authorize: Authorize = Depends(Authorize()),
     db: Session = Depends(get_db)
 ):
@@ -75,9 +128,28 @@ def get_locations(
     if not point:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                             detail="Точка не найдена")
+    etag = make_etag("point", point.id, point.version)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    response.headers["ETag"] = etag
     return point
 
 
+@router.get("/{pointId}/areas", response_model=List[Area], dependencies=[Depends(Admission("spatial"))])
+def get_location_areas(
+    pointId: int = Path(..., ge=1),
+    authorize: Authorize = Depends(Authorize()),
+    db: Session = Depends(get_db)
+):
+    '''Зоны, содержащие точку'''
+    point = PointCRUD(db).get_point_by_id(pointId)
+    if not point:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail="Точка не найдена")
+    area_ids = area_index.get(db).containing(point.latitude, point.longitude)
+    return AreaCRUD(db).get_areas_by_ids(area_ids)
+
+
 @router.put("/{pointId}", response_model=Location)
 def update_location(
     location_data: LocationBase,
@@ -0,0 +1,138 @@
+import asyncio
+import math
+import time
+from collections import deque
+
+from fastapi import Depends, HTTPException, Request, status
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.db.db import client_key, get_db
+from app.db.deadline import cancel_statement, set_deadline
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+
+    def take(self, now: float) -> float:
+        '''Забирает токен; возвращает 0 или через сколько секунд токен появится'''
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class AdmissionGroup:
+    '''
+    Ограничения группы маршрутов: частота запросов одного клиента и число одновременно выполняемых запросов.
+    Ожидающие запросы не занимают потоки обработчиков; все методы вызываются из цикла событий
+    '''
+
+    def __init__(self, name: str, concurrency: int, queue: int, timeout: float, rate: float, burst: float,
+                 deadline: float = None, max_clients: int = 100000):
+        self.name = name
+        self.deadline = deadline
+        self.concurrency = concurrency
+        self.queue = queue
+        self.timeout = timeout
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self.active = 0
+        self._waiters: deque = deque()
+        self._buckets: dict[int, TokenBucket] = {}
+
+    def check_rate(self, key: int) -> None:
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= self.max_clients:
+                # полностью восстановившиеся корзины ничем не отличаются от новых
+                self._buckets = {
+                    key: bucket for key, bucket in self._buckets.items()
+                    if bucket.tokens + (now - bucket.updated_at) * bucket.rate < bucket.burst
+                }
+            bucket = self._buckets[key] = TokenBucket(self.rate, self.burst)
+        retry_after = bucket.take(now)
+        if retry_after:
+            raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                                detail="Слишком много запросов",
+                                headers={"Retry-After": str(math.ceil(retry_after))})
+
+    async def acquire(self) -> None:
+        if self.active < self.concurrency and not self._waiters:
+            self.active += 1
+            return
+        if len(self._waiters) >= self.queue:
+            self._reject()
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        try:
+            await asyncio.wait_for(future, self.timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as error:
+            if future.done() and not future.cancelled():
+                # место уже было передано этому запросу
+                self.release()
+            elif future in self._waiters:
+                self._waiters.remove(future)
+            if isinstance(error, asyncio.TimeoutError):
+                self._reject()
+            raise
+
+    def release(self) -> None:
+        while self._waiters:
+            future = self._waiters.popleft()
+            if not future.done():
+                # место передаётся следующему в очереди, счётчик не меняется
+                future.set_result(None)
+                return
+        self.active -= 1
+
+    def _reject(self):
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail="Сервис перегружен, повторите запрос позже",
+                            headers={"Retry-After": str(math.ceil(self.timeout))})
+
+
+admission_groups = {name: AdmissionGroup(name, **limits) for name, limits in settings.ADMISSION_LIMITS.items()}
+
+
+class Admission:
+    '''
+    Зависимость маршрута: допуск запроса к выполнению по ограничениям группы. Запросы к базе допущенного запроса
+    прерываются, если клиент отключился или истёк срок выполнения группы
+    '''
+
+    def __init__(self, group: str):
+        self.group = admission_groups[group]
+
+    async def __call__(self, request: Request, db: Session = Depends(get_db)):
+        self.group.check_rate(client_key(request))
+        await self.group.acquire()
+        deadline = None
+        if self.group.deadline is not None:
+            deadline = time.monotonic() + self.group.deadline
+            set_deadline(db, deadline)
+        watchdog = asyncio.create_task(self._watch(request, db, deadline))
+        try:
+            yield
+        finally:
+            watchdog.cancel()
+            self.group.release()
+
+    async def _watch(self, request: Request, db: Session, deadline: float | None) -> None:
+        while deadline is None or time.monotonic() < deadline:
+            delay = settings.DISCONNECT_POLL_INTERVAL
+            if deadline is not None:
+                delay = min(delay, deadline - time.monotonic())
+            await asyncio.sleep(max(delay, 0))
+            if await request.is_disconnected():
+                break
+        # отдельный пул потоков: потоки обработчиков при перегрузке могут быть заняты
+        await asyncio.get_running_loop().run_in_executor(None, cancel_statement, db)
@@ -0,0 +1,167 @@
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Tuple
+
+from app.core.areas import point_in_polygon, polygon_bounds
+from app.core.spatial import AreaIndex
+
+# события пребывания в зоне: животное было в зоне на начало периода или чипировано в ней, прибыло, ушло
+STAY_PRESENT, STAY_ARRIVED, STAY_GONE = 0, 1, 2
+
+
+class AreaPresenceScanner:
+    '''Определяет присутствие, прибытие и уход животных из зон за один проход по их перемещениям'''
+
+    def __init__(self, polygons: Dict[int, List[Tuple[float, float]]]):
+        self.index = AreaIndex().build(polygons)
+        self._containing = {}
+
+    def containing_areas(self, latitude: float, longitude: float) -> frozenset:
+        key = (latitude, longitude)
+        areas = self._containing.get(key)
+        if areas is None:
+            areas = frozenset(self.index.containing(latitude, longitude))
+            self._containing[key] = areas
+        return areas
+
+    def scan(self, positions: dict, movements: Iterable) -> Dict[int, Dict[int, List[bool]]]:
+        '''
+        positions - координаты животных на начало периода, по ходу прохода заменяются последними;
+        movements - перемещения (animal_id, latitude, longitude) в хронологическом порядке для каждого животного.
+        Возвращает для каждой зоны словарь animal_id -> [прибыло, ушло]
+        '''
+        presence = defaultdict(dict)
+        for animal_id, (latitude, longitude) in positions.items():
+            for area_id in self.containing_areas(latitude, longitude):
+                presence[area_id][animal_id] = [False, False]
+        for animal_id, latitude, longitude in movements:
+            current = self.containing_areas(latitude, longitude)
+            previous_position = positions.get(animal_id)
+            previous = self.containing_areas(*previous_position) if previous_position else None
+            for area_id in current:
+                flags = presence[area_id].setdefault(animal_id, [False, False])
+                if previous is not None and area_id not in previous:
+                    flags[0] = True
+            if previous:
+                for area_id in previous - current:
+                    presence[area_id].setdefault(animal_id, [False, False])[1] = True
+            positions[animal_id] = (latitude, longitude)
+        return presence
+
+
+def merge_presence(target: dict, source: dict) -> dict:
+    for area_id, animals in source.items():
+        area_presence = target.setdefault(area_id, {})
+        for animal_id, (arrived, gone) in animals.items():
+            flags = area_presence.setdefault(animal_id, [False, False])
+            flags[0] = flags[0] or arrived
+            flags[1] = flags[1] or gone
+    return target
+
+
+def build_area_analytics(presence: Dict[int, List[bool]], animal_types: Iterable) -> dict:
+    '''animal_types - строки (animal_id, type_id, type_name) для животных из presence'''
+    types = {}
+    for animal_id, type_id, type_name in animal_types:
+        arrived, gone = presence[animal_id]
+        item = types.setdefault(type_id, {
+            "animalType": type_name,
+            "animalTypeId": type_id,
+            "quantityAnimals": 0,
+            "animalsArrived": 0,
+            "animalsGone": 0,
+        })
+        item["quantityAnimals"] += 1
+        item["animalsArrived"] += arrived
+        item["animalsGone"] += gone
+    return {
+        "totalQuantityAnimals": len(presence),
+        "totalAnimalsArrived": sum(arrived for arrived, _ in presence.values()),
+        "totalAnimalsGone": sum(gone for _, gone in presence.values()),
+        "animalsAnalytics": [types[type_id] for type_id in sorted(types)],
+    }
+
+
+def area_stay_events(polygon: List[Tuple[float, float]], start: datetime, positions: dict,
+                     movements: Iterable) -> List[Tuple[datetime, int, int]]:
+    '''
+    События (время, animal_id, вид) входа в зону и выхода из неё, отсортированные по времени.
+    positions - координаты животных на начало периода start; movements - перемещения
+    (animal_id, date_time, latitude, longitude) в хронологическом порядке для каждого животного
+    '''
+    min_latitude, min_longitude, max_latitude, max_longitude = polygon_bounds(polygon)
+    containing = {}
+
+    def inside(latitude: float, longitude: float) -> bool:
+        key = (latitude, longitude)
+        if key not in containing:
+            containing[key] = (min_latitude <= latitude <= max_latitude and min_longitude <= longitude <= max_longitude
+                               and point_in_polygon(latitude, longitude, polygon))
+        return containing[key]
+
+    events = []
+    states = {}
+    for animal_id, (latitude, longitude) in positions.items():
+        states[animal_id] = inside(latitude, longitude)
+        if states[animal_id]:
+            events.append((start, animal_id, STAY_PRESENT))
+    for animal_id, date_time, latitude, longitude in movements:
+        previous = states.get(animal_id)
+        current = states[animal_id] = inside(latitude, longitude)
+        if current and previous is None:
+            events.append((date_time, animal_id, STAY_PRESENT))
+        elif current and not previous:
+            events.append((date_time, animal_id, STAY_ARRIVED))
+        elif previous and not current:
+            events.append((date_time, animal_id, STAY_GONE))
+    events.sort(key=lambda event: event[0])
+    return events
+
+
+def occupancy_series(events: List[Tuple[datetime, int, int]], boundaries: List[datetime]) -> List[dict]:
+    '''
+    Заполненность зоны по интервалам [boundaries[k], boundaries[k + 1]) одним проходом по событиям:
+    сколько разных животных было в зоне, прибыло в неё и ушло из неё за интервал
+    '''
+    series = []
+    inside = 0
+    last_gone = {}
+    arrived_in, gone_in = {}, {}
+    position = 0
+    for bucket, (bucket_start, bucket_end) in enumerate(zip(boundaries, boundaries[1:])):
+        quantity, arrived, gone = inside, 0, 0
+        while position < len(events) and events[position][0] < bucket_end:
+            date_time, animal_id, kind = events[position]
+            position += 1
+            if kind == STAY_GONE:
+                inside -= 1
+                last_gone[animal_id] = date_time
+                if gone_in.get(animal_id) != bucket:
+                    gone_in[animal_id] = bucket
+                    gone += 1
+                continue
+            inside += 1
+            # животное, ушедшее в этом интервале, уже посчитано: было в зоне на его начало или вошло раньше
+            if animal_id not in last_gone or last_gone[animal_id] < bucket_start:
+                quantity += 1
+            if kind == STAY_ARRIVED and arrived_in.get(animal_id) != bucket:
+                arrived_in[animal_id] = bucket
+                arrived += 1
+        series.append({"start": bucket_start, "quantityAnimals": quantity, "animalsArrived": arrived,
+                       "animalsGone": gone})
+    return series
+
+
+def days_between(start_date: date, end_date: date) -> List[date]:
+    return [start_date + timedelta(days=i) for i in range((end_date - start_date).days + 1)]
+
+
+def group_consecutive_days(days: List[date]) -> List[Tuple[date, date]]:
+    '''Объединяет отсортированные дни в непрерывные отрезки (первый день, последний день)'''
+    segments = []
+    for day in days:
+        if segments and segments[-1][1] + timedelta(days=1) == day:
+            segments[-1] = (segments[-1][0], day)
+        else:
+            segments.append((day, day))
+    return segments
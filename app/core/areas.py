@@ -1,4 +1,9 @@
-from typing import List
+import hashlib
+from typing import List, Tuple
+
+import numpy as np
+
+from app.core.geometry import all_collinear, has_duplicates, has_spikes, ring_coordinates, ring_self_intersects
 from app.schemas.locations import LocationBase
 
 
@@ -11,70 +16,147 @@ class AreaValidator:
         if len(self.points) < 3:
             return False
 
-        # Check if all points lie on the same line
-        x_coords = [point.longitude for point in self.points]
-        y_coords = [point.latitude for point in self.points]
-        if len(set(x_coords)) == 1 or len(set(y_coords)) == 1:
+        x, y = ring_coordinates(self.points)
+        # Check if all points lie on the same line or the polygon folds back onto itself
+        if all_collinear(x, y) or has_spikes(x, y):
             return False
 
-        # Check if the polygon self-intersects
-        for i in range(len(self.points)):
-            for j in range(i + 1, len(self.points)):
-                if i == 0 and j == len(self.points) - 1:
-                    continue
-                elif i == j - 1:
-                    continue
-                elif j == i - 1:
-                    continue
-                elif j == len(self.points) - 1 and i == 0:
-                    continue
-
-                if self.line_intersects(self.points[i], self.points[(i + 1) % len(self.points)],
-                                        self.points[j], self.points[(j + 1) % len(self.points)]):
-                    return False
-
-        # Check if the polygon has duplicate points
-        points = [(point.latitude, point.longitude) for point in self.points]
-        if len(set(points)) != len(points):
+        # The lexicographic vertex order is both the duplicate check and the sweep-line event queue
+        order = np.lexsort((y, x))
+        if has_duplicates(x, y, order):
             return False
 
+        # Check if the polygon self-intersects
+        return not ring_self_intersects(x, y, order)
+
+
+def polygon_bounds(polygon: List[Tuple[float, float]]) -> Tuple[float, float, float, float]:
+    '''Возвращает ограничивающий прямоугольник (min_lat, min_lon, max_lat, max_lon)'''
+    latitudes = [latitude for latitude, _ in polygon]
+    longitudes = [longitude for _, longitude in polygon]
+    return min(latitudes), min(longitudes), max(latitudes), max(longitudes)
+
+
+def point_in_polygon(latitude: float, longitude: float, polygon: List[Tuple[float, float]],
+                     on_boundary: bool = True) -> bool:
+    '''Проверяет, лежит ли точка внутри многоугольника; on_boundary - результат для точек на границе'''
+    inside = False
+    count = len(polygon)
+    for i in range(count):
+        lat1, lon1 = polygon[i]
+        lat2, lon2 = polygon[(i + 1) % count]
+        cross = (lon2 - lon1) * (latitude - lat1) - (lat2 - lat1) * (longitude - lon1)
+        if cross == 0 and min(lon1, lon2) <= longitude <= max(lon1, lon2) \
+                and min(lat1, lat2) <= latitude <= max(lat1, lat2):
+            return on_boundary
+        if (lat1 > latitude) != (lat2 > latitude):
+            edge_longitude = lon1 + (latitude - lat1) * (lon2 - lon1) / (lat2 - lat1)
+            if longitude < edge_longitude:
+                inside = not inside
+    return inside
+
+
+def interior_point(polygon: List[Tuple[float, float]]) -> Tuple[float, float]:
+    '''Точка строго внутри простого многоугольника'''
+    count = len(polygon)
+    # лексикографически наименьшая вершина всегда выпуклая
+    i = min(range(count), key=polygon.__getitem__)
+    a, v, b = polygon[i - 1], polygon[i], polygon[(i + 1) % count]
+
+    def side(p, q, r):
+        return (q[1] - p[1]) * (r[0] - p[0]) - (q[0] - p[0]) * (r[1] - p[1])
+
+    orientation = side(a, v, b)
+    inside = [
+        point for k, point in enumerate(polygon)
+        if k not in (i, (i - 1) % count, (i + 1) % count)
+        and side(a, v, point) * orientation >= 0 and side(v, b, point) * orientation >= 0
+        and side(b, a, point) * orientation >= 0
+    ]
+    if not inside:
+        return (a[0] + v[0] + b[0]) / 3, (a[1] + v[1] + b[1]) / 3
+    # вершина внутри треугольника, ближайшая к v: отрезок от v до неё проходит внутри многоугольника
+    nearest = max(inside, key=lambda point: abs(side(b, a, point)))
+    return (v[0] + nearest[0]) / 2, (v[1] + nearest[1]) / 2
+
+
+def _edges(polygon: List[Tuple[float, float]]) -> Tuple[np.ndarray, np.ndarray]:
+    start = np.asarray(polygon, dtype=float)
+    return start, np.roll(start, -1, axis=0)
+
+
+def _boundary_enters(polygon: List[Tuple[float, float]], other: List[Tuple[float, float]]) -> bool:
+    '''
+    Заходит ли граница polygon внутрь other. Рёбра разбиваются вершинами other, лежащими на них:
+    без собственных пересечений рёбер каждый кусок целиком внутри, снаружи или на границе other
+    '''
+    if any(point_in_polygon(latitude, longitude, other, on_boundary=False) for latitude, longitude in polygon):
         return True
-
-    def line_intersects(self, p1, q1, p2, q2):
-        def orientation(p, q, r):
-            val = (q.latitude - p.latitude) * (r.longitude - q.longitude) - \
-                  (q.longitude - p.longitude) * (r.latitude - q.latitude)
-            if val == 0:
-                return 0
-            elif val > 0:
-                return 1
-            else:
-                return 2
-
-        o1 = orientation(p1, q1, p2)
-        o2 = orientation(p1, q1, q2)
-        o3 = orientation(p2, q2, p1)
-        o4 = orientation(p2, q2, q1)
-
-        if (o1 != o2 and o3 != o4):
-            return True
-
-        if (o1 == 0 and self.on_segment(p1, p2, q1)):
-            return True
-
-        if (o2 == 0 and self.on_segment(p1, q2, q1)):
-            return True
-
-        if (o3 == 0 and self.on_segment(p2, p1, q2)):
-            return True
-
-        if (o4 == 0 and self.on_segment(p2, q1, q2)):
-            return True
-
-        return False
-
-    def on_segment(self, p, q, r):
-        if (q.longitude <= max(p.longitude, r.longitude) and q.longitude >= min(p.longitude, r.longitude) and
-                q.latitude <= max(p.latitude, r.latitude) and q.latitude >= min(p.latitude, r.latitude)):
-            return True
-        return False
\ No newline at end of file
+    start, end = _edges(polygon)
+    vertices = np.asarray(other, dtype=float)
+    direction = end - start
+    offset = vertices[None, :, :] - start[:, None, :]
+    cross = direction[:, None, 0] * offset[:, :, 1] - direction[:, None, 1] * offset[:, :, 0]
+    length = (direction ** 2).sum(axis=1)
+    t = (offset * direction[:, None, :]).sum(axis=2) / length[:, None]
+    on_edge = (cross == 0) & (t > 0) & (t < 1)
+    for edge in range(len(polygon)):
+        cuts = np.concatenate(([0.0], np.sort(t[edge][on_edge[edge]]), [1.0]))
+        middles = (cuts[:-1] + cuts[1:]) / 2
+        for middle in middles.tolist():
+            latitude, longitude = start[edge] + direction[edge] * middle
+            if point_in_polygon(latitude, longitude, other, on_boundary=False):
+                return True
+    return False
+
+
+def polygons_overlap(first: List[Tuple[float, float]], second: List[Tuple[float, float]]) -> bool:
+    '''Пересекаются ли внутренние области простых многоугольников; касание границами пересечением не считается'''
+    first_start, first_end = _edges(first)
+    second_start, second_end = _edges(second)
+
+    def orientation(a, b, c):
+        return np.sign((b[..., 0] - a[..., 0]) * (c[..., 1] - a[..., 1]) - (b[..., 1] - a[..., 1]) * (c[..., 0] - a[..., 0]))
+
+    a, b = first_start[:, None, :], first_end[:, None, :]
+    c, d = second_start[None, :, :], second_end[None, :, :]
+    o1, o2 = orientation(a, b, c), orientation(a, b, d)
+    o3, o4 = orientation(c, d, a), orientation(c, d, b)
+    if np.any((o1 * o2 < 0) & (o3 * o4 < 0)):
+        return True
+    if _boundary_enters(first, second) or _boundary_enters(second, first):
+        return True
+    # границы не заходят друг в друга: области либо не пересекаются, либо совпадают
+    return point_in_polygon(*interior_point(first), second, on_boundary=False)
+
+
+def least_rotation(sequence: list) -> int:
+    '''Алгоритм Бута: индекс начала лексикографически наименьшего циклического сдвига'''
+    doubled = sequence + sequence
+    failure = [-1] * len(doubled)
+    start = 0
+    for j in range(1, len(doubled)):
+        item = doubled[j]
+        i = failure[j - start - 1]
+        while i != -1 and item != doubled[start + i + 1]:
+            if item < doubled[start + i + 1]:
+                start = j - i - 1
+            i = failure[i]
+        if item != doubled[start + i + 1]:
+            if item < doubled[start]:
+                start = j
+            failure[j - start] = -1
+        else:
+            failure[j - start] = i + 1
+    return start
+
+
+def area_fingerprint(points: List) -> str:
+    '''Хэш кольца вершин зоны, не зависящий от начальной вершины и направления обхода'''
+    ring = [(point.latitude + 0.0, point.longitude + 0.0) for point in points]
+    candidates = []
+    for sequence in (ring, ring[::-1]):
+        start = least_rotation(sequence)
+        candidates.append(sequence[start:] + sequence[:start])
+    canonical = min(candidates)
+    return hashlib.sha256(repr(canonical).encode()).hexdigest()
@@ -0,0 +1,224 @@
+import logging
+import select
+import threading
+import uuid
+from collections import OrderedDict
+from itertools import chain
+from typing import Callable, Dict, List
+
+import psycopg2
+from sqlalchemy import event, func, inspect
+from sqlalchemy import select as sql_select
+from sqlalchemy.orm import Session, make_transient_to_detached
+
+from app.core.config import settings
+from app.db.session import SessionLocal, engine
+from app.models.animals import AnimalType
+from app.models.areas import Area, AreaPoint
+from app.models.points import Point
+from app.models.user import User
+
+logger = logging.getLogger(__name__)
+
+
+class EntityCache:
+    '''
+    LRU-кэш строк таблицы по id и дополнительным уникальным ключам. Хранятся значения колонок,
+    объект присоединяется к сессии без запроса к базе
+    '''
+
+    def __init__(self, model, max_size: int, keys: tuple = ()):
+        self.model = model
+        self.max_size = max_size
+        self.columns = [attribute.key for attribute in inspect(model).column_attrs]
+        self._rows: OrderedDict = OrderedDict()
+        self._keys: Dict[str, dict] = {key: {} for key in keys}
+        self._lock = threading.Lock()
+        # счётчик инвалидаций: строка, прочитанная до инвалидации, в кэш не попадает
+        self._generation = 0
+
+    def get(self, db: Session, id: int, loader: Callable):
+        with self._lock:
+            values = self._rows.get(id)
+            if values is not None:
+                self._rows.move_to_end(id)
+            generation = self._generation
+        if values is None:
+            return self._load(db, loader, generation)
+        return self._attach(db, values)
+
+    def get_by(self, db: Session, key: str, value, loader: Callable):
+        with self._lock:
+            id = self._keys[key].get(value)
+            values = self._rows.get(id) if id is not None else None
+            if values is not None:
+                self._rows.move_to_end(id)
+            generation = self._generation
+        if values is None:
+            return self._load(db, loader, generation)
+        return self._attach(db, values)
+
+    def put(self, obj) -> None:
+        self._store({column: getattr(obj, column) for column in self.columns}, None)
+
+    def invalidate(self, ids: List[int] = None) -> None:
+        '''ids=None - сбросить весь кэш'''
+        with self._lock:
+            self._generation += 1
+            if ids is None:
+                self._rows.clear()
+                for index in self._keys.values():
+                    index.clear()
+                return
+            for id in ids:
+                self._remove(id)
+
+    def _load(self, db: Session, loader: Callable, generation: int):
+        obj = loader()
+        # строка с реплики может быть старше последней инвалидации
+        if obj is not None and not db.info.get("replica"):
+            self._store({column: getattr(obj, column) for column in self.columns}, generation)
+        return obj
+
+    def _attach(self, db: Session, values: dict):
+        obj = self.model(**values)
+        make_transient_to_detached(obj)
+        return db.merge(obj, load=False)
+
+    def _store(self, values: dict, generation: int | None) -> None:
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            self._remove(values["id"])
+            self._rows[values["id"]] = values
+            for key, index in self._keys.items():
+                index[values[key]] = values["id"]
+            while len(self._rows) > self.max_size:
+                self._remove(next(iter(self._rows)))
+
+    def _remove(self, id: int) -> None:
+        values = self._rows.pop(id, None)
+        if values is None:
+            return
+        for key, index in self._keys.items():
+            if index.get(values[key]) == id:
+                del index[values[key]]
+
+
+class ChangeNotifier:
+    '''
+    Рассылает id изменённых строк отслеживаемых таблиц подписчикам всех процессов. Изменения собираются
+    при flush и отправляются через NOTIFY в той же транзакции; в своём процессе подписчики вызываются
+    сразу после commit, другие процессы получают их через LISTEN. ids=None у подписчика означает,
+    что изменения могли быть пропущены и сбросить нужно всё
+    '''
+
+    def __init__(self, channel: str, models: tuple, batch_size: int = 500):
+        self.channel = channel
+        self.tables = {model: model.__tablename__ for model in models}
+        self.batch_size = batch_size
+        self.token = uuid.uuid4().hex
+        self._subscribers: Dict[str, List[Callable]] = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def subscribe(self, model, callback: Callable) -> None:
+        '''model - отслеживаемая модель или имя темы для сообщений publish'''
+        self._subscribers.setdefault(self.tables.get(model, model), []).append(callback)
+
+    def publish(self, topic: str, ids: List[int]) -> None:
+        '''Отправляет подписчикам всех процессов сообщение, не связанное с транзакцией сессии'''
+        self._dispatch(topic, ids)
+        with engine.begin() as connection:
+            payload = f"{self.token}:{topic}:{','.join(map(str, ids))}"
+            connection.execute(sql_select(func.pg_notify(self.channel, payload)))
+
+    def install(self, session_factory) -> None:
+        event.listen(session_factory, "after_flush", self._after_flush)
+        event.listen(session_factory, "after_commit", self._after_commit)
+        event.listen(session_factory, "after_rollback", self._after_rollback)
+
+    def _after_flush(self, session: Session, flush_context) -> None:
+        changed = {}
+        for obj in chain(session.new, session.dirty, session.deleted):
+            table = self.tables.get(type(obj))
+            if table is None or (obj in session.dirty and not session.is_modified(obj, include_collections=False)):
+                continue
+            changed.setdefault(table, set()).add(obj.id)
+        for table, ids in changed.items():
+            self.record(session, table, ids)
+
+    def record(self, session: Session, model, ids) -> None:
+        '''Регистрирует изменения в транзакции сессии; нужно для строк, записанных в обход ORM'''
+        table = self.tables.get(model, model)
+        session.info.setdefault("changed_rows", {}).setdefault(table, set()).update(ids)
+        ids = sorted(ids)
+        connection = session.connection()
+        for start in range(0, len(ids), self.batch_size):
+            payload = f"{self.token}:{table}:{','.join(map(str, ids[start:start + self.batch_size]))}"
+            connection.execute(sql_select(func.pg_notify(self.channel, payload)))
+
+    def _after_commit(self, session: Session) -> None:
+        for table, ids in session.info.pop("changed_rows", {}).items():
+            self._dispatch(table, sorted(ids))
+
+    def _after_rollback(self, session: Session) -> None:
+        session.info.pop("changed_rows", None)
+
+    def _dispatch(self, table: str, ids: List[int] | None) -> None:
+        for callback in self._subscribers.get(table, []):
+            try:
+                callback(ids)
+            except Exception:
+                logger.exception("Ошибка подписчика изменений таблицы %s", table)
+
+    def _dispatch_all(self) -> None:
+        for table in self._subscribers:
+            self._dispatch(table, None)
+
+    def start(self) -> None:
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._listen, name="change-listener", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def _listen(self) -> None:
+        while not self._stop.is_set():
+            connection = None
+            try:
+                connection = psycopg2.connect(settings.DATABASE_URI)
+                connection.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                connection.cursor().execute(f'LISTEN "{self.channel}"')
+                # пока соединения не было, изменения могли быть пропущены
+                self._dispatch_all()
+                while not self._stop.is_set():
+                    if select.select([connection], [], [], 1.0)[0]:
+                        connection.poll()
+                        while connection.notifies:
+                            self._handle(connection.notifies.pop(0).payload)
+            except Exception:
+                logger.exception("Потеряно соединение для получения изменений, переподключение")
+                self._stop.wait(1.0)
+            finally:
+                if connection is not None:
+                    connection.close()
+
+    def _handle(self, payload: str) -> None:
+        token, table, ids = payload.split(":", 2)
+        if token != self.token:
+            self._dispatch(table, [int(id) for id in ids.split(",")])
+
+
+change_notifier = ChangeNotifier(channel="entity_changes", models=(AnimalType, Point, User, Area, AreaPoint))
+change_notifier.install(SessionLocal)
+
+animal_type_cache = EntityCache(AnimalType, max_size=settings.CACHE_MAX_SIZE)
+point_cache = EntityCache(Point, max_size=settings.CACHE_MAX_SIZE)
+user_cache = EntityCache(User, max_size=settings.CACHE_MAX_SIZE, keys=("email",))
+change_notifier.subscribe(AnimalType, animal_type_cache.invalidate)
+change_notifier.subscribe(Point, point_cache.invalidate)
+change_notifier.subscribe(User, user_cache.invalidate)
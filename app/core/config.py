@@ -31,6 +31,63 @@ class Settings(BaseSettings):
             "role": UserRoles.USER
         }
     ]
+    # пересоздавать схему при запуске; при запуске через gunicorn выполняется один раз в master-процессе
+    DB_RESET_ON_START: bool = True
+    DB_INIT_ON_STARTUP: bool = True
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: float = 30.0
+    DATABASE_REPLICA_URIS: list[str] = []
+    READ_YOUR_WRITES_WINDOW: float = 5.0
+    ROLLUP_ENABLED: bool = True
+    ROLLUP_INTERVAL: int = 300
+    ROLLUP_MAX_DAYS: int = 31
+    # секции посещений по месяцам: создаются на LOCATION_PARTITION_MONTHS_AHEAD месяцев вперёд,
+    # секции старше LOCATION_PARTITION_RETENTION_MONTHS месяцев отсоединяются (0 - хранить все)
+    LOCATION_PARTITION_INTERVAL: int = 3600
+    LOCATION_PARTITION_MONTHS_AHEAD: int = 2
+    LOCATION_PARTITION_RETENTION_MONTHS: int = 0
+    ANALYTICS_JOB_WORKERS: int = 2
+    ANALYTICS_JOB_USER_LIMIT: int = 2
+    ANALYTICS_JOB_RETENTION: int = 3600
+    # задача, выполняющаяся дольше ANALYTICS_JOB_TIMEOUT секунд, завершается ошибкой: её процесс мог упасть
+    ANALYTICS_JOB_TIMEOUT: int = 3600
+    ANALYTICS_JOB_POLL_INTERVAL: float = 1.0
+    AREA_INDEX_CELL_SIZE: float = 1.0
+    AREA_INDEX_TTL: float = 5.0
+    POINT_INDEX_REBUILD_THRESHOLD: int = 1024
+    POINT_INDEX_TTL: float = 5.0
+    NEAREST_MAX_K: int = 100
+    WITHIN_MAX_RESULTS: int = 1000
+    MULTI_GET_LIMIT: int = 100
+    AREA_IMPORT_MAX_FEATURES: int = 1000
+    OCCUPANCY_MAX_BUCKETS: int = 24 * 366
+    CACHE_MAX_SIZE: int = 10000
+    EXPORT_BATCH_SIZE: int = 10000
+    # потоков событий зон на процесс; комментарий в поток раз в GEOFENCE_HEARTBEAT секунд
+    GEOFENCE_MAX_STREAMS: int = 1000
+    GEOFENCE_HEARTBEAT: float = 15.0
+    GEOFENCE_BATCH_SIZE: int = 500
+    # результаты запросов с Idempotency-Key хранятся IDEMPOTENCY_KEY_TTL секунд; заявка запроса, который
+    # не завершился за IDEMPOTENCY_LOCK_TIMEOUT секунд, считается зависшей
+    IDEMPOTENCY_KEY_TTL: int = 24 * 3600
+    IDEMPOTENCY_LOCK_TIMEOUT: float = 60.0
+    IDEMPOTENCY_CLEANUP_INTERVAL: int = 600
+    IDEMPOTENCY_CLEANUP_BATCH_SIZE: int = 10000
+    # групповая запись посещений: пачка пишется через VISIT_GROUP_COMMIT_DELAY секунд после первого
+    # посещения или при VISIT_GROUP_COMMIT_MAX_ROWS посещениях
+    VISIT_GROUP_COMMIT: bool = False
+    VISIT_GROUP_COMMIT_DELAY: float = 0.005
+    VISIT_GROUP_COMMIT_MAX_ROWS: int = 500
+    # ограничения на процесс: concurrency одновременных запросов группы, queue ожидающих не дольше timeout секунд,
+    # rate запросов в секунду на клиента с запасом burst, deadline секунд на выполнение допущенного запроса
+    ADMISSION_LIMITS: dict[str, dict] = {
+        "analytics": {"concurrency": 4, "queue": 16, "timeout": 10.0, "rate": 1.0, "burst": 5, "deadline": 60.0},
+        "search": {"concurrency": 8, "queue": 32, "timeout": 5.0, "rate": 10.0, "burst": 20, "deadline": 15.0},
+        "spatial": {"concurrency": 8, "queue": 32, "timeout": 5.0, "rate": 20.0, "burst": 40, "deadline": 15.0},
+        "export": {"concurrency": 1, "queue": 0, "timeout": 1.0, "rate": 0.1, "burst": 2},
+    }
+    DISCONNECT_POLL_INTERVAL: float = 0.25
 
 
 settings = Settings()
@@ -0,0 +1,72 @@
+import msgpack
+from fastapi import Header, Response
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel
+
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+MSGPACK_MEDIA_TYPES = (MSGPACK_MEDIA_TYPE, "application/x-msgpack")
+JSON_MEDIA_RANGES = ("application/json", "application/*", "*/*")
+# описание для OpenAPI маршрутов, умеющих отвечать в MessagePack
+MSGPACK_RESPONSES = {200: {"content": {MSGPACK_MEDIA_TYPE: {}}}}
+
+
+class MsgPackResponse(Response):
+    media_type = MSGPACK_MEDIA_TYPE
+
+    def render(self, content) -> bytes:
+        return msgpack.packb(content, use_bin_type=True)
+
+
+def parse_accept(accept: str) -> list[tuple[str, float, dict]]:
+    '''Диапазоны типов из заголовка Accept: (тип, q, параметры)'''
+    media_ranges = []
+    for item in accept.split(","):
+        media_type, *params = [part.strip() for part in item.split(";")]
+        if not media_type:
+            continue
+        params = dict(param.partition("=")[::2] for param in params)
+        try:
+            quality = float(params.pop("q", 1))
+        except ValueError:
+            quality = 0.0
+        media_ranges.append((media_type.lower(), quality, {key.strip().lower(): value.strip().lower()
+                                                           for key, value in params.items()}))
+    return media_ranges
+
+
+def to_columns(rows: list[dict], fields: list[str]) -> dict[str, list]:
+    '''Список объектов по столбцам: {поле: [значения по порядку объектов]}'''
+    return {field: [row[field] for row in rows] for field in fields}
+
+
+class ResponseFormat:
+    '''
+    Зависимость списочных маршрутов: формат ответа по заголовку Accept. application/msgpack - ответ в MessagePack,
+    иначе JSON. Параметр layout=columnar (application/msgpack; layout=columnar) отдаёт список объектов
+    по столбцам, без повторения имён полей в каждом объекте
+    '''
+
+    def __init__(self, accept: str | None = Header(default=None, include_in_schema=False)):
+        self.msgpack = False
+        self.columnar = False
+        if not accept:
+            return
+        json_quality, json_params = 0.0, {}
+        msgpack_quality, msgpack_params = 0.0, {}
+        for media_type, quality, params in parse_accept(accept):
+            if media_type in MSGPACK_MEDIA_TYPES and quality > msgpack_quality:
+                msgpack_quality, msgpack_params = quality, params
+            elif media_type in JSON_MEDIA_RANGES and quality > json_quality:
+                json_quality, json_params = quality, params
+        # при равном приоритете остаётся JSON
+        self.msgpack = msgpack_quality > json_quality
+        params = msgpack_params if self.msgpack else json_params
+        self.columnar = params.get("layout") == "columnar"
+
+    def response(self, content, model: type[BaseModel] = None, status_code: int = 200) -> Response:
+        '''content - уже готовые к сериализации dict/list; model задаёт столбцы для пустого списка'''
+        if self.columnar and isinstance(content, list):
+            fields = list(model.__fields__) if model is not None else list(content[0]) if content else []
+            content = to_columns(content, fields)
+        response_class = MsgPackResponse if self.msgpack else ORJSONResponse
+        return response_class(content, status_code=status_code, headers={"Vary": "Accept"})
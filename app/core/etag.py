@@ -0,0 +1,20 @@
+from hashlib import blake2b
+
+from fastapi import Response, status
+
+
+def make_etag(*parts) -> str:
+    return '"' + blake2b(":".join(map(str, parts)).encode(), digest_size=12).hexdigest() + '"'
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    '''Слабое сравнение ETag из заголовка If-None-Match'''
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
@@ -0,0 +1,150 @@
+import argparse
+import json
+import os
+import zipfile
+from datetime import datetime
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy import Boolean, DateTime, Enum, Float, Integer, String, cast, select, text
+
+from app.core.config import settings
+from app.db.session import engine
+from app.models.animals import Animal, AnimalLocation, AnimalTypeAnimal
+from app.models.areas import Area, AreaPoint
+from app.models.points import Point
+from app.schemas.types import parse_datetime
+
+EXPORT_TABLES = [Animal.__table__, AnimalTypeAnimal.__table__, AnimalLocation.__table__, Point.__table__,
+                 Area.__table__, AreaPoint.__table__]
+# таблицы, которые при выгрузке с отметки выгружаются только с посещениями новее неё; остальные - целиком
+INCREMENTAL_COLUMNS = {AnimalLocation.__tablename__: AnimalLocation.__table__.c.dateTimeOfVisitLocationPoint}
+MANIFEST_NAME = "manifest.json"
+
+
+def arrow_type(column) -> pa.DataType:
+    if isinstance(column.type, Integer):
+        return pa.int64()
+    if isinstance(column.type, Float):
+        return pa.float64()
+    if isinstance(column.type, Boolean):
+        return pa.bool_()
+    if isinstance(column.type, DateTime):
+        return pa.timestamp("us", tz="UTC")
+    return pa.string()
+
+
+def _export_query(table, since: datetime | None):
+    # перечисления выгружаются строками
+    columns = [
+        cast(column, String).label(column.name) if isinstance(column.type, Enum) else column
+        for column in table.columns
+    ]
+    query = select(*columns).order_by(*table.primary_key.columns)
+    if since is not None and table.name in INCREMENTAL_COLUMNS:
+        query = query.where(INCREMENTAL_COLUMNS[table.name] >= since)
+    return query
+
+
+def write_snapshot(open_file, since: datetime = None, batch_size: int = None):
+    '''
+    Выгружает таблицы в Parquet из одного снимка базы (REPEATABLE READ). Строки читаются серверным курсором
+    пачками по batch_size, каждая пачка записывается отдельной группой строк, поэтому память не растёт с объёмом.
+    open_file(name) открывает файл для записи. Генератор: отдаёт управление после каждой пачки,
+    в конце возвращает манифест выгрузки.
+
+    watermark манифеста - отметка для следующей выгрузки с since: посещения, записанные транзакциями,
+    которые не успели завершиться к снимку, получают время не раньше её. Изменения и удаления
+    старых посещений выгрузкой с отметки не переносятся
+    '''
+    batch_size = batch_size or settings.EXPORT_BATCH_SIZE
+    manifest = {"since": since.isoformat() if since else None, "tables": {}}
+    with engine.connect() as connection:
+        connection = connection.execution_options(isolation_level="REPEATABLE READ")
+        with connection.begin():
+            connection.execute(text("SET TRANSACTION READ ONLY"))
+            snapshot_time, watermark = connection.execute(text(
+                "SELECT now(), least(now(), min(xact_start)) FROM pg_stat_activity "
+                "WHERE xact_start IS NOT NULL AND pid <> pg_backend_pid()"
+            )).one()
+            manifest["snapshotTime"] = snapshot_time.isoformat()
+            manifest["watermark"] = watermark.isoformat()
+            for table in EXPORT_TABLES:
+                schema = pa.schema([pa.field(column.name, arrow_type(column), nullable=column.nullable)
+                                    for column in table.columns])
+                rows_count = 0
+                result = connection.execute(
+                    _export_query(table, since).execution_options(stream_results=True, max_row_buffer=batch_size))
+                with open_file(f"{table.name}.parquet") as file, pq.ParquetWriter(file, schema) as writer:
+                    for rows in result.partitions(batch_size):
+                        columns = list(zip(*rows))
+                        writer.write_batch(pa.RecordBatch.from_arrays(
+                            [pa.array(values, type=field.type) for values, field in zip(columns, schema)],
+                            schema=schema
+                        ))
+                        rows_count += len(rows)
+                        yield
+                manifest["tables"][table.name] = {
+                    "file": f"{table.name}.parquet",
+                    "rows": rows_count,
+                    "incremental": since is not None and table.name in INCREMENTAL_COLUMNS
+                }
+    return manifest
+
+
+def export_to_directory(directory: str, since: datetime = None, batch_size: int = None) -> dict:
+    os.makedirs(directory, exist_ok=True)
+    snapshot = write_snapshot(lambda name: open(os.path.join(directory, name), "wb"), since, batch_size)
+    try:
+        while True:
+            next(snapshot)
+    except StopIteration as stop:
+        manifest = stop.value
+    with open(os.path.join(directory, MANIFEST_NAME), "w") as file:
+        json.dump(manifest, file, indent=2)
+    return manifest
+
+
+class _ChunkBuffer:
+    '''Файл без позиционирования: zipfile пишет в него архив, а записанное забирается по частям'''
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def take(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def stream_zip_snapshot(since: datetime = None, batch_size: int = None):
+    '''Выгрузка zip-архивом из файлов Parquet и манифеста; архив отдаётся частями по мере записи'''
+    buffer = _ChunkBuffer()
+    with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_STORED) as archive:
+        snapshot = write_snapshot(lambda name: archive.open(name, "w", force_zip64=True), since, batch_size)
+        try:
+            while True:
+                next(snapshot)
+                yield buffer.take()
+        except StopIteration as stop:
+            manifest = stop.value
+        archive.writestr(MANIFEST_NAME, json.dumps(manifest, indent=2))
+    yield buffer.take()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Выгрузка снимка базы в Parquet")
+    parser.add_argument("directory", help="каталог для файлов выгрузки")
+    parser.add_argument("--since", type=parse_datetime, help="выгружать посещения не раньше отметки (watermark "
+                                                          "манифеста предыдущей выгрузки)")
+    parser.add_argument("--batch-size", type=int, default=None)
+    arguments = parser.parse_args()
+    result = export_to_directory(arguments.directory, arguments.since, arguments.batch_size)
+    print(json.dumps(result, indent=2))
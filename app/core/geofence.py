@@ -0,0 +1,243 @@
+import asyncio
+import json
+import logging
+import threading
+from itertools import chain
+from typing import List
+
+from fastapi import HTTPException, status
+from sqlalchemy import event
+from sqlalchemy.orm import Session, attributes
+from starlette.concurrency import run_in_threadpool
+
+from app.core.cache import change_notifier
+from app.core.config import settings
+from app.core.indexes import area_index
+from app.crud.crud_geofence import GeofenceEventCRUD
+from app.crud.crud_point import PointCRUD
+from app.db.session import SessionLocal
+from app.models.animals import Animal
+from app.models.areas import GeofenceEvent, GeofenceEventType
+from app.schemas.types import format_datetime
+
+logger = logging.getLogger(__name__)
+
+# тема уведомлений: id зон, в которых появились события
+GEOFENCE_TOPIC = "geofence_areas"
+
+
+def area_transitions(previous_areas: set, current_areas: set) -> List[tuple]:
+    '''(зона, событие) при переходе между наборами зон: сначала выходы, затем входы'''
+    return (
+        [(area_id, GeofenceEventType.EXIT) for area_id in sorted(previous_areas - current_areas)]
+        + [(area_id, GeofenceEventType.ENTER) for area_id in sorted(current_areas - previous_areas)]
+    )
+
+
+class GeofenceTracker:
+    '''
+    События входа в зоны и выхода из них. Текущая точка животного меняется при чипировании, добавлении,
+    изменении и удалении посещений; при flush зоны старой и новой точки сравниваются по индексу зон,
+    события пишутся в той же транзакции и публикуются после её фиксации. Зоны, созданные или изменённые
+    позже, событий для уже находящихся в них животных не дают; зоны, зафиксированные раньше, учитываются сразу
+    '''
+
+    def install(self, session_factory) -> None:
+        # старая точка нужна и тогда, когда атрибут не загружен после commit
+        event.listen(Animal.currentPointId, "set", self._load_previous_point, active_history=True)
+        event.listen(session_factory, "after_flush", self._after_flush)
+        event.listen(session_factory, "after_commit", self._after_commit)
+        event.listen(session_factory, "after_rollback", self._after_rollback)
+
+    @staticmethod
+    def _load_previous_point(target, value, previous, initiator) -> None:
+        pass
+
+    def _after_flush(self, session: Session, flush_context) -> None:
+        moves = []
+        for obj in chain(session.new, session.dirty):
+            if not isinstance(obj, Animal):
+                continue
+            history = attributes.get_history(obj, "currentPointId")
+            if not history.added:
+                continue
+            previous = history.deleted[0] if history.deleted else None
+            if previous != history.added[0]:
+                moves.append((obj.id, previous, history.added[0]))
+        if moves:
+            self.record(session, moves)
+
+    @staticmethod
+    def _after_commit(session: Session) -> None:
+        if session.info.pop("geofence_events", False):
+            try:
+                publish_events()
+            except Exception:
+                # изменения уже зафиксированы; события опубликует следующая запись или поток подписчика
+                logger.exception("Ошибка публикации событий зон")
+
+    @staticmethod
+    def _after_rollback(session: Session) -> None:
+        session.info.pop("geofence_events", None)
+
+    def record(self, session: Session, moves: List[tuple]) -> None:
+        '''moves - (animal_id, старая точка или None, новая точка)'''
+        point_ids = {point_id for _, *points in moves for point_id in points if point_id is not None}
+        coordinates = {point.id: (point.latitude, point.longitude)
+                       for point in PointCRUD(session).get_points_by_ids(sorted(point_ids))}
+        # уведомление об изменении зон может ещё не дойти: события не должны считаться по устаревшему индексу
+        index = area_index.get(session, fresh=True)
+
+        def containing(point_id) -> set:
+            if point_id not in coordinates:
+                return set()
+            return set(index.containing(*coordinates[point_id]))
+
+        events = [
+            {"area_id": area_id, "animal_id": animal_id, "event_type": event_type, "location_point_id": current}
+            for animal_id, previous, current in moves
+            for area_id, event_type in area_transitions(containing(previous), containing(current))
+        ]
+        if not events:
+            return
+        GeofenceEventCRUD(session).add_events(events)
+        session.info["geofence_events"] = True
+
+
+def publish_events(wait: bool = True) -> None:
+    '''
+    Публикует зафиксированные события и будит потоки всех процессов, подписанные на их зоны. Без ожидания
+    публикация пропускается, если её уже выполняет другая транзакция
+    '''
+    with SessionLocal() as db:
+        event_crud = GeofenceEventCRUD(db)
+        if not event_crud.lock_publishing(wait):
+            return
+        area_ids = event_crud.publish_events()
+        if area_ids:
+            change_notifier.record(db, GEOFENCE_TOPIC, area_ids)
+        db.commit()
+
+
+def event_to_dict(geofence_event: GeofenceEvent) -> dict:
+    return {
+        "id": geofence_event.sequence,
+        "areaId": geofence_event.area_id,
+        "animalId": geofence_event.animal_id,
+        "eventType": geofence_event.event_type.value,
+        "locationPointId": geofence_event.location_point_id,
+        "dateTime": format_datetime(geofence_event.event_time),
+    }
+
+
+def format_sse(geofence_event: dict) -> str:
+    return f"id: {geofence_event['id']}\nevent: {geofence_event['eventType']}\ndata: {json.dumps(geofence_event)}\n\n"
+
+
+def load_events(area_ids: List[int], after_id: int, limit: int) -> List[dict]:
+    '''after_id - номер последнего полученного события'''
+    # события читаются с основной базы: уведомление может опередить реплику
+    with SessionLocal() as db:
+        return [event_to_dict(row) for row in GeofenceEventCRUD(db).get_events(area_ids, after_id, limit)]
+
+
+def get_last_event_id() -> int:
+    with SessionLocal() as db:
+        return GeofenceEventCRUD(db).get_last_sequence()
+
+
+class Subscription:
+    '''Подписка потока на зоны. Будится из любого потока; ожидание - в цикле событий'''
+
+    def __init__(self, area_ids: List[int]):
+        self.area_ids = area_ids
+        self.loop = asyncio.get_running_loop()
+        self.event = asyncio.Event()
+
+    def wake(self) -> None:
+        try:
+            self.loop.call_soon_threadsafe(self.event.set)
+        except RuntimeError:
+            # цикл событий уже закрыт
+            pass
+
+
+class GeofenceBroker:
+    '''
+    Рассылка событий потокам Server-Sent Events процесса. Уведомление будит только потоки, подписанные
+    на зоны с новыми событиями; сами события поток дочитывает из базы после последнего отправленного id,
+    поэтому повторная выдача после переподключения и пропущенные уведомления обрабатываются одинаково
+    '''
+
+    def __init__(self, max_streams: int, heartbeat: float, batch_size: int):
+        self.max_streams = max_streams
+        self.heartbeat = heartbeat
+        self.batch_size = batch_size
+        self._subscriptions: dict[int, set] = {}
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def check_capacity(self) -> None:
+        if self._count >= self.max_streams:
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                                detail="Превышено число подписок на события зон")
+
+    def subscribe(self, area_ids: List[int]) -> Subscription:
+        subscription = Subscription(area_ids)
+        with self._lock:
+            self._count += 1
+            for area_id in area_ids:
+                self._subscriptions.setdefault(area_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            self._count -= 1
+            for area_id in subscription.area_ids:
+                subscriptions = self._subscriptions.get(area_id)
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[area_id]
+
+    def notify(self, area_ids: List[int] | None) -> None:
+        '''area_ids=None - уведомления могли быть пропущены, будятся все потоки'''
+        with self._lock:
+            if area_ids is None:
+                woken = set(chain.from_iterable(self._subscriptions.values()))
+            else:
+                woken = set(chain.from_iterable(self._subscriptions.get(area_id, ()) for area_id in area_ids))
+        for subscription in woken:
+            subscription.wake()
+
+    async def stream(self, area_ids: List[int], after_id: int):
+        '''
+        События зон с id больше after_id, затем новые по мере появления. Подписка оформляется при первом
+        чтении ответа, чтобы не остаться за ответом, который так и не начали отправлять
+        '''
+        subscription = self.subscribe(area_ids)
+        try:
+            while True:
+                subscription.event.clear()
+                events = await run_in_threadpool(load_events, subscription.area_ids, after_id, self.batch_size)
+                for geofence_event in events:
+                    yield format_sse(geofence_event)
+                if events:
+                    after_id = events[-1]["id"]
+                if len(events) == self.batch_size:
+                    continue
+                try:
+                    await asyncio.wait_for(subscription.event.wait(), self.heartbeat)
+                except asyncio.TimeoutError:
+                    # комментарий не даёт прокси закрыть соединение; после него база перечитывается
+                    yield ": ping\n\n"
+                    # события транзакции, процесс которой завершился до их публикации
+                    await run_in_threadpool(publish_events, False)
+        finally:
+            self.unsubscribe(subscription)
+
+
+geofence_tracker = GeofenceTracker()
+geofence_tracker.install(SessionLocal)
+geofence_broker = GeofenceBroker(max_streams=settings.GEOFENCE_MAX_STREAMS, heartbeat=settings.GEOFENCE_HEARTBEAT,
+                                 batch_size=settings.GEOFENCE_BATCH_SIZE)
+change_notifier.subscribe(GEOFENCE_TOPIC, geofence_broker.notify)
@@ -0,0 +1,190 @@
+from typing import List
+
+import numpy as np
+
+
+def ring_coordinates(points: List) -> tuple[np.ndarray, np.ndarray]:
+    '''Координаты вершин многоугольника: x - долгота, y - широта'''
+    x = np.fromiter((point.longitude for point in points), dtype=float, count=len(points))
+    y = np.fromiter((point.latitude for point in points), dtype=float, count=len(points))
+    return x, y
+
+
+def orientations(ax, ay, bx, by, cx, cy) -> np.ndarray:
+    '''Знак векторного произведения (b - a) x (c - a): 1 - против часовой стрелки, -1 - по часовой, 0 - на одной прямой'''
+    return np.sign((bx - ax) * (cy - ay) - (by - ay) * (cx - ax))
+
+
+def all_collinear(x: np.ndarray, y: np.ndarray) -> bool:
+    return not np.any(orientations(x[0], y[0], x[1], y[1], x, y))
+
+
+def has_duplicates(x: np.ndarray, y: np.ndarray, order: np.ndarray) -> bool:
+    '''order - индексы вершин, отсортированных лексикографически по (x, y)'''
+    sorted_x, sorted_y = x[order], y[order]
+    return bool(np.any((sorted_x[1:] == sorted_x[:-1]) & (sorted_y[1:] == sorted_y[:-1])))
+
+
+def has_spikes(x: np.ndarray, y: np.ndarray) -> bool:
+    '''Проверяет, есть ли соседние рёбра, лежащие на одной прямой и накладывающиеся друг на друга'''
+    prev_x, prev_y = np.roll(x, 1), np.roll(y, 1)
+    next_x, next_y = np.roll(x, -1), np.roll(y, -1)
+    collinear = orientations(prev_x, prev_y, x, y, next_x, next_y) == 0
+    turns_back = (x - prev_x) * (next_x - x) + (y - prev_y) * (next_y - y) < 0
+    return bool(np.any(collinear & turns_back))
+
+
+def ring_self_intersects(x: np.ndarray, y: np.ndarray, order: np.ndarray) -> bool:
+    '''
+    Алгоритм Шамоса-Хоя: заметающая прямая проходит вершины в лексикографическом порядке,
+    пересечения проверяются только у рёбер, соседних в статусе заметающей прямой. Смежные рёбра
+    многоугольника имеют общую вершину и пересечением не считаются. Вершины не должны повторяться.
+    Статус - список с пропусками: поиск места ребра за O(log n) в среднем, удаление и замена ребра
+    следующим ребром цепочки - по ссылкам, без сравнений
+    '''
+    n = len(x)
+    xs, ys = x.tolist(), y.tolist()
+    next_vertex = list(range(1, n)) + [0]
+    # ребро i идёт из вершины i в вершину i + 1; left/right - его концы в лексикографическом порядке
+    left, right = [], []
+    for i in range(n):
+        j = next_vertex[i]
+        if (xs[i], ys[i]) < (xs[j], ys[j]):
+            left.append(i)
+            right.append(j)
+        else:
+            left.append(j)
+            right.append(i)
+    lx = [xs[i] for i in left]
+    ly = [ys[i] for i in left]
+    rx = [xs[i] for i in right]
+    ry = [ys[i] for i in right]
+    dx = [b - a for a, b in zip(lx, rx)]
+    dy = [b - a for a, b in zip(ly, ry)]
+    rank = np.empty(n, dtype=np.int64)
+    rank[order] = np.arange(n)
+    left_rank = rank[left].tolist()
+
+    def is_below(s, t):
+        # сравнение идёт относительно ребра, начавшегося раньше: его прямая разделяет статус
+        if left_rank[s] < left_rank[t]:
+            base, other, below = s, t, False
+        else:
+            base, other, below = t, s, True
+        x0, y0, base_dx, base_dy = lx[base], ly[base], dx[base], dy[base]
+        value = base_dx * (ly[other] - y0) - base_dy * (lx[other] - x0)
+        if value == 0:
+            value = base_dx * (ry[other] - y0) - base_dy * (rx[other] - x0)
+            if value == 0:
+                # рёбра на одной прямой упорядочиваются по номеру, чтобы порядок оставался строгим
+                return s < t
+        return value < 0 if below else value > 0
+
+    def on_segment(edge, px, py):
+        return min(lx[edge], rx[edge]) <= px <= max(lx[edge], rx[edge]) \
+            and min(ly[edge], ry[edge]) <= py <= max(ly[edge], ry[edge])
+
+    def intersects(s, t):
+        if (s - t) % n in (1, n - 1):
+            return False
+        # знаки векторных произведений: концы t относительно s и концы s относительно t
+        sx, sy, sdx, sdy, tx, ty, tdx, tdy = lx[s], ly[s], dx[s], dy[s], lx[t], ly[t], dx[t], dy[t]
+        value = sdx * (ty - sy) - sdy * (tx - sx)
+        o1 = (value > 0) - (value < 0)
+        value = sdx * (ry[t] - sy) - sdy * (rx[t] - sx)
+        o2 = (value > 0) - (value < 0)
+        value = tdx * (sy - ty) - tdy * (sx - tx)
+        o3 = (value > 0) - (value < 0)
+        value = tdx * (ry[s] - ty) - tdy * (rx[s] - tx)
+        o4 = (value > 0) - (value < 0)
+        if o1 != o2 and o3 != o4:
+            return True
+        return (o1 == 0 and on_segment(s, lx[t], ly[t])) or (o2 == 0 and on_segment(s, rx[t], ry[t])) \
+            or (o3 == 0 and on_segment(t, lx[s], ly[s])) or (o4 == 0 and on_segment(t, rx[s], ry[s]))
+
+    # узел n - голова списка, -1 - конец уровня. Высоты узлов геометрические с p = 1/2;
+    # генератор с постоянным зерном делает проверку воспроизводимой
+    head = n
+    heights = np.minimum(np.random.default_rng(0).geometric(0.5, n), max(1, n.bit_length())).tolist()
+    levels = max(heights, default=1)
+    following = [[-1] * height for height in heights] + [[-1] * levels]
+    preceding = [[head] * height for height in heights]
+    # path[level] - последний узел уровня, лежащий ниже вставляемого ребра
+    path = [head] * levels
+
+    def neighbours(edge):
+        below = preceding[edge][0]
+        return -1 if below == head else below, following[edge][0]
+
+    def locate(edge):
+        node = head
+        for level in range(levels - 1, -1, -1):
+            candidate = following[node][level]
+            while candidate != -1 and is_below(candidate, edge):
+                node = candidate
+                candidate = following[node][level]
+            path[level] = node
+
+    def link(edge):
+        for level in range(heights[edge]):
+            node = path[level]
+            above = following[node][level]
+            following[edge][level] = above
+            preceding[edge][level] = node
+            following[node][level] = edge
+            if above != -1:
+                preceding[above][level] = edge
+
+    def unlink(edge):
+        for level in range(heights[edge]):
+            below, above = preceding[edge][level], following[edge][level]
+            following[below][level] = above
+            if above != -1:
+                preceding[above][level] = below
+
+    def replace(edge, successor):
+        heights[successor] = heights[edge]
+        following[successor], preceding[successor] = following[edge], preceding[edge]
+        for level in range(heights[edge]):
+            below, above = preceding[edge][level], following[edge][level]
+            following[below][level] = successor
+            if above != -1:
+                preceding[above][level] = successor
+
+    # ребро, приходящее в вершину, заканчивается в ней, если предыдущая вершина раньше в порядке обхода
+    previous_ends = (np.roll(rank, 1) < rank).tolist()
+    next_ends = (np.roll(rank, -1) < rank).tolist()
+    for vertex in order.tolist():
+        previous_edge = vertex - 1 if vertex else n - 1
+        if previous_ends[vertex] != next_ends[vertex]:
+            # ребро цепочки продолжается следующим и занимает его место: рёбра, проходящие через вершину,
+            # пересекают закончившееся ребро и уже найдены, остальные лежат по ту же сторону от обоих
+            edge, successor = (previous_edge, vertex) if previous_ends[vertex] else (vertex, previous_edge)
+            replace(edge, successor)
+            below, above = neighbours(successor)
+            if below != -1 and intersects(below, successor):
+                return True
+            if above != -1 and intersects(successor, above):
+                return True
+        elif previous_ends[vertex]:
+            for edge in (previous_edge, vertex):
+                below, above = neighbours(edge)
+                unlink(edge)
+                if below != -1 and above != -1 and intersects(below, above):
+                    return True
+        else:
+            locate(previous_edge)
+            link(previous_edge)
+            # второе ребро, выходящее из вершины, - сосед первого: путь поиска первого почти подходит
+            if is_below(previous_edge, vertex):
+                for level in range(heights[previous_edge]):
+                    path[level] = previous_edge
+            link(vertex)
+            for edge in (previous_edge, vertex):
+                below, above = neighbours(edge)
+                if below != -1 and intersects(below, edge):
+                    return True
+                if above != -1 and intersects(edge, above):
+                    return True
+    return False
+
@@ -0,0 +1,195 @@
+import hashlib
+import json
+import logging
+import threading
+
+from fastapi.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers
+
+from app.crud.crud_idempotency import IdempotencyKeyCRUD
+from app.db.session import SessionLocal
+from app.models.idempotency import IdempotencyKey
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENT_METHODS = ("POST", "PUT")
+KEY_MAX_LENGTH = 255
+# заголовки, которые при повторе выставляются заново
+SKIPPED_HEADERS = (b"content-length",)
+
+
+def client_hash(scope, headers: Headers) -> bytes:
+    '''Клиент - заголовок Authorization, для анонимных запросов - адрес клиента'''
+    client = headers.get("authorization") or (scope["client"][0] if scope.get("client") else "")
+    return hashlib.blake2b(client.encode(), digest_size=16).digest()
+
+
+def request_fingerprint(scope, body: bytes) -> bytes:
+    digest = hashlib.sha256()
+    for part in (scope["method"].encode(), scope["path"].encode(), scope.get("query_string", b"")):
+        digest.update(part)
+        digest.update(b"\0")
+    digest.update(body)
+    return digest.digest()
+
+
+async def read_body(receive) -> bytes:
+    chunks = []
+    while True:
+        message = await receive()
+        if message["type"] != "http.request":
+            break
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body", False):
+            break
+    return b"".join(chunks)
+
+
+def should_store(status: int) -> bool:
+    '''Ошибки сервера и отказы из-за нагрузки временные: повтор выполняется заново'''
+    return status < 500 and status != 429
+
+
+def claim_key(client: bytes, key: str, fingerprint: bytes, lock_timeout: float) -> IdempotencyKey | None:
+    '''None - ключ занят под этот запрос, иначе запись предыдущего запроса с этим ключом'''
+    with SessionLocal() as db:
+        idempotency_crud = IdempotencyKeyCRUD(db)
+        while True:
+            if idempotency_crud.claim(client, key, fingerprint, lock_timeout):
+                return None
+            record = idempotency_crud.get(client, key)
+            # запись могла истечь или освободиться между запросами
+            if record is not None:
+                return record
+
+
+def complete_key(client: bytes, key: str, status: int, headers: str, body: bytes, ttl: float) -> None:
+    with SessionLocal() as db:
+        IdempotencyKeyCRUD(db).complete(client, key, status, headers, body, ttl)
+
+
+def release_key(client: bytes, key: str) -> None:
+    with SessionLocal() as db:
+        IdempotencyKeyCRUD(db).release(client, key)
+
+
+class IdempotencyMiddleware:
+    '''
+    POST и PUT с заголовком Idempotency-Key выполняются один раз: повтор с тем же ключом от того же клиента
+    в течение ttl секунд получает сохранённые код, заголовки и тело ответа без авторизации и проверок.
+    Ключ с другим методом, путём или телом - 400, пока первый запрос выполняется - 409
+    '''
+
+    def __init__(self, app, ttl: float, lock_timeout: float):
+        self.app = app
+        self.ttl = ttl
+        self.lock_timeout = lock_timeout
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in IDEMPOTENT_METHODS:
+            return await self.app(scope, receive, send)
+        headers = Headers(scope=scope)
+        key = headers.get("idempotency-key")
+        if key is None:
+            return await self.app(scope, receive, send)
+        if not key or len(key) > KEY_MAX_LENGTH:
+            response = JSONResponse(status_code=400, content={
+                "detail": f"Idempotency-Key должен содержать от 1 до {KEY_MAX_LENGTH} символов"})
+            return await response(scope, receive, send)
+
+        body = await read_body(receive)
+        client = client_hash(scope, headers)
+        fingerprint = request_fingerprint(scope, body)
+        record = await run_in_threadpool(claim_key, client, key, fingerprint, self.lock_timeout)
+        if record is not None:
+            return await self._reply(record, fingerprint, scope, receive, send)
+
+        body_sent = False
+
+        async def replay_receive():
+            # тело уже прочитано; дальше обработчик узнаёт об отключении клиента
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        start, chunks = None, []
+
+        async def capture(message):
+            nonlocal start
+            if message["type"] == "http.response.start":
+                start = message
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+
+        try:
+            await self.app(scope, replay_receive, capture)
+        except BaseException:
+            await run_in_threadpool(release_key, client, key)
+            raise
+        if start is None:
+            await run_in_threadpool(release_key, client, key)
+            return
+        response_body = b"".join(chunks)
+        if should_store(start["status"]):
+            stored_headers = json.dumps([
+                [name.decode("latin-1"), value.decode("latin-1")]
+                for name, value in start["headers"] if name.lower() not in SKIPPED_HEADERS
+            ])
+            # результат сохраняется до ответа: повтор после обрыва связи уже найдёт его
+            await run_in_threadpool(complete_key, client, key, start["status"], stored_headers, response_body,
+                                    self.ttl)
+        else:
+            await run_in_threadpool(release_key, client, key)
+        await send(start)
+        await send({"type": "http.response.body", "body": response_body})
+
+    async def _reply(self, record: IdempotencyKey, fingerprint: bytes, scope, receive, send):
+        if bytes(record.fingerprint) != fingerprint:
+            response = JSONResponse(status_code=400, content={
+                "detail": "Idempotency-Key уже использован для другого запроса"})
+            return await response(scope, receive, send)
+        if record.status is None:
+            response = JSONResponse(status_code=409, content={
+                "detail": "Запрос с этим Idempotency-Key ещё выполняется"}, headers={"Retry-After": "1"})
+            return await response(scope, receive, send)
+        body = bytes(record.body)
+        headers = [(name.encode("latin-1"), value.encode("latin-1")) for name, value in json.loads(record.headers)]
+        headers += [(b"content-length", str(len(body)).encode()), (b"idempotent-replayed", b"true")]
+        await send({"type": "http.response.start", "status": record.status, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
+
+
+class IdempotencyCleanupWorker:
+    '''Фоновый поток, удаляющий истёкшие ключи идемпотентности пачками'''
+
+    def __init__(self, interval: int, batch_size: int):
+        self.interval = interval
+        self.batch_size = batch_size
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="idempotency-cleanup", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval)
+
+    def run_once(self) -> None:
+        with SessionLocal() as db:
+            idempotency_crud = IdempotencyKeyCRUD(db)
+            while not self._stop.is_set() and idempotency_crud.delete_expired(self.batch_size) == self.batch_size:
+                pass
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception:
+                logger.exception("Ошибка при удалении истёкших ключей идемпотентности")
+            self._stop.wait(self.interval)
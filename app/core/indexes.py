@@ -0,0 +1,126 @@
+import threading
+import time
+from abc import ABC, abstractmethod
+
+from sqlalchemy.orm import Session
+
+from app.core.cache import change_notifier
+from app.core.config import settings
+from app.core.spatial import AreaIndex, PointIndex
+from app.crud.crud_area import AreaCRUD
+from app.crud.crud_point import PointCRUD
+from app.db.session import SessionLocal
+from app.models.areas import Area, AreaPoint
+from app.models.points import Point
+
+
+class SharedIndex(ABC):
+    '''
+    Индекс в памяти, общий для обработчиков процесса. Строится лениво при первом обращении и сбрасывается
+    по уведомлениям об изменениях; сигнатура данных в базе проверяется на случай пропущенных уведомлений
+    '''
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._index = None
+        self._signature = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    @abstractmethod
+    def load_signature(self, db: Session):
+        '''Сигнатура данных в базе: меняется, когда индекс нужно перестроить'''
+
+    @abstractmethod
+    def load(self, db: Session):
+        '''Строит индекс по базе'''
+
+    def is_stale(self, signature) -> bool:
+        return signature != self._signature
+
+    def refresh(self, db: Session) -> None:
+        '''Применяет к построенному индексу накопленные изменения'''
+
+    def get(self, db: Session, fresh: bool = False):
+        '''fresh - сигнатура проверяется независимо от ttl: индекс учитывает всё, что видно в транзакции db'''
+        if db.info.get("replica"):
+            # индекс общий для всех запросов процесса, поэтому строится только по основной базе
+            with SessionLocal() as primary:
+                return self.get(primary, fresh)
+        with self._lock:
+            if self._index is not None:
+                self.refresh(db)
+            now = time.monotonic()
+            if self._index is None or fresh or now - self._checked_at >= self.ttl:
+                signature = self.load_signature(db)
+                if self._index is None or self.is_stale(signature):
+                    self._index = self.load(db)
+                    self._signature = signature
+                self._checked_at = now
+            return self._index
+
+    def invalidate(self, ids=None) -> None:
+        with self._lock:
+            self._index = None
+
+
+class SharedAreaIndex(SharedIndex):
+    '''После изменения зон индекс перестраивается при следующем обращении'''
+
+    def __init__(self, cell_size: float, ttl: float):
+        super().__init__(ttl)
+        self.cell_size = cell_size
+
+    def load_signature(self, db: Session):
+        return AreaCRUD(db).get_areas_signature()
+
+    def load(self, db: Session) -> AreaIndex:
+        return AreaIndex(self.cell_size).build(AreaCRUD(db).get_area_polygons())
+
+
+class SharedPointIndex(SharedIndex):
+    '''
+    Изменённые точки перечитываются из базы при следующем обращении и вносятся в индекс без перестроения;
+    сигнатура - максимальный id точки
+    '''
+
+    def __init__(self, rebuild_threshold: int, ttl: float):
+        super().__init__(ttl)
+        self.rebuild_threshold = rebuild_threshold
+        self._changed = set()
+
+    def load_signature(self, db: Session):
+        return PointCRUD(db).get_max_point_id()
+
+    def is_stale(self, signature) -> bool:
+        return signature > self._signature
+
+    def load(self, db: Session) -> PointIndex:
+        self._changed.clear()
+        ids, latitudes, longitudes = PointCRUD(db).get_points_coordinates()
+        return PointIndex(self.rebuild_threshold).build(ids, latitudes, longitudes)
+
+    def refresh(self, db: Session) -> None:
+        if not self._changed:
+            return
+        changed, self._changed = self._changed, set()
+        points = PointCRUD(db).get_points_by_ids(sorted(changed))
+        for point in points:
+            self._index.add(point.id, point.latitude, point.longitude)
+            self._signature = max(self._signature, point.id)
+        for point_id in changed - {point.id for point in points}:
+            self._index.remove(point_id)
+
+    def invalidate(self, ids=None) -> None:
+        with self._lock:
+            if ids is None:
+                self._index = None
+            else:
+                self._changed.update(ids)
+
+
+area_index = SharedAreaIndex(cell_size=settings.AREA_INDEX_CELL_SIZE, ttl=settings.AREA_INDEX_TTL)
+point_index = SharedPointIndex(rebuild_threshold=settings.POINT_INDEX_REBUILD_THRESHOLD, ttl=settings.POINT_INDEX_TTL)
+change_notifier.subscribe(Area, area_index.invalidate)
+change_notifier.subscribe(AreaPoint, area_index.invalidate)
+change_notifier.subscribe(Point, point_index.invalidate)
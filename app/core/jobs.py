@@ -0,0 +1,173 @@
+import logging
+import threading
+import uuid
+from datetime import date
+
+from sqlalchemy import func, select
+
+from app.core.cache import change_notifier
+from app.core.config import settings
+from app.crud.crud_area import AreaCRUD
+from app.crud.crud_jobs import AnalyticsJobCRUD
+from app.db.db import replica_router
+from app.db.session import SessionLocal, engine, replica_engines
+from app.models.jobs import AnalyticsJob, AnalyticsJobStatus
+
+logger = logging.getLogger(__name__)
+
+# тема уведомлений о новых задачах: свободные исполнители всех процессов сразу забирают их
+JOBS_TOPIC = "analytics_jobs"
+
+
+class JobLimitExceeded(Exception):
+    pass
+
+
+def cancel_backends(backends: list[tuple]) -> None:
+    '''Прерывает запросы соединений (pid, реплика) на тех базах, где они открыты'''
+    for backend_pid, backend_replica in backends:
+        if backend_pid is None:
+            continue
+        backend_engine = engine if backend_replica is None else replica_engines[backend_replica]
+        with backend_engine.connect() as connection:
+            connection.execute(select(func.pg_cancel_backend(backend_pid)))
+
+
+class AnalyticsJobManager:
+    '''
+    Очередь тяжёлых расчётов аналитики, выполняемых вне пула обработчиков запросов. Задачи хранятся в базе:
+    их видят и отменяют все процессы, лимит задач пользователя общий. Исполнители каждого процесса
+    занимают ожидающие задачи через SELECT ... FOR UPDATE SKIP LOCKED
+    '''
+
+    def __init__(self, workers: int, user_limit: int, retention: int, timeout: int, poll_interval: float):
+        self.workers = workers
+        self.user_limit = user_limit
+        self.retention = retention
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self._running: set[str] = set()
+        self._wakeup = threading.Condition()
+        self._stopped = False
+        self._threads = []
+
+    def start(self) -> None:
+        self._stopped = False
+        self._threads = [
+            threading.Thread(target=self._run, name=f"analytics-job-{number}", daemon=True)
+            for number in range(self.workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def wake(self, ids=None) -> None:
+        with self._wakeup:
+            self._wakeup.notify_all()
+
+    def submit(self, owner_id: int, area_id: int, start_date: date, end_date: date) -> AnalyticsJob:
+        with SessionLocal() as db:
+            job_crud = AnalyticsJobCRUD(db)
+            job_crud.delete_expired_jobs(self.retention)
+            job = job_crud.create_job(uuid.uuid4().hex, owner_id, area_id, start_date, end_date, self.user_limit)
+            if job is None:
+                raise JobLimitExceeded()
+        change_notifier.publish(JOBS_TOPIC, [area_id])
+        return job
+
+    def get(self, job_id: str) -> AnalyticsJob | None:
+        with SessionLocal() as db:
+            return AnalyticsJobCRUD(db).get_job(job_id, self.retention)
+
+    def cancel(self, job_id: str) -> AnalyticsJob | None:
+        '''
+        Отмена из любого процесса. Запрос расчёта прерывается до фиксации отмены: строка задачи остаётся
+        заблокированной, и исполнитель не вернёт соединение расчёта в пул раньше, чем прерывание дойдёт
+        '''
+        with SessionLocal() as db:
+            cancel_backends(AnalyticsJobCRUD(db).cancel_job(job_id))
+            db.commit()
+        return self.get(job_id)
+
+    def shutdown(self) -> None:
+        '''
+        Выполняющиеся в процессе задачи возвращаются в очередь; другие процессы заберут их не позже чем
+        через poll_interval секунд
+        '''
+        with self._wakeup:
+            self._stopped = True
+            self._wakeup.notify_all()
+            running = sorted(self._running)
+        if running:
+            with SessionLocal() as db:
+                cancel_backends(AnalyticsJobCRUD(db).requeue_jobs(running))
+                db.commit()
+        for thread in self._threads:
+            thread.join()
+
+    def _run(self) -> None:
+        while not self._stopped:
+            try:
+                claimed = self._claim()
+                if claimed is not None:
+                    self._execute(*claimed)
+                    continue
+            except Exception:
+                logger.exception("Ошибка исполнителя задач аналитики")
+            with self._wakeup:
+                if not self._stopped:
+                    # уведомление могло потеряться: очередь всё равно перечитывается раз в poll_interval
+                    self._wakeup.wait(self.poll_interval)
+
+    def _claim(self) -> tuple | None:
+        '''(задача, метка занятия) или None, если ожидающих задач нет'''
+        with SessionLocal() as db:
+            job_crud = AnalyticsJobCRUD(db)
+            cancel_backends(job_crud.fail_stale_jobs(self.timeout))
+            db.commit()
+            with self._wakeup:
+                if self._stopped:
+                    return None
+                claim_token = uuid.uuid4().hex
+                job = job_crud.claim_job(claim_token)
+                if job is None:
+                    return None
+                # shutdown видит задачу сразу после занятия и вернёт её в очередь
+                self._running.add(job.id)
+            return job, claim_token
+
+    def _execute(self, job: AnalyticsJob, claim_token: str) -> None:
+        db = replica_router.read_session()
+        try:
+            backend_pid = db.execute(select(func.pg_backend_pid())).scalar()
+            bind = db.get_bind()
+            backend_replica = replica_engines.index(bind) if bind in replica_engines else None
+            with SessionLocal() as primary:
+                job_crud = AnalyticsJobCRUD(primary)
+                if not job_crud.set_backend(job.id, claim_token, backend_pid, backend_replica):
+                    return
+                try:
+                    result = AreaCRUD(db).get_area_analytics(
+                        area_id=job.areaId,
+                        start_date=job.startDate,
+                        end_date=job.endDate
+                    )
+                except Exception as error:
+                    db.rollback()
+                    # после отмены или возврата в очередь задача не изменится
+                    job_crud.finish_job(job.id, claim_token, AnalyticsJobStatus.FAILED, error=str(error))
+                else:
+                    job_crud.finish_job(job.id, claim_token, AnalyticsJobStatus.DONE, result=result)
+        finally:
+            # соединение расчёта освобождается только после записи итога задачи
+            db.close()
+            self._running.discard(job.id)
+
+
+analytics_jobs = AnalyticsJobManager(
+    workers=settings.ANALYTICS_JOB_WORKERS,
+    user_limit=settings.ANALYTICS_JOB_USER_LIMIT,
+    retention=settings.ANALYTICS_JOB_RETENTION,
+    timeout=settings.ANALYTICS_JOB_TIMEOUT,
+    poll_interval=settings.ANALYTICS_JOB_POLL_INTERVAL
+)
+change_notifier.subscribe(JOBS_TOPIC, analytics_jobs.wake)
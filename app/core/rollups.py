@@ -0,0 +1,71 @@
+import logging
+import threading
+from datetime import timedelta
+
+from app.core.analytics import AreaPresenceScanner
+from app.crud.crud_animal import AnimalCRUD
+from app.crud.crud_area import AreaCRUD
+from app.crud.crud_rollup import AreaRollupCRUD
+from app.db.session import SessionLocal
+from app.schemas.types import day_start
+
+logger = logging.getLogger(__name__)
+
+
+def aggregate_pending_days(db, max_days: int) -> int:
+    '''Считает дневные агрегаты зон за завершившиеся дни, возвращает количество обработанных дней'''
+    rollup_crud = AreaRollupCRUD(db)
+    animal_crud = AnimalCRUD(db)
+    area_crud = AreaCRUD(db)
+    positions = None
+    previous_day = None
+    processed = 0
+    for day in rollup_crud.get_pending_days(limit=max_days):
+        if not rollup_crud.lock(wait=False):
+            db.rollback()
+            break
+        area_ids = rollup_crud.get_missing_area_ids(day)
+        start = day_start(day)
+        if positions is None or previous_day != day - timedelta(days=1):
+            positions = area_crud.get_positions_at(day)
+        scanner = AreaPresenceScanner(area_crud.get_area_polygons(area_ids))
+        presence = scanner.scan(positions, animal_crud.get_movements(start, start + timedelta(days=1)))
+        rollup_crud.save_day(day, area_ids, presence, positions)
+        previous_day = day
+        processed += 1
+    return processed
+
+
+class RollupWorker:
+    '''Фоновый поток, поддерживающий дневные агрегаты зон в актуальном состоянии'''
+
+    def __init__(self, interval: int, max_days: int):
+        self.interval = interval
+        self.max_days = max_days
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="area-rollups", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval)
+
+    def run_once(self) -> None:
+        db = SessionLocal()
+        try:
+            while not self._stop.is_set() and aggregate_pending_days(db, self.max_days) == self.max_days:
+                pass
+        finally:
+            db.close()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception:
+                logger.exception("Ошибка при расчёте дневных агрегатов зон")
+            self._stop.wait(self.interval)
@@ -0,0 +1,251 @@
+import math
+from itertools import chain
+from typing import Dict, List, Tuple
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from app.core.areas import point_in_polygon, polygon_bounds
+
+
+class AreaIndex:
+    '''Равномерная сетка по ограничивающим прямоугольникам зон для поиска зон, содержащих точку'''
+
+    def __init__(self, cell_size: float = 1.0, max_cells_per_area: int = 4096):
+        self.cell_size = cell_size
+        self.max_cells_per_area = max_cells_per_area
+        self.polygons: Dict[int, List[Tuple[float, float]]] = {}
+        self.bounds: Dict[int, Tuple[float, float, float, float]] = {}
+        self.cells: Dict[Tuple[int, int], set] = {}
+        # зоны, покрывающие слишком много ячеек, проверяются при каждом запросе
+        self.large = set()
+
+    def build(self, polygons: Dict[int, List[Tuple[float, float]]]) -> "AreaIndex":
+        for area_id, polygon in polygons.items():
+            self.add(area_id, polygon)
+        return self
+
+    def _cell(self, latitude: float, longitude: float) -> Tuple[int, int]:
+        return math.floor(latitude / self.cell_size), math.floor(longitude / self.cell_size)
+
+    def _cells_range(self, bounds: Tuple[float, float, float, float]):
+        min_lat, min_lon = self._cell(bounds[0], bounds[1])
+        max_lat, max_lon = self._cell(bounds[2], bounds[3])
+        return range(min_lat, max_lat + 1), range(min_lon, max_lon + 1)
+
+    def add(self, area_id: int, polygon: List[Tuple[float, float]]) -> None:
+        self.remove(area_id)
+        bounds = polygon_bounds(polygon)
+        self.polygons[area_id] = polygon
+        self.bounds[area_id] = bounds
+        lat_cells, lon_cells = self._cells_range(bounds)
+        if len(lat_cells) * len(lon_cells) > self.max_cells_per_area:
+            self.large.add(area_id)
+            return
+        for i in lat_cells:
+            for j in lon_cells:
+                self.cells.setdefault((i, j), set()).add(area_id)
+
+    def remove(self, area_id: int) -> None:
+        bounds = self.bounds.pop(area_id, None)
+        if bounds is None:
+            return
+        del self.polygons[area_id]
+        if area_id in self.large:
+            self.large.discard(area_id)
+            return
+        lat_cells, lon_cells = self._cells_range(bounds)
+        for i in lat_cells:
+            for j in lon_cells:
+                cell = self.cells.get((i, j))
+                cell.discard(area_id)
+                if not cell:
+                    del self.cells[(i, j)]
+
+    def overlapping(self, bounds: Tuple[float, float, float, float]) -> List[int]:
+        '''Зоны, ограничивающие прямоугольники которых пересекаются с bounds (min_lat, min_lon, max_lat, max_lon)'''
+        lat_cells, lon_cells = self._cells_range(bounds)
+        if len(lat_cells) * len(lon_cells) > self.max_cells_per_area:
+            candidates = self.bounds.keys()
+        else:
+            candidates = set(self.large)
+            for i in lat_cells:
+                for j in lon_cells:
+                    candidates.update(self.cells.get((i, j), ()))
+        return sorted(
+            area_id for area_id in candidates
+            if self.bounds[area_id][0] <= bounds[2] and bounds[0] <= self.bounds[area_id][2]
+            and self.bounds[area_id][1] <= bounds[3] and bounds[1] <= self.bounds[area_id][3]
+        )
+
+    def containing(self, latitude: float, longitude: float) -> List[int]:
+        candidates = chain(self.cells.get(self._cell(latitude, longitude), ()), self.large)
+        return sorted(
+            area_id for area_id in candidates
+            if self.bounds[area_id][0] <= latitude <= self.bounds[area_id][2]
+            and self.bounds[area_id][1] <= longitude <= self.bounds[area_id][3]
+            and point_in_polygon(latitude, longitude, self.polygons[area_id])
+        )
+
+
+EARTH_RADIUS = 6371008.8
+
+
+def unit_vectors(latitudes, longitudes) -> np.ndarray:
+    '''Точки на единичной сфере: хордовое расстояние между ними монотонно по расстоянию гаверсинусов'''
+    latitudes = np.radians(np.asarray(latitudes, dtype=float))
+    longitudes = np.radians(np.asarray(longitudes, dtype=float))
+    cos_latitudes = np.cos(latitudes)
+    return np.column_stack((cos_latitudes * np.cos(longitudes), cos_latitudes * np.sin(longitudes), np.sin(latitudes)))
+
+
+def meters_to_chord(meters: float) -> float:
+    return 2 * math.sin(min(meters / EARTH_RADIUS, math.pi) / 2)
+
+
+class PointIndex:
+    '''
+    KD-дерево по точкам на единичной сфере. Новые и изменённые точки копятся в буфере, удалённые
+    и изменённые точки дерева помечаются; буфер вливается в дерево, когда изменений становится много
+    '''
+
+    def __init__(self, rebuild_threshold: int = 1024):
+        self.rebuild_threshold = rebuild_threshold
+        self.pending: Dict[int, Tuple[float, float]] = {}
+        self.removed = set()
+        self._pending_arrays = None
+        self._set_base(np.empty(0, dtype=np.int64), np.empty(0), np.empty(0))
+
+    def build(self, ids, latitudes, longitudes) -> "PointIndex":
+        self.pending.clear()
+        self.removed.clear()
+        self._pending_arrays = None
+        self._set_base(ids, latitudes, longitudes)
+        return self
+
+    def _set_base(self, ids, latitudes, longitudes) -> None:
+        ids = np.asarray(ids, dtype=np.int64)
+        order = np.argsort(ids, kind="stable")
+        self.ids = ids[order]
+        self.latitudes = np.asarray(latitudes, dtype=float)[order]
+        self.longitudes = np.asarray(longitudes, dtype=float)[order]
+        self.tree = cKDTree(unit_vectors(self.latitudes, self.longitudes)) if len(self.ids) else None
+        # полосы по широте для запросов по прямоугольнику
+        self.latitude_order = np.argsort(self.latitudes, kind="stable")
+        self.sorted_latitudes = self.latitudes[self.latitude_order]
+
+    def __len__(self) -> int:
+        return len(self.ids) - len(self.removed) + len(self.pending)
+
+    def _in_base(self, point_id: int) -> bool:
+        index = np.searchsorted(self.ids, point_id)
+        return index < len(self.ids) and self.ids[index] == point_id
+
+    def add(self, point_id: int, latitude: float, longitude: float) -> None:
+        if self._in_base(point_id):
+            self.removed.add(point_id)
+        self.pending[point_id] = (latitude, longitude)
+        self._pending_arrays = None
+        self._compact_if_needed()
+
+    def remove(self, point_id: int) -> None:
+        if self._in_base(point_id):
+            self.removed.add(point_id)
+        self.pending.pop(point_id, None)
+        self._pending_arrays = None
+        self._compact_if_needed()
+
+    def _compact_if_needed(self) -> None:
+        if len(self.pending) + len(self.removed) > self.rebuild_threshold:
+            self.compact()
+
+    def compact(self) -> None:
+        keep = ~np.isin(self.ids, np.fromiter(self.removed, dtype=np.int64, count=len(self.removed)))
+        pending_ids, pending_latitudes, pending_longitudes, _ = self._get_pending_arrays()
+        self.build(
+            np.concatenate((self.ids[keep], pending_ids)),
+            np.concatenate((self.latitudes[keep], pending_latitudes)),
+            np.concatenate((self.longitudes[keep], pending_longitudes))
+        )
+
+    def _get_pending_arrays(self):
+        if self._pending_arrays is None:
+            ids = np.fromiter(self.pending, dtype=np.int64, count=len(self.pending))
+            coordinates = np.array(list(self.pending.values()), dtype=float).reshape(-1, 2)
+            self._pending_arrays = (
+                ids, coordinates[:, 0], coordinates[:, 1], cKDTree(unit_vectors(coordinates[:, 0], coordinates[:, 1]))
+            )
+        return self._pending_arrays
+
+    def _without_removed(self, ids: np.ndarray) -> np.ndarray:
+        if not self.removed:
+            return ids
+        return ids[~np.isin(ids, np.fromiter(self.removed, dtype=np.int64, count=len(self.removed)))]
+
+    def within_bbox(self, min_latitude: float, min_longitude: float, max_latitude: float, max_longitude: float) -> np.ndarray:
+        '''Отсортированные id точек в прямоугольнике; min_longitude > max_longitude - прямоугольник через 180-й меридиан'''
+        def longitude_mask(longitudes):
+            if min_longitude <= max_longitude:
+                return (longitudes >= min_longitude) & (longitudes <= max_longitude)
+            return (longitudes >= min_longitude) | (longitudes <= max_longitude)
+
+        start = np.searchsorted(self.sorted_latitudes, min_latitude, side="left")
+        end = np.searchsorted(self.sorted_latitudes, max_latitude, side="right")
+        candidates = self.latitude_order[start:end]
+        ids = self._without_removed(self.ids[candidates[longitude_mask(self.longitudes[candidates])]])
+        if self.pending:
+            pending_ids, latitudes, longitudes, _ = self._get_pending_arrays()
+            mask = (latitudes >= min_latitude) & (latitudes <= max_latitude) & longitude_mask(longitudes)
+            ids = np.concatenate((ids, pending_ids[mask]))
+        return np.sort(ids)
+
+    def within_radius(self, latitude: float, longitude: float, radius: float) -> np.ndarray:
+        '''Отсортированные id точек не дальше radius метров'''
+        target = unit_vectors([latitude], [longitude])[0]
+        chord = meters_to_chord(radius)
+        ids = np.empty(0, dtype=np.int64)
+        if self.tree is not None:
+            ids = self._without_removed(self.ids[np.asarray(self.tree.query_ball_point(target, chord), dtype=np.int64)])
+        if self.pending:
+            pending_ids, _, _, tree = self._get_pending_arrays()
+            ids = np.concatenate((ids, pending_ids[np.asarray(tree.query_ball_point(target, chord), dtype=np.int64)]))
+        return np.sort(ids)
+
+    def nearest(self, latitude: float, longitude: float, k: int, max_distance: float = None) -> List[tuple]:
+        '''k ближайших точек (id, широта, долгота, расстояние в метрах) не дальше max_distance метров'''
+        lat, lon = math.radians(latitude), math.radians(longitude)
+        target = (math.cos(lat) * math.cos(lon), math.cos(lat) * math.sin(lon), math.sin(lat))
+        bound = meters_to_chord(max_distance) if max_distance is not None else np.inf
+        candidates = []
+        if self.tree is not None:
+            query_k = min(k, len(self.ids))
+            while True:
+                # граница с запасом: дерево отбрасывает соседей строго дальше неё, точная проверка ниже
+                distances, indexes = self.tree.query(
+                    target, k=[*range(1, query_k + 1)], distance_upper_bound=bound * (1 + 1e-9)
+                )
+                n = len(self.ids)
+                candidates = [
+                    (distance, index) for distance, index in zip(distances.tolist(), indexes.tolist())
+                    if index < n and (not self.removed or int(self.ids[index]) not in self.removed)
+                ]
+                if len(candidates) >= k or query_k >= len(self.ids) or math.isinf(distances[-1]):
+                    break
+                query_k = min(k + len(self.removed), len(self.ids))
+            candidates = [
+                (distance, int(self.ids[index]), float(self.latitudes[index]), float(self.longitudes[index]))
+                for distance, index in candidates
+            ]
+        if self.pending:
+            ids, latitudes, longitudes, tree = self._get_pending_arrays()
+            distances, indexes = tree.query(target, k=[*range(1, min(k, len(ids)) + 1)])
+            for distance, index in zip(distances.tolist(), indexes.tolist()):
+                candidates.append((distance, int(ids[index]), float(latitudes[index]), float(longitudes[index])))
+        candidates.sort()
+        result = []
+        for chord, point_id, point_latitude, point_longitude in candidates[:k]:
+            meters = 2 * EARTH_RADIUS * math.asin(min(chord / 2, 1.0))
+            if max_distance is not None and meters > max_distance:
+                break
+            result.append((point_id, point_latitude, point_longitude, meters))
+        return result
@@ -0,0 +1,84 @@
+from datetime import datetime
+from typing import Dict, Iterable, List
+
+import numpy as np
+
+from app.core.spatial import EARTH_RADIUS, AreaIndex
+
+
+def haversine(latitudes1, longitudes1, latitudes2, longitudes2) -> np.ndarray:
+    '''Расстояния в метрах между парами точек'''
+    latitudes1, longitudes1 = np.radians(latitudes1), np.radians(longitudes1)
+    latitudes2, longitudes2 = np.radians(latitudes2), np.radians(longitudes2)
+    a = (np.sin((latitudes2 - latitudes1) / 2) ** 2
+         + np.cos(latitudes1) * np.cos(latitudes2) * np.sin((longitudes2 - longitudes1) / 2) ** 2)
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def build_trajectories(rows: List, until: Dict[int, datetime], area_index: AreaIndex) -> Dict[int, dict]:
+    '''
+    rows - остановки (animal_id, время в секундах, point_id, latitude, longitude), упорядоченные по животному и времени;
+    until - конец последней остановки каждого животного. Участки и время остановок считаются сразу
+    для всех животных; участки между разными животными отбрасываются
+    '''
+    trajectories = {animal_id: empty_trajectory(animal_id) for animal_id in until}
+    if not rows:
+        return trajectories
+    animal_ids, times, point_ids, latitudes, longitudes = zip(*rows)
+    animal_ids = np.asarray(animal_ids, dtype=np.int64)
+    point_ids = np.asarray(point_ids, dtype=np.int64)
+    times = np.asarray(times, dtype=float)
+    latitudes = np.asarray(latitudes, dtype=float)
+    longitudes = np.asarray(longitudes, dtype=float)
+
+    same_animal = animal_ids[1:] == animal_ids[:-1]
+    distances = np.where(same_animal, haversine(latitudes[:-1], longitudes[:-1], latitudes[1:], longitudes[1:]), 0.0)
+    durations = times[1:] - times[:-1]
+    # участки с нулевой длительностью не дают скорости
+    speeds = np.where(same_animal & (durations > 0), distances / np.where(durations > 0, durations, 1), 0.0)
+    # остановка длится до следующей остановки того же животного, последняя - до until
+    ends = np.empty_like(times)
+    ends[:-1] = np.where(same_animal, times[1:], 0.0)
+    last = np.append(~same_animal, True)
+    ends[last] = [until[animal_id].timestamp() for animal_id in animal_ids[last]]
+    dwell = np.maximum(ends - times, 0.0)
+
+    starts = np.flatnonzero(np.insert(~same_animal, 0, True))
+    bounds = np.append(starts, len(animal_ids))
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        trajectory = trajectories[int(animal_ids[start])]
+        if end - start > 1:
+            trajectory["totalDistance"] = float(distances[start:end - 1].sum())
+            trajectory["maxSpeed"] = float(speeds[start:end - 1].max())
+        trajectory["points"] = _dwell_by_point(point_ids[start:end], dwell[start:end])
+        coordinates = {int(point_id): (latitude, longitude) for point_id, latitude, longitude
+                       in zip(point_ids[start:end], latitudes[start:end], longitudes[start:end])}
+        trajectory["areas"] = _dwell_by_area(trajectory["points"], coordinates, area_index)
+    return trajectories
+
+
+def track_end(now: datetime, end: datetime = None, death_time: datetime = None) -> datetime:
+    '''Конец последней остановки: конец периода, но не позже текущего момента и смерти животного'''
+    # время без часового пояса считается местным, как и в фильтрах запросов
+    return min(moment.astimezone() for moment in (now, end, death_time) if moment is not None)
+
+
+def empty_trajectory(animal_id: int) -> dict:
+    return {"animalId": animal_id, "totalDistance": 0.0, "maxSpeed": 0.0, "points": [], "areas": []}
+
+
+def _dwell_by_point(point_ids: np.ndarray, dwell: np.ndarray) -> List[dict]:
+    unique_ids, inverse, visits = np.unique(point_ids, return_inverse=True, return_counts=True)
+    totals = np.bincount(inverse, weights=dwell)
+    return [
+        {"locationPointId": int(point_id), "visits": int(count), "dwellTime": float(total)}
+        for point_id, count, total in zip(unique_ids, visits, totals)
+    ]
+
+
+def _dwell_by_area(points: Iterable[dict], coordinates: dict, area_index: AreaIndex) -> List[dict]:
+    areas = {}
+    for point in points:
+        for area_id in area_index.containing(*coordinates[point["locationPointId"]]):
+            areas[area_id] = areas.get(area_id, 0.0) + point["dwellTime"]
+    return [{"areaId": area_id, "dwellTime": areas[area_id]} for area_id in sorted(areas)]
@@ -0,0 +1,130 @@
+import logging
+import threading
+import time
+from concurrent.futures import Future
+
+from fastapi import HTTPException, status
+
+from app.core.config import settings
+from app.core.geofence import geofence_tracker
+from app.crud.crud_animal import AnimalCRUD
+from app.db.session import SessionLocal
+from app.models.animals import AnimalAlive
+from app.schemas.animals import animal_location_from_row
+
+logger = logging.getLogger(__name__)
+
+
+class VisitBatcher:
+    '''
+    Групповая фиксация посещений. Запросы ставят посещения в общую очередь; фоновый поток забирает их
+    пачкой не больше max_rows, подождав после первого не дольше delay секунд, и записывает одной вставкой
+    в одной транзакции. Перед вставкой строки животных блокируются и проверки животного повторяются,
+    поэтому посещение, потерявшее смысл за время ожидания, отклоняется, а не записывается
+    '''
+
+    def __init__(self, delay: float, max_rows: int):
+        self.delay = delay
+        self.max_rows = max_rows
+        self._queue: list[tuple] = []
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._thread = None
+
+    def start(self) -> None:
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name="visit-batcher", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        '''Очередь дописывается до остановки'''
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+
+    def add(self, animal_id: int, point_id: int) -> dict:
+        '''Ставит посещение в очередь и ждёт фиксации его пачки; ошибки проверки - HTTPException'''
+        future = Future()
+        with self._condition:
+            if self._stopped or self._thread is None:
+                raise RuntimeError("Групповая запись посещений не запущена")
+            self._queue.append((animal_id, point_id, future))
+            if len(self._queue) == 1 or len(self._queue) >= self.max_rows:
+                self._condition.notify()
+        return future.result()
+
+    def _take(self) -> list[tuple]:
+        with self._condition:
+            while not self._queue and not self._stopped:
+                self._condition.wait()
+            deadline = time.monotonic() + self.delay
+            while len(self._queue) < self.max_rows and not self._stopped:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            batch, self._queue = self._queue[:self.max_rows], self._queue[self.max_rows:]
+            return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._take()
+            if not batch:
+                return
+            self._flush(batch)
+
+    def _flush(self, batch: list[tuple]) -> None:
+        try:
+            results = self.write(batch)
+        except Exception as error:
+            if len(batch) == 1:
+                batch[0][2].set_exception(error)
+                return
+            # одна ошибочная строка не должна отменять всю пачку
+            logger.exception("Ошибка групповой записи %s посещений, запись по одному", len(batch))
+            for item in batch:
+                self._flush([item])
+            return
+        for (_, _, future), result in zip(batch, results):
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    @staticmethod
+    def write(batch: list[tuple]) -> list:
+        '''Записывает пачку; для каждого посещения - посещение или ошибка проверки'''
+        with SessionLocal() as db:
+            animal_crud = AnimalCRUD(db)
+            animals = animal_crud.lock_animals(sorted({animal_id for animal_id, _, _ in batch}))
+            current_points = {animal_id: current_point_id for animal_id, (current_point_id, _) in animals.items()}
+            results, visits, moves = [], [], []
+            for animal_id, point_id, _ in batch:
+                if animal_id not in animals:
+                    results.append(HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                                                 detail=f"Животное с id {animal_id} не найдено"))
+                elif animals[animal_id][1] == AnimalAlive.DEAD:
+                    results.append(HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                                 detail=f"Животное с id {animal_id} мертво"))
+                elif current_points[animal_id] == point_id:
+                    results.append(HTTPException(
+                        status_code=status.HTTP_400_BAD_REQUEST,
+                        detail="Попытка добавить точку локации, в которой уже находится животное"))
+                else:
+                    results.append(None)
+                    visits.append((animal_id, point_id))
+                    moves.append((animal_id, current_points[animal_id], point_id))
+                    current_points[animal_id] = point_id
+            if not visits:
+                return results
+            rows = iter(animal_crud.insert_animal_locations(visits))
+            animal_crud.set_current_points({animal_id: current_points[animal_id] for animal_id, _ in visits})
+            geofence_tracker.record(db, moves)
+            db.commit()
+        return [result if result is not None else animal_location_from_row(next(rows)) for result in results]
+
+
+visit_batcher = VisitBatcher(delay=settings.VISIT_GROUP_COMMIT_DELAY, max_rows=settings.VISIT_GROUP_COMMIT_MAX_ROWS)
+
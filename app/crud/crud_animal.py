@@ -1,4 +1,6 @@
 from datetime import datetime
+from sqlalchemy import Integer, any_, bindparam, func, insert, literal, select, union_all, update
+from sqlalchemy.dialects.postgresql import ARRAY
 from app.crud.base import CRUDBase
 from app.models.animals import AnimalAlive, AnimalGender, AnimalType, Animal, AnimalTypeAnimal, AnimalLocation
 from app.models.points import Point
@@ -12,11 +14,50 @@ class AnimalCRUD(CRUDBase):
     def get_animal_by_id(self, id: int) -> Animal | None:
         return self.db.query(Animal).filter(Animal.id == id).first()
 
+    def get_animal_version(self, animalId: int) -> tuple | None:
+        '''Версия животного вместе с количеством и максимальным id посещений и связей с типами'''
+        def aggregate(function, column, condition):
+            return self.db.query(function(column)).filter(condition).scalar_subquery()
+
+        row = self.db.query(
+            Animal.version,
+            aggregate(func.count, AnimalLocation.id, AnimalLocation.animalId == animalId),
+            aggregate(func.max, AnimalLocation.id, AnimalLocation.animalId == animalId),
+            aggregate(func.count, AnimalTypeAnimal.id, AnimalTypeAnimal.animal_id == animalId),
+            aggregate(func.max, AnimalTypeAnimal.id, AnimalTypeAnimal.animal_id == animalId),
+        ).filter(Animal.id == animalId).first()
+        return tuple(row) if row else None
+
     def get_last_animal_location(self, animalId: int) -> AnimalLocation | None:
         return self.db.query(AnimalLocation).filter(AnimalLocation.animalId == animalId).order_by(AnimalLocation.dateTimeOfVisitLocationPoint.desc()).first()
 
+    def get_current_point(self, animal: Animal) -> Point | None:
+        '''Текущее положение животного: последняя посещённая точка, иначе точка чипирования'''
+        return self.db.query(Point).filter(Point.id == animal.currentPointId).first()
+
+    def _get_current_point_id(self, animal: Animal) -> int:
+        last_location = self.get_last_animal_location(animal.id)
+        return last_location.locationPointId if last_location else animal.chippingLocationId
+
+    def refresh_current_point(self, animalId: int) -> Animal:
+        animal = self.get_animal_by_id(animalId)
+        animal.currentPointId = self._get_current_point_id(animal)
+        return self.update(animal)
+
+    def get_animals_at_points(self, point_ids: list[int], from_: int, size: int) -> list[Animal]:
+        '''Животные, текущее положение которых - одна из точек point_ids'''
+        if not point_ids:
+            return []
+        return (
+            self.db.query(Animal)
+            .filter(Animal.currentPointId == any_(literal(point_ids, ARRAY(Integer))))
+            .order_by(Animal.id)
+            .slice(from_, from_ + size)
+            .all()
+        )
+
     def get_animal_chipping_location(self, animalId: int) -> Point | None:
-        return self.db.query(Point).join(Animal).filter(Animal.id == animalId).order_by(Animal.chippingDateTime.desc()).first()
+        return self.db.query(Point).join(Animal, Animal.chippingLocationId == Point.id).filter(Animal.id == animalId).order_by(Animal.chippingDateTime.desc()).first()
 
     def get_first_animal_location(self, animalId: int) -> AnimalLocation | None:
         return self.get_animal_location_by_offset(animalId, 0)
@@ -29,7 +70,9 @@ class AnimalCRUD(CRUDBase):
 
     def update_animal_location(self, animalLocation: AnimalLocation, new_location_id: int) -> AnimalLocation:
         animalLocation.locationPointId = new_location_id
-        return self.update(animalLocation)
+        animalLocation = self.update(animalLocation)
+        self.refresh_current_point(animalLocation.animalId)
+        return animalLocation
 
     def update_animal(self, animal: Animal, weight: int, length: int, height: int, gender: AnimalGender, chipperId: int, chippingLocationId: int, lifeStatus: AnimalAlive) -> Animal:
         animal.weight = weight
@@ -39,6 +82,7 @@ class AnimalCRUD(CRUDBase):
         animal.lifeStatus = lifeStatus
         animal.chipperId = chipperId
         animal.chippingLocationId = chippingLocationId
+        animal.currentPointId = self._get_current_point_id(animal)
         if lifeStatus == AnimalAlive.DEAD and animal.deathDateTime is None:
             animal.deathDateTime = datetime.now()
         return self.update(animal)
@@ -69,7 +113,7 @@ class AnimalCRUD(CRUDBase):
     def get_animal_locations_count(self, animalId: int):
         return self.db.query(AnimalLocation).filter(AnimalLocation.animalId == animalId).count()
 
-    def get_animal_locations(self, animalId: int, startDateTime: datetime, endDateTime: datetime, from_: int, size: int) -> list[AnimalLocation] | None:
+    def _animal_locations_query(self, animalId: int, startDateTime: datetime, endDateTime: datetime, from_: int, size: int):
         query = self.db.query(AnimalLocation).filter(
             AnimalLocation.animalId == animalId)
         if startDateTime:
@@ -80,10 +124,126 @@ class AnimalCRUD(CRUDBase):
                 AnimalLocation.dateTimeOfVisitLocationPoint <= endDateTime)
         query = query.order_by(
             AnimalLocation.dateTimeOfVisitLocationPoint.asc())
-        query = query.slice(from_, from_ + size)
-        return query.all()
+        return query.slice(from_, from_ + size)
 
-    def search_animals(self, startDateTime: datetime, endDateTime: datetime, chipperId: int, lifeStatus: AnimalAlive, gender: AnimalGender, from_: int, size: int) -> list[Animal] | None:
+    def get_animal_locations(self, animalId: int, startDateTime: datetime, endDateTime: datetime, from_: int, size: int) -> list[AnimalLocation] | None:
+        return self._animal_locations_query(animalId, startDateTime, endDateTime, from_, size).all()
+
+    def get_animal_locations_rows(self, animalId: int, startDateTime: datetime, endDateTime: datetime, from_: int, size: int) -> list:
+        return self._animal_locations_query(animalId, startDateTime, endDateTime, from_, size).with_entities(
+            AnimalLocation.id, AnimalLocation.dateTimeOfVisitLocationPoint, AnimalLocation.locationPointId
+        ).all()
+
+    def get_positions_before(self, date_time: datetime) -> dict[int, tuple[float, float]]:
+        '''Последние координаты каждого животного, известные до date_time'''
+        chipping_positions = (
+            self.db.query(Animal.id, Point.latitude, Point.longitude)
+            .join(Point, Point.id == Animal.chippingLocationId)
+            .filter(Animal.chippingDateTime < date_time)
+        )
+        last_visits = (
+            self.db.query(AnimalLocation.animalId, Point.latitude, Point.longitude)
+            .join(Point, Point.id == AnimalLocation.locationPointId)
+            .filter(AnimalLocation.dateTimeOfVisitLocationPoint < date_time)
+            .order_by(AnimalLocation.animalId, AnimalLocation.dateTimeOfVisitLocationPoint.desc())
+            .distinct(AnimalLocation.animalId)
+        )
+        positions = {animal_id: (latitude, longitude) for animal_id, latitude, longitude in chipping_positions}
+        positions.update((animal_id, (latitude, longitude)) for animal_id, latitude, longitude in last_visits)
+        return positions
+
+    def _movements_subquery(self, start: datetime, end: datetime):
+        chippings = (
+            self.db.query(
+                Animal.id.label("animal_id"),
+                Animal.chippingDateTime.label("date_time"),
+                Point.latitude.label("latitude"),
+                Point.longitude.label("longitude")
+            )
+            .join(Point, Point.id == Animal.chippingLocationId)
+            .filter(Animal.chippingDateTime >= start, Animal.chippingDateTime < end)
+        )
+        visits = (
+            self.db.query(
+                AnimalLocation.animalId,
+                AnimalLocation.dateTimeOfVisitLocationPoint,
+                Point.latitude,
+                Point.longitude
+            )
+            .join(Point, Point.id == AnimalLocation.locationPointId)
+            .filter(
+                AnimalLocation.dateTimeOfVisitLocationPoint >= start,
+                AnimalLocation.dateTimeOfVisitLocationPoint < end
+            )
+        )
+        return union_all(chippings.statement, visits.statement).subquery()
+
+    def get_movements(self, start: datetime, end: datetime):
+        '''Чипирования и посещения в полуинтервале [start, end) в хронологическом порядке для каждого животного'''
+        movements = self._movements_subquery(start, end)
+        return (
+            self.db.query(movements.c.animal_id, movements.c.latitude, movements.c.longitude)
+            .order_by(movements.c.animal_id, movements.c.date_time)
+        )
+
+    def get_timed_movements(self, start: datetime, end: datetime):
+        '''То же, что get_movements, со временем перемещения: (animal_id, date_time, latitude, longitude)'''
+        movements = self._movements_subquery(start, end)
+        return (
+            self.db.query(movements.c.animal_id, movements.c.date_time, movements.c.latitude, movements.c.longitude)
+            .order_by(movements.c.animal_id, movements.c.date_time)
+        )
+
+    def get_tracks_rows(self, animal_ids: list[int], start: datetime = None, end: datetime = None) -> list:
+        '''
+        Остановки животных за период одним запросом: чипирование и посещения с координатами точек,
+        строки (animal_id, время в секундах Unix, point_id, latitude, longitude) по животным в хронологическом порядке
+        '''
+        chippings = (
+            self.db.query(
+                Animal.id.label("animal_id"),
+                Animal.chippingDateTime.label("date_time"),
+                Animal.chippingLocationId.label("point_id"),
+                Point.latitude.label("latitude"),
+                Point.longitude.label("longitude")
+            )
+            .join(Point, Point.id == Animal.chippingLocationId)
+            .filter(Animal.id.in_(animal_ids))
+        )
+        visits = (
+            self.db.query(
+                AnimalLocation.animalId,
+                AnimalLocation.dateTimeOfVisitLocationPoint,
+                AnimalLocation.locationPointId,
+                Point.latitude,
+                Point.longitude
+            )
+            .join(Point, Point.id == AnimalLocation.locationPointId)
+            .filter(AnimalLocation.animalId.in_(animal_ids))
+        )
+        if start:
+            chippings = chippings.filter(Animal.chippingDateTime >= start)
+            visits = visits.filter(AnimalLocation.dateTimeOfVisitLocationPoint >= start)
+        if end:
+            chippings = chippings.filter(Animal.chippingDateTime <= end)
+            visits = visits.filter(AnimalLocation.dateTimeOfVisitLocationPoint <= end)
+        stops = union_all(chippings.statement, visits.statement).subquery()
+        query = (
+            select(
+                stops.c.animal_id,
+                func.date_part("epoch", stops.c.date_time),
+                stops.c.point_id,
+                stops.c.latitude,
+                stops.c.longitude
+            )
+            .order_by(stops.c.animal_id, stops.c.date_time)
+        )
+        return self.db.execute(query).all()
+
+    def get_death_times(self, animal_ids: list[int]) -> dict[int, datetime | None]:
+        return dict(self.db.query(Animal.id, Animal.deathDateTime).filter(Animal.id.in_(animal_ids)))
+
+    def _search_animals_query(self, startDateTime: datetime, endDateTime: datetime, chipperId: int, lifeStatus: AnimalAlive, gender: AnimalGender, from_: int, size: int):
         query = self.db.query(Animal)
         if startDateTime:
             query = query.filter(
@@ -101,8 +261,37 @@ class AnimalCRUD(CRUDBase):
             query = query.filter(Animal.gender == gender)
         query = query.order_by(
             Animal.chippingDateTime.asc())
-        query = query.slice(from_, from_ + size)
-        return query.all()
+        return query.slice(from_, from_ + size)
+
+    def search_animals(self, startDateTime: datetime, endDateTime: datetime, chipperId: int, lifeStatus: AnimalAlive, gender: AnimalGender, from_: int, size: int) -> list[Animal] | None:
+        return self._search_animals_query(startDateTime, endDateTime, chipperId, lifeStatus, gender, from_, size).all()
+
+    def search_animals_rows(self, startDateTime: datetime, endDateTime: datetime, chipperId: int, lifeStatus: AnimalAlive, gender: AnimalGender, from_: int, size: int) -> list:
+        '''То же, что search_animals, но строками со списками посещений и типов, без загрузки объектов'''
+        return self._search_animals_query(startDateTime, endDateTime, chipperId, lifeStatus, gender, from_, size) \
+            .with_entities(*self._animal_row_columns()).all()
+
+    def get_animals_rows_by_ids(self, ids: list[int]) -> list:
+        return self.db.query(Animal).filter(Animal.id.in_(ids)).with_entities(*self._animal_row_columns()).all()
+
+    def _animal_row_columns(self) -> tuple:
+        visited_locations = (
+            self.db.query(AnimalLocation.id)
+            .filter(AnimalLocation.animalId == Animal.id)
+            .order_by(AnimalLocation.id)
+            .scalar_subquery()
+        )
+        animal_types = (
+            self.db.query(AnimalTypeAnimal.type_id)
+            .filter(AnimalTypeAnimal.animal_id == Animal.id)
+            .order_by(AnimalTypeAnimal.id)
+            .scalar_subquery()
+        )
+        return (
+            Animal.weight, Animal.height, Animal.length, Animal.gender, Animal.chipperId,
+            Animal.chippingLocationId, Animal.id, Animal.lifeStatus, Animal.chippingDateTime,
+            Animal.deathDateTime, func.array(visited_locations), func.array(animal_types)
+        )
 
     def create_animal(
         self,
@@ -121,7 +310,8 @@ class AnimalCRUD(CRUDBase):
                 height=height,
                 gender=gender,
                 chipperId=chipperId,
-                chippingLocationId=chippingLocationId
+                chippingLocationId=chippingLocationId,
+                currentPointId=chippingLocationId
             )
         )
         for animal_type in types:
@@ -134,12 +324,49 @@ class AnimalCRUD(CRUDBase):
         return animal
 
     def add_animal_location(self, animalId: int, locationPointId: int) -> AnimalLocation:
-        return self.create(
+        animal_location = self.create(
             AnimalLocation(
                 animalId=animalId,
                 locationPointId=locationPointId,
             )
         )
+        self.refresh_current_point(animalId)
+        return animal_location
+
+    def lock_animals(self, animal_ids: list[int]) -> dict[int, tuple]:
+        '''Текущая точка и статус животных, строки блокируются до конца транзакции'''
+        rows = (
+            self.db.query(Animal.id, Animal.currentPointId, Animal.lifeStatus)
+            .filter(Animal.id.in_(animal_ids))
+            .order_by(Animal.id)
+            .with_for_update()
+        )
+        return {animal_id: (current_point_id, life_status) for animal_id, current_point_id, life_status in rows}
+
+    def insert_animal_locations(self, visits: list[tuple[int, int]]) -> list:
+        '''
+        Посещения (животное, точка) одной вставкой без фиксации транзакции; строки (id, время, точка)
+        в порядке visits. Время - момент вставки строки, а не начала транзакции: посещения одного животного
+        в одной вставке получают разное время
+        '''
+        return self.db.execute(
+            insert(AnimalLocation)
+            .values([
+                {"animalId": animal_id, "locationPointId": point_id,
+                 "dateTimeOfVisitLocationPoint": func.clock_timestamp()}
+                for animal_id, point_id in visits
+            ])
+            .returning(AnimalLocation.id, AnimalLocation.dateTimeOfVisitLocationPoint, AnimalLocation.locationPointId)
+        ).all()
+
+    def set_current_points(self, current_points: dict[int, int]) -> None:
+        animals = Animal.__table__
+        self.db.execute(
+            update(animals)
+            .where(animals.c.id == bindparam("animal_id"))
+            .values(currentPointId=bindparam("point_id"), version=animals.c.version + 1),
+            [{"animal_id": animal_id, "point_id": point_id} for animal_id, point_id in current_points.items()]
+        )
 
     def add_animal_type(self, animalId: int, typeId: int) -> AnimalTypeAnimal:
         return self.create(
@@ -1,17 +1,30 @@
-from datetime import datetime
+from datetime import date, datetime, timedelta, timezone
 from typing import List, Union
 
 from fastapi import HTTPException
-from sqlalchemy import func, or_, and_
+from sqlalchemy import func, insert, literal, or_, and_, select
+from sqlalchemy.dialects.postgresql import aggregate_order_by
+from sqlalchemy.orm import selectinload
+from app.core.areas import AreaValidator, area_fingerprint, polygon_bounds, polygons_overlap
+from app.core.analytics import AreaPresenceScanner, area_stay_events, build_area_analytics, days_between, group_consecutive_days, merge_presence, occupancy_series
+from app.core.cache import change_notifier
+from app.core.spatial import AreaIndex
 from app.crud.base import CRUDBase
+from app.crud.crud_animal import AnimalCRUD
+from app.crud.crud_rollup import AreaRollupCRUD
 from app.models.animals import Animal, AnimalLocation, AnimalType, AnimalTypeAnimal
 from app.models.areas import Area, AreaPoint
 from app.models.points import Point
+from app.schemas.areas import CreateArea, OccupancyBucket
 from app.schemas.locations import LocationBase
+from app.schemas.types import day_start, format_datetime
+
+AREA_IMPORT_LOCK_KEY = 42001
+
 
 class AreaCRUD(CRUDBase):
     def create_area(self, name: str, points: list[LocationBase]) -> Area:
-        area = self.create(Area(name=name))
+        area = self.create(Area(name=name, fingerprint=area_fingerprint(points)))
         return self.create_area_points(area, points)
 
     def create_area_points(self, area: Area, points: list[LocationBase]) -> Area:
@@ -30,37 +43,23 @@ class AreaCRUD(CRUDBase):
     def get_area(self, area_id: int) -> Area | None:
         return self.get(area_id, Area)
 
+    def get_area_version(self, area_id: int) -> tuple | None:
+        '''Версия зоны и максимальный id её точек: точки при изменении зоны создаются заново'''
+        points = self.db.query(func.max(AreaPoint.id)).filter(AreaPoint.area_id == area_id).scalar_subquery()
+        row = self.db.query(Area.version, points).filter(Area.id == area_id).first()
+        return tuple(row) if row else None
+
     def update_area(self, db_area: Area, name: str, points: List[LocationBase]) -> Area:
         db_area.name = name
+        db_area.fingerprint = area_fingerprint(points)
         for point in db_area.areaPoints:
             self.delete(point)
         return self.create_area_points(db_area, points)
 
     def area_by_points(self, points: list[LocationBase]) -> Area | None:
         '''Проверяет, существует ли зона, состоящая из таких точек'''
-        query = (
-            self.db.query(Area)
-            .join(AreaPoint)
-            .filter(
-                and_(
-                    AreaPoint.latitude == points[0].latitude,
-                    AreaPoint.longitude == points[0].longitude
-                )
-            )
-        )
-        for i in range(1, len(points)):
-            subquery = (
-                self.db.query(AreaPoint.area_id)
-                .filter(
-                    and_(
-                        AreaPoint.latitude == points[i].latitude,
-                        AreaPoint.longitude == points[i].longitude
-                    )
-                )
-            )
-            query = query.filter(Area.id.in_(subquery))
-        count = query.group_by(Area.id).having(func.count(Area.id) == len(points)).count()
-        return query.first() if count > 0 else None
+        return self.db.query(Area).filter(Area.fingerprint == area_fingerprint(points)).first()
+
     def _get_next_point_and_current_point_subquery(self):
         return (
             self.db.query(
@@ -211,154 +210,232 @@ class AreaCRUD(CRUDBase):
                 )
         return or_(*filters)
 
+    def get_areas_by_ids(self, area_ids: List[int]) -> List[Area]:
+        if not area_ids:
+            return []
+        return (
+            self.db.query(Area)
+            .options(selectinload(Area.areaPoints))
+            .filter(Area.id.in_(area_ids))
+            .order_by(Area.id)
+            .all()
+        )
+
+    def get_areas_signature(self) -> tuple:
+        '''Сигнатура набора зон: меняется при создании, изменении и удалении зон и их точек'''
+        areas = self.db.query(
+            func.count(Area.id),
+            func.md5(func.string_agg(
+                func.concat(Area.id, ':', Area.fingerprint),
+                aggregate_order_by(literal(','), Area.id)
+            ))
+        ).one()
+        points = self.db.query(func.count(AreaPoint.id), func.max(AreaPoint.id)).one()
+        return tuple(areas) + tuple(points)
+
+    def lock_import(self) -> None:
+        '''Блокировка на время транзакции: проверки и вставка зон параллельных импортов не перемежаются'''
+        self.db.execute(select(func.pg_advisory_xact_lock(AREA_IMPORT_LOCK_KEY)))
+
+    def check_import(self, areas: dict[int, CreateArea]) -> dict[int, str]:
+        '''
+        Проверяет зоны импорта между собой и с существующими зонами; возвращает ошибки по номерам объектов.
+        Пересечения ищутся по одному индексу ограничивающих прямоугольников всех зон
+        '''
+        errors = {}
+        valid = {}
+        for index, area in areas.items():
+            if AreaValidator(area.areaPoints).validate():
+                valid[index] = area
+            else:
+                errors[index] = "Неверные координаты"
+        fingerprints = {index: area_fingerprint(area.areaPoints) for index, area in valid.items()}
+        existing_names = {
+            name for name, in self.db.query(Area.name).filter(Area.name.in_({area.name for area in valid.values()}))
+        }
+        existing_fingerprints = {
+            fingerprint for fingerprint, in
+            self.db.query(Area.fingerprint).filter(Area.fingerprint.in_(set(fingerprints.values())))
+        }
+        names, seen_fingerprints = {}, {}
+        for index, area in valid.items():
+            if area.name in existing_names:
+                errors[index] = "Зона с таким именем уже существует"
+            elif area.name in names:
+                errors[index] = f"Зона с таким именем уже есть в объекте {names[area.name]}"
+            elif fingerprints[index] in existing_fingerprints:
+                errors[index] = "Зона с такими точками уже существует"
+            elif fingerprints[index] in seen_fingerprints:
+                errors[index] = f"Зона с такими точками уже есть в объекте {seen_fingerprints[fingerprints[index]]}"
+            names.setdefault(area.name, index)
+            seen_fingerprints.setdefault(fingerprints[index], index)
+        # новые зоны в индексе под отрицательными ключами, чтобы не совпасть с id существующих
+        polygons = self.get_area_polygons()
+        for index, area in valid.items():
+            if index not in errors:
+                polygons[-1 - index] = [(point.latitude, point.longitude) for point in area.areaPoints]
+        area_index = AreaIndex().build(polygons)
+        for index in sorted(valid):
+            if index in errors:
+                continue
+            polygon = polygons[-1 - index]
+            for other in area_index.overlapping(polygon_bounds(polygon)):
+                if other == -1 - index or not polygons_overlap(polygon, polygons[other]):
+                    continue
+                if other >= 0:
+                    errors[index] = f"Зона пересекается с зоной {other}"
+                else:
+                    errors[index] = f"Зона пересекается с объектом {-1 - other}"
+                break
+        return errors
+
+    def create_areas(self, areas: list[CreateArea]) -> list[int]:
+        '''
+        Вставка зон одной транзакцией. id берутся из последовательностей заранее, чтобы точки со ссылками
+        на следующую точку кольца вставлялись одним запросом
+        '''
+        def next_ids(sequence: str, count: int) -> list[int]:
+            return self.db.execute(
+                select(func.nextval(sequence)).select_from(func.generate_series(1, count))
+            ).scalars().all()
+
+        area_ids = next_ids("areas_id_seq", len(areas))
+        point_ids = iter(next_ids("area_point_id_seq", sum(len(area.areaPoints) for area in areas)))
+        area_rows, point_rows = [], []
+        for area_id, area in zip(area_ids, areas):
+            area_rows.append({"id": area_id, "name": area.name, "fingerprint": area_fingerprint(area.areaPoints)})
+            ids = [next(point_ids) for _ in area.areaPoints]
+            for point_id, next_id, point in zip(ids, ids[1:] + ids[:1], area.areaPoints):
+                point_rows.append({
+                    "id": point_id, "area_id": area_id, "next_id": next_id,
+                    "latitude": point.latitude, "longitude": point.longitude
+                })
+        self.db.execute(insert(Area).values(area_rows))
+        # одним запросом: внешний ключ next_id проверяется в конце запроса
+        self.db.execute(insert(AreaPoint).values(point_rows))
+        change_notifier.record(self.db, Area, area_ids)
+        change_notifier.record(self.db, AreaPoint, [row["id"] for row in point_rows])
+        self.db.commit()
+        return area_ids
+
     def get_area_by_name(self, name: str) -> Area | None:
         return self.db.query(Area).filter(Area.name == name).first()
 
-    def get_area_analytics(self, correct_points, start_date: datetime, end_date: datetime):
-
+    def get_area_polygons(self, area_ids: List[int] = None) -> dict[int, list[tuple[float, float]]]:
         query = (
-            self._get_analytics_query(
-                correct_points=correct_points,
-                start_date=start_date,
-                end_date=end_date,
-                query=self.db.query(
-                    AnimalType.type.label("animalType"),
-                    AnimalType.id.label("animalTypeId"),
-                )
-            )
-            .group_by(AnimalType.id)
-        )
-        info = []
-        for animal_type in query:
-            type_query = (self._get_analytics_query(
-                        correct_points=correct_points,
-                        start_date=start_date,
-                        end_date=end_date,
-                        query=self.db.query(
-                            Animal.id,
-                        )
-                    )
-                    .filter(AnimalType.id == animal_type.animalTypeId)
-                    .distinct(Animal.id))
-
-            info.append(
-                {
-                    "animalType": animal_type.animalType,
-                    "animalTypeId": animal_type.animalTypeId,
-                    "animalsArrived": self.get_area_analytics_animals_arrived(correct_points=correct_points, start_date=start_date, end_date=end_date, type_id=animal_type.animalTypeId),
-                    "animalsGone": self.get_area_analytics_animals_gone(correct_points=correct_points,start_date=start_date, end_date=end_date,type_id=animal_type.animalTypeId),
-                    "quantityAnimals": type_query.count()
-                }
-            )
-        return info
-
-
-    def get_area_analytics_animals_count(self, start_date: datetime, end_date: datetime,correct_points, type_id: int = None):
-        last_animal_points = (
-            self._get_analytics_query(
-                correct_points=correct_points,
-                start_date=start_date,
-                end_date=end_date,
-                query=self.db.query(
-                    Point.id.label("locationPointId"),
-                    Animal.id.label("animalId"),
-                )
-            )
-            .order_by(AnimalLocation.animalId, AnimalLocation.dateTimeOfVisitLocationPoint.desc())
-            .distinct(AnimalLocation.animalId)
+            self.db.query(AreaPoint.area_id, AreaPoint.latitude, AreaPoint.longitude)
+            .order_by(AreaPoint.area_id, AreaPoint.id)
         )
-        if type_id is not None:
-            last_animal_points = last_animal_points.filter(AnimalType.id == type_id)
-        return last_animal_points.count()
-
-    def get_area_analytics_animals_arrived(self, correct_points: list, start_date: datetime, end_date: datetime, type_id: int = None):
-        query = self._get_analytics_query(
-            correct_points=correct_points,
-            start_date=start_date,
-            end_date=end_date,
-            query=self.db.query(
-                Animal.id, AnimalLocation.dateTimeOfVisitLocationPoint, Point.id, Animal.chippingLocationId,
-                AnimalLocation.id
-            )
-        ).order_by(Animal.id, AnimalLocation.dateTimeOfVisitLocationPoint.asc()).distinct(Animal.id)
-        if type_id is not None:
-            query = query.filter(AnimalType.id == type_id)
-        arrived = 0
-        correct_points_ids = [point.point_id for point in correct_points]
-
-        for animal_id, date, first_visit_point_id, chipping_location_id, animal_location_id in query:
-            if not animal_location_id:
-                continue
-            else:
-                visited_points_in_period = (
-                    self.db.query(Point)
-                    .select_from(Animal)
-                    .filter(Animal.id == animal_id)
-                    .join(AnimalLocation, AnimalLocation.animalId == Animal.id, isouter=True)
-                    .join(
-                        Point,
-                        or_(
-                            Point.id == AnimalLocation.locationPointId,
-                            and_(
-                                AnimalLocation.id == None,
-                                Point.id == Animal.chippingLocationId
-                            )
-                        )
-                    )
-                    .filter(
-                        or_(
-                            AnimalLocation.id == None,
-                            and_(
-                                AnimalLocation.dateTimeOfVisitLocationPoint >= start_date,
-                                AnimalLocation.dateTimeOfVisitLocationPoint <= end_date
-                            )
-                        )
-                    )
-                )
-                visited_points = visited_points_in_period.all()
-                visited_points_ids = [point.id for point in visited_points]
-                points_in_area = [point in correct_points_ids for point in visited_points_ids]
-                for point, prev_point in zip(points_in_area, points_in_area[1:]):
-                    if point and not prev_point:
-                        arrived += 1
-                        break
-        return arrived
-
-
-
-    def get_area_analytics_animals_gone(self,  correct_points: list,  start_date: datetime, end_date: datetime, type_id: int= None):
-        last_animal_points = (
-            self._get_analytics_query(
-                correct_points=correct_points,
-                start_date=start_date,
-                end_date=end_date,
-                query=self.db.query(
-                    Point.id.label("locationPointId"),
-                    Animal.id.label("animalId"),
-                )
+        if area_ids is not None:
+            query = query.filter(AreaPoint.area_id.in_(area_ids))
+        polygons = {}
+        for area_id, latitude, longitude in query:
+            polygons.setdefault(area_id, []).append((latitude, longitude))
+        return polygons
+
+    def get_positions_at(self, day: date) -> dict[int, tuple[float, float]]:
+        '''
+        Координаты животных на начало дня day: берутся сохранённые вместе с агрегатами координаты на конец
+        последнего посчитанного дня и дополняются перемещениями после него. Вся история посещений
+        просматривается, только если таких координат ещё нет
+        '''
+        animal_crud = AnimalCRUD(self.db)
+        start = day_start(day)
+        snapshot = AreaRollupCRUD(self.db).get_latest_positions(day)
+        if snapshot is None:
+            return animal_crud.get_positions_before(start)
+        snapshot_day, positions = snapshot
+        # удалённые после сохранения координат животные в расчёт не попадают
+        existing = {
+            animal_id for animal_id, in self.db.query(Animal.id).filter(Animal.chippingDateTime < start)
+        }
+        positions = {animal_id: position for animal_id, position in positions.items() if animal_id in existing}
+        if snapshot_day < day - timedelta(days=1):
+            movements = animal_crud.get_movements(day_start(snapshot_day + timedelta(days=1)), start)
+            for animal_id, latitude, longitude in movements:
+                positions[animal_id] = (latitude, longitude)
+        return positions
+
+    def get_areas_presence(self, area_ids: List[int], start_date: date, end_date: date) -> dict:
+        '''
+        Присутствие животных в зонах за период [start_date, end_date]: полностью посчитанные дни берутся
+        из дневных агрегатов, остальные дни досчитываются по сырым посещениям
+        '''
+        if not area_ids:
+            return {}
+        rollup_crud = AreaRollupCRUD(self.db)
+        presence = rollup_crud.get_presence(area_ids, start_date, end_date)
+        complete_days = rollup_crud.get_complete_days(area_ids, start_date, end_date)
+        raw_days = [day for day in days_between(start_date, end_date) if day not in complete_days]
+        if not raw_days:
+            return presence
+        scanner = AreaPresenceScanner(self.get_area_polygons(area_ids))
+        animal_crud = AnimalCRUD(self.db)
+        for first_day, last_day in group_consecutive_days(raw_days):
+            start = day_start(first_day)
+            end = day_start(last_day + timedelta(days=1))
+            merge_presence(
+                presence,
+                scanner.scan(self.get_positions_at(first_day), animal_crud.get_movements(start, end))
             )
-            .order_by(AnimalLocation.animalId, AnimalLocation.dateTimeOfVisitLocationPoint.desc())
-            .distinct(AnimalLocation.animalId)
+        return presence
+
+    def get_animal_types_rows(self, animal_ids) -> list:
+        if not animal_ids:
+            return []
+        return (
+            self.db.query(AnimalTypeAnimal.animal_id, AnimalType.id, AnimalType.type)
+            .join(AnimalType, AnimalType.id == AnimalTypeAnimal.type_id)
+            .filter(AnimalTypeAnimal.animal_id.in_(animal_ids))
+            .all()
         )
-        if type_id is not None:
-            last_animal_points = last_animal_points.filter(AnimalType.id == type_id)
-        animal_ids = [animal.animalId for animal in last_animal_points]
-        gone_animals = (
-            self._get_analytics_query(
-                correct_points=correct_points,
-                start_date=start_date,
-                end_date=end_date,
-                query=self.db.query(
-                    Point.id.label("locationPointId"),
-                    Animal.id.label("animalId"),
-                )
-            )
-            .filter(AnimalLocation.animalId.notin_(animal_ids))
-            .order_by(AnimalLocation.animalId, AnimalLocation.dateTimeOfVisitLocationPoint.desc())
-            .distinct(AnimalLocation.animalId)
+
+    def get_area_analytics(self, area_id: int, start_date: date, end_date: date) -> dict:
+        presence = self.get_areas_presence([area_id], start_date, end_date).get(area_id, {})
+        return build_area_analytics(presence, self.get_animal_types_rows(list(presence)))
+
+    def get_areas_analytics(self, area_ids: List[int], start_date: date, end_date: date) -> list[dict]:
+        presence = self.get_areas_presence(area_ids, start_date, end_date)
+        animal_ids = set()
+        for animals in presence.values():
+            animal_ids.update(animals)
+        animal_types = {}
+        for animal_id, type_id, type_name in self.get_animal_types_rows(list(animal_ids)):
+            animal_types.setdefault(animal_id, []).append((animal_id, type_id, type_name))
+        analytics = []
+        for area_id in area_ids:
+            area_presence = presence.get(area_id, {})
+            rows = [row for animal_id in area_presence for row in animal_types.get(animal_id, [])]
+            analytics.append({"areaId": area_id, **build_area_analytics(area_presence, rows)})
+        return analytics
+
+    def get_area_occupancy(self, area_id: int, start_date: date, end_date: date, bucket: OccupancyBucket) -> list[dict]:
+        '''Заполненность зоны по часам или дням периода [start_date, end_date] по местному времени сервера'''
+        if bucket == OccupancyBucket.DAY:
+            boundaries = [day_start(day) for day in days_between(start_date, end_date + timedelta(days=1))]
+        else:
+            # часы отсчитываются в UTC: в день перехода на летнее время их 23 или 25
+            start = day_start(start_date).astimezone(timezone.utc)
+            hours = (day_start(end_date + timedelta(days=1)) - start) // timedelta(hours=1)
+            boundaries = [start + timedelta(hours=hour) for hour in range(hours + 1)]
+        animal_crud = AnimalCRUD(self.db)
+        events = area_stay_events(
+            self.get_area_polygons([area_id])[area_id],
+            boundaries[0],
+            self.get_positions_at(start_date),
+            animal_crud.get_timed_movements(boundaries[0], boundaries[-1])
         )
-        return gone_animals.count()
+        series = occupancy_series(events, boundaries)
+        for item in series:
+            item["start"] = format_datetime(item["start"])
+        return series
+
+    def get_area_ids(self) -> List[int]:
+        return [area_id for area_id, in self.db.query(Area.id).order_by(Area.id)]
 
+    def get_missing_area_ids(self, area_ids: List[int]) -> List[int]:
+        existing = {area_id for area_id, in self.db.query(Area.id).filter(Area.id.in_(area_ids))}
+        return [area_id for area_id in area_ids if area_id not in existing]
 
     def get_next_animal_location(self, animal_id: int, date_time: datetime):
         return (
@@ -368,69 +445,3 @@ class AreaCRUD(CRUDBase):
             .order_by(AnimalLocation.dateTimeOfVisitLocationPoint)
             .first()
         )
-    def get_all_points_contained_in_area(self, area_id: int, start_date: datetime, end_date: datetime):
-        query = (
-            self.db.query(
-                Point.id.label("point_id"),
-                Animal.id.label("animal_id"),
-                AnimalLocation.dateTimeOfVisitLocationPoint.label("date_time"),
-            )
-            .select_from(Animal)
-            .join(AnimalLocation, AnimalLocation.animalId == Animal.id, isouter=True)
-            .join(AnimalTypeAnimal, AnimalTypeAnimal.animal_id == Animal.id)
-            .join(AnimalType, AnimalType.id == AnimalTypeAnimal.type_id)
-            .join(
-                Point,
-                or_(
-                    Point.id == AnimalLocation.locationPointId,
-                    and_(
-                        AnimalLocation.id == None,
-                        Point.id == Animal.chippingLocationId
-                    )
-                )
-            )
-            .join(AreaPoint, AreaPoint.area_id == area_id)
-            .filter(
-                Point.latitude <= AreaPoint.latitude,
-                (AreaPoint.longitude - Point.longitude) * (Point.latitude - AreaPoint.latitude)
-                >= (Point.longitude - AreaPoint.longitude) * (AreaPoint.latitude - Point.latitude)
-            )
-            .filter(
-                or_(
-                    AnimalLocation.id == None,
-                    and_(
-                        AnimalLocation.dateTimeOfVisitLocationPoint >= start_date,
-                        AnimalLocation.dateTimeOfVisitLocationPoint <= end_date
-                    )
-                )
-            )
-        )
-        return query.all()
-    def _get_analytics_query(self, query, correct_points, start_date: datetime = None, end_date: datetime = None):
-        correct_points_ids = [point.point_id for point in correct_points]
-        query = (
-            query
-            .select_from(Animal)
-            .join(AnimalLocation, AnimalLocation.animalId == Animal.id, isouter=True)
-            .join(AnimalTypeAnimal, AnimalTypeAnimal.animal_id == Animal.id)
-            .join(AnimalType, AnimalType.id == AnimalTypeAnimal.type_id)
-            .join(Point, or_(Point.id == AnimalLocation.locationPointId, and_(Point.id == Animal.chippingLocationId, AnimalLocation.id == None)))
-            .filter(
-               Point.id.in_(correct_points_ids),
-            )
-        )
-        if start_date:
-            query = query.filter(
-                or_(
-                    AnimalLocation.id.is_(None),
-                    AnimalLocation.dateTimeOfVisitLocationPoint >= start_date,
-                )
-            )
-        if end_date:
-            query = query.filter(
-                or_(
-                    AnimalLocation.id.is_(None),
-                    AnimalLocation.dateTimeOfVisitLocationPoint <= end_date,
-                )
-            )
-        return query
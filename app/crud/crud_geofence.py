@@ -0,0 +1,54 @@
+from typing import List
+
+from sqlalchemy import func, insert, select, update
+from app.crud.base import CRUDBase
+from app.models.areas import GeofenceEvent
+
+GEOFENCE_PUBLISH_LOCK_KEY = 48001
+
+
+class GeofenceEventCRUD(CRUDBase):
+    def add_events(self, events: List[dict]) -> List[int]:
+        '''Добавляет неопубликованные события, возвращает id их зон'''
+        return self.db.execute(
+            insert(GeofenceEvent).values(events).returning(GeofenceEvent.area_id)
+        ).scalars().all()
+
+    def lock_publishing(self, wait: bool = True) -> bool:
+        '''Блокировка на время транзакции публикации: номера событий выдаёт одна транзакция за раз'''
+        if wait:
+            self.db.execute(select(func.pg_advisory_xact_lock(GEOFENCE_PUBLISH_LOCK_KEY)))
+            return True
+        return self.db.execute(select(func.pg_try_advisory_xact_lock(GEOFENCE_PUBLISH_LOCK_KEY))).scalar()
+
+    def publish_events(self) -> set[int]:
+        '''
+        Нумерует зафиксированные неопубликованные события, возвращает id их зон. Номера выдаются в порядке
+        публикации, поэтому подписчик, читающий события после последнего полученного номера, не пропустит
+        событие транзакции, зафиксированной позже
+        '''
+        unpublished = (
+            select(GeofenceEvent.id, func.row_number().over(order_by=GeofenceEvent.id).label("number"))
+            .where(GeofenceEvent.sequence.is_(None))
+            .subquery()
+        )
+        last_sequence = select(func.coalesce(func.max(GeofenceEvent.sequence), 0)).scalar_subquery()
+        return set(self.db.execute(
+            update(GeofenceEvent)
+            .where(GeofenceEvent.id == unpublished.c.id)
+            .values(sequence=last_sequence + unpublished.c.number)
+            .returning(GeofenceEvent.area_id)
+            .execution_options(synchronize_session=False)
+        ).scalars())
+
+    def get_events(self, area_ids: List[int], after_sequence: int, limit: int) -> List[GeofenceEvent]:
+        return (
+            self.db.query(GeofenceEvent)
+            .filter(GeofenceEvent.area_id.in_(area_ids), GeofenceEvent.sequence > after_sequence)
+            .order_by(GeofenceEvent.sequence)
+            .limit(limit)
+            .all()
+        )
+
+    def get_last_sequence(self) -> int:
+        return self.db.query(func.coalesce(func.max(GeofenceEvent.sequence), 0)).scalar()
@@ -0,0 +1,59 @@
+from datetime import timedelta
+
+from sqlalchemy import delete, func, select, tuple_, update
+from sqlalchemy.dialects.postgresql import insert
+from app.crud.base import CRUDBase
+from app.models.idempotency import IdempotencyKey
+
+
+class IdempotencyKeyCRUD(CRUDBase):
+    def claim(self, client: bytes, key: str, fingerprint: bytes, lock_timeout: float) -> bool:
+        '''Занимает ключ под выполнение запроса; истёкшая запись, в том числе зависшая заявка, занимается заново'''
+        values = {"fingerprint": fingerprint, "status": None, "headers": None, "body": None,
+                  "expires_at": func.now() + timedelta(seconds=lock_timeout)}
+        claimed = self.db.execute(
+            insert(IdempotencyKey)
+            .values(client=client, key=key, **values)
+            .on_conflict_do_update(index_elements=[IdempotencyKey.client, IdempotencyKey.key], set_=values,
+                                   where=IdempotencyKey.expires_at <= func.now())
+            .returning(IdempotencyKey.key)
+        ).first() is not None
+        self.db.commit()
+        return claimed
+
+    def get(self, client: bytes, key: str) -> IdempotencyKey | None:
+        return self.db.query(IdempotencyKey).filter(
+            IdempotencyKey.client == client,
+            IdempotencyKey.key == key,
+            IdempotencyKey.expires_at > func.now()
+        ).first()
+
+    def complete(self, client: bytes, key: str, status: int, headers: str, body: bytes, ttl: float) -> None:
+        self.db.execute(
+            update(IdempotencyKey)
+            .where(IdempotencyKey.client == client, IdempotencyKey.key == key)
+            .values(status=status, headers=headers, body=body, expires_at=func.now() + timedelta(seconds=ttl))
+        )
+        self.db.commit()
+
+    def release(self, client: bytes, key: str) -> None:
+        '''Освобождает ключ, если запрос не выполнен: повтор выполнится заново'''
+        self.db.execute(delete(IdempotencyKey).where(
+            IdempotencyKey.client == client, IdempotencyKey.key == key, IdempotencyKey.status.is_(None)
+        ))
+        self.db.commit()
+
+    def delete_expired(self, batch_size: int) -> int:
+        '''Удаляет не больше batch_size истёкших записей, возвращает их число'''
+        expired = (
+            select(IdempotencyKey.client, IdempotencyKey.key)
+            .where(IdempotencyKey.expires_at <= func.now())
+            .limit(batch_size)
+        )
+        deleted = self.db.execute(
+            delete(IdempotencyKey)
+            .where(tuple_(IdempotencyKey.client, IdempotencyKey.key).in_(expired))
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        self.db.commit()
+        return deleted
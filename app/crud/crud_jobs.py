@@ -0,0 +1,133 @@
+from datetime import date, timedelta
+
+from sqlalchemy import func, or_, select, update
+from app.crud.base import CRUDBase
+from app.models.jobs import AnalyticsJob, AnalyticsJobStatus
+
+JOB_LOCK_KEY = 27001
+ACTIVE_STATUSES = (AnalyticsJobStatus.PENDING, AnalyticsJobStatus.RUNNING)
+
+
+class AnalyticsJobCRUD(CRUDBase):
+    def create_job(self, job_id: str, owner_id: int, area_id: int, start_date: date, end_date: date,
+                   user_limit: int) -> AnalyticsJob | None:
+        '''Новая задача; None, если у пользователя уже user_limit незавершённых задач'''
+        # блокировка по пользователю: одновременные запросы в разных процессах не превысят лимит
+        self.db.execute(select(func.pg_advisory_xact_lock(JOB_LOCK_KEY, owner_id)))
+        active = self.db.query(func.count(AnalyticsJob.id)).filter(
+            AnalyticsJob.ownerId == owner_id,
+            AnalyticsJob.status.in_(ACTIVE_STATUSES)
+        ).scalar()
+        if active >= user_limit:
+            self.db.rollback()
+            return None
+        job = self.create(AnalyticsJob(id=job_id, ownerId=owner_id, areaId=area_id, startDate=start_date,
+                                       endDate=end_date, status=AnalyticsJobStatus.PENDING))
+        self.db.refresh(job)
+        return job
+
+    def get_job(self, job_id: str, retention: float) -> AnalyticsJob | None:
+        '''Задача; завершённые раньше retention секунд назад считаются удалёнными'''
+        return self.db.query(AnalyticsJob).filter(
+            AnalyticsJob.id == job_id,
+            or_(AnalyticsJob.finishedDateTime.is_(None),
+                AnalyticsJob.finishedDateTime > func.now() - timedelta(seconds=retention))
+        ).first()
+
+    def claim_job(self, claim_token: str) -> AnalyticsJob | None:
+        '''Занимает самую раннюю ожидающую задачу; задачи, занятые другими процессами, пропускаются'''
+        pending = (
+            select(AnalyticsJob.id)
+            .where(AnalyticsJob.status == AnalyticsJobStatus.PENDING)
+            .order_by(AnalyticsJob.createdDateTime)
+            .limit(1)
+            .with_for_update(skip_locked=True)
+            .scalar_subquery()
+        )
+        job_id = self.db.execute(
+            update(AnalyticsJob)
+            .where(AnalyticsJob.id == pending)
+            .values(status=AnalyticsJobStatus.RUNNING, startedDateTime=func.now(), claim_token=claim_token)
+            .returning(AnalyticsJob.id)
+            .execution_options(synchronize_session=False)
+        ).scalar()
+        self.db.commit()
+        return self.db.query(AnalyticsJob).filter(AnalyticsJob.id == job_id).first() if job_id else None
+
+    def set_backend(self, job_id: str, claim_token: str, backend_pid: int, backend_replica: int | None) -> bool:
+        '''Запоминает соединение расчёта; False - задачу уже отменили или забрали у исполнителя'''
+        updated = self.db.execute(
+            update(AnalyticsJob)
+            .where(AnalyticsJob.id == job_id, AnalyticsJob.claim_token == claim_token,
+                   AnalyticsJob.status == AnalyticsJobStatus.RUNNING)
+            .values(backend_pid=backend_pid, backend_replica=backend_replica)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        self.db.commit()
+        return updated == 1
+
+    def finish_job(self, job_id: str, claim_token: str, status: AnalyticsJobStatus, result: dict = None,
+                   error: str = None) -> None:
+        '''Результат выполняющейся задачи; отменённая или забранная у исполнителя задача не меняется'''
+        self.db.execute(
+            update(AnalyticsJob)
+            .where(AnalyticsJob.id == job_id, AnalyticsJob.claim_token == claim_token,
+                   AnalyticsJob.status == AnalyticsJobStatus.RUNNING)
+            .values(status=status, result=result, error=error, finishedDateTime=func.now(),
+                    backend_pid=None, backend_replica=None)
+            .execution_options(synchronize_session=False)
+        )
+        self.db.commit()
+
+    def _stop_jobs(self, conditions: tuple, **values) -> list[tuple]:
+        '''Меняет задачи, не фиксируя транзакцию; (pid, реплика) их расчётов до изменения'''
+        # RETURNING отдаёт уже изменённую строку, поэтому соединения читаются заранее под блокировкой
+        jobs = self.db.execute(
+            select(AnalyticsJob.id, AnalyticsJob.backend_pid, AnalyticsJob.backend_replica)
+            .where(*conditions)
+            .with_for_update()
+        ).all()
+        if jobs:
+            self.db.execute(
+                update(AnalyticsJob)
+                .where(AnalyticsJob.id.in_([job_id for job_id, _, _ in jobs]))
+                .values(backend_pid=None, backend_replica=None, **values)
+                .execution_options(synchronize_session=False)
+            )
+        return [(backend_pid, backend_replica) for _, backend_pid, backend_replica in jobs]
+
+    def cancel_job(self, job_id: str) -> list[tuple]:
+        '''
+        Отменяет незавершённую задачу, не фиксируя транзакцию; (pid, реплика) её расчёта.
+        Пока транзакция не зафиксирована, строка заблокирована и выполняющий задачу процесс не освободит
+        соединение расчёта, поэтому pid можно прервать без риска задеть чужой запрос
+        '''
+        return self._stop_jobs(
+            (AnalyticsJob.id == job_id, AnalyticsJob.status.in_(ACTIVE_STATUSES)),
+            status=AnalyticsJobStatus.CANCELLED, finishedDateTime=func.now()
+        )
+
+    def requeue_jobs(self, job_ids: list[str]) -> list[tuple]:
+        '''Возвращает выполняющиеся задачи в очередь, не фиксируя транзакцию; (pid, реплика) их расчётов'''
+        return self._stop_jobs(
+            (AnalyticsJob.id.in_(job_ids), AnalyticsJob.status == AnalyticsJobStatus.RUNNING),
+            status=AnalyticsJobStatus.PENDING, startedDateTime=None, claim_token=None
+        )
+
+    def fail_stale_jobs(self, timeout: float) -> list[tuple]:
+        '''
+        Завершает ошибкой задачи, выполняющиеся дольше timeout секунд (процесс, занявший их, мог завершиться
+        аварийно), не фиксируя транзакцию; (pid, реплика) их расчётов
+        '''
+        return self._stop_jobs(
+            (AnalyticsJob.status == AnalyticsJobStatus.RUNNING,
+             AnalyticsJob.startedDateTime < func.now() - timedelta(seconds=timeout)),
+            status=AnalyticsJobStatus.FAILED, error="Превышено время выполнения задачи", finishedDateTime=func.now()
+        )
+
+    def delete_expired_jobs(self, retention: float) -> int:
+        deleted = self.db.query(AnalyticsJob).filter(
+            AnalyticsJob.finishedDateTime < func.now() - timedelta(seconds=retention)
+        ).delete(synchronize_session=False)
+        self.db.commit()
+        return deleted
@@ -1,3 +1,6 @@
+import numpy as np
+from sqlalchemy import func
+from app.core.cache import point_cache
 from app.crud.base import CRUDBase
 from app.models.points import Point
 from app.models.animals import Animal, AnimalLocation
@@ -5,7 +8,12 @@ from app.models.animals import Animal, AnimalLocation
 
 class PointCRUD(CRUDBase):
     def get_point_by_id(self, id: int) -> Point | None:
-        return self.db.query(Point).filter(Point.id == id).first()
+        return point_cache.get(self.db, id, lambda: self.db.query(Point).filter(Point.id == id).first())
+
+    def get_points_by_ids(self, ids: list[int]) -> list[Point]:
+        if not ids:
+            return []
+        return self.db.query(Point).filter(Point.id.in_(ids)).order_by(Point.id).all()
 
     def get_point_by_coordinates(self, latitude: float, longitude: float) -> Point | None:
         return self.db.query(Point).filter(Point.latitude == latitude, Point.longitude == longitude).first()
@@ -20,7 +28,9 @@ class PointCRUD(CRUDBase):
     def update_point(self, db_point: Point, latitude: float, longitude: float) -> Point:
         db_point.latitude = latitude
         db_point.longitude = longitude
-        return self.update(db_point)
+        db_point = self.update(db_point)
+        point_cache.put(db_point)
+        return db_point
 
     def is_allow_change(self, db_point: Point) -> bool:
         animal_locations = self.db.query(AnimalLocation).filter(
@@ -28,3 +38,12 @@ class PointCRUD(CRUDBase):
         animals = self.db.query(Animal).filter(
             Animal.chippingLocationId == db_point.id).first() is None
         return animal_locations and animals
+
+    def get_max_point_id(self) -> int:
+        return self.db.query(func.max(Point.id)).scalar() or 0
+
+    def get_points_coordinates(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        '''Идентификаторы, широты и долготы всех точек'''
+        rows = self.db.query(Point.id, Point.latitude, Point.longitude).all()
+        coordinates = np.array(rows, dtype=float).reshape(-1, 3)
+        return coordinates[:, 0].astype(np.int64), coordinates[:, 1], coordinates[:, 2]
@@ -0,0 +1,141 @@
+from datetime import date, datetime
+from typing import List
+
+from sqlalchemy import func, select
+from app.crud.base import CRUDBase
+from app.models.animals import Animal, AnimalLocation
+from app.models.areas import AnimalPositionDay, Area, AreaAnimalDay, AreaRollupDay
+from app.schemas.types import local_date, local_timezone
+
+ROLLUP_LOCK_KEY = 26001
+
+
+class AreaRollupCRUD(CRUDBase):
+    def lock(self, wait: bool = True) -> bool:
+        '''Блокировка на время транзакции, чтобы пересчёт агрегатов не пересекался с их инвалидацией'''
+        if wait:
+            self.db.execute(select(func.pg_advisory_xact_lock(ROLLUP_LOCK_KEY)))
+            return True
+        return self.db.execute(select(func.pg_try_advisory_xact_lock(ROLLUP_LOCK_KEY))).scalar()
+
+    def get_complete_days(self, area_ids: List[int], start_date: date, end_date: date) -> set[date]:
+        '''Дни, за которые агрегаты посчитаны для всех указанных зон'''
+        query = (
+            self.db.query(AreaRollupDay.day)
+            .filter(
+                AreaRollupDay.area_id.in_(area_ids),
+                AreaRollupDay.day >= start_date,
+                AreaRollupDay.day <= end_date
+            )
+            .group_by(AreaRollupDay.day)
+            .having(func.count(AreaRollupDay.area_id) == len(set(area_ids)))
+        )
+        return {day for day, in query}
+
+    def get_presence(self, area_ids: List[int], start_date: date, end_date: date) -> dict:
+        query = (
+            self.db.query(
+                AreaAnimalDay.area_id,
+                AreaAnimalDay.animal_id,
+                func.bool_or(AreaAnimalDay.arrived),
+                func.bool_or(AreaAnimalDay.gone)
+            )
+            .filter(
+                AreaAnimalDay.area_id.in_(area_ids),
+                AreaAnimalDay.day >= start_date,
+                AreaAnimalDay.day <= end_date
+            )
+            .group_by(AreaAnimalDay.area_id, AreaAnimalDay.animal_id)
+        )
+        presence = {}
+        for area_id, animal_id, arrived, gone in query:
+            presence.setdefault(area_id, {})[animal_id] = [arrived, gone]
+        return presence
+
+    def get_pending_days(self, limit: int) -> List[date]:
+        '''Завершившиеся дни, за которые агрегаты посчитаны не для всех зон или не сохранены координаты животных'''
+        first_chipping = self.db.query(func.min(Animal.chippingDateTime)).scalar()
+        areas_count = self.db.query(Area).count()
+        if first_chipping is None or areas_count == 0:
+            return []
+        today = datetime.now(local_timezone).date()
+        first_day = local_date(first_chipping)
+        completed = dict(
+            self.db.query(AreaRollupDay.day, func.count(AreaRollupDay.area_id))
+            .filter(AreaRollupDay.day >= first_day)
+            .group_by(AreaRollupDay.day)
+        )
+        positions_days = {
+            day for day, in self.db.query(AnimalPositionDay.day).filter(AnimalPositionDay.day >= first_day)
+        }
+        pending = []
+        for offset in range((today - first_day).days):
+            day = date.fromordinal(first_day.toordinal() + offset)
+            if completed.get(day, 0) < areas_count or day not in positions_days:
+                pending.append(day)
+                if len(pending) == limit:
+                    break
+        return pending
+
+    def get_missing_area_ids(self, day: date) -> List[int]:
+        completed = self.db.query(AreaRollupDay.area_id).filter(AreaRollupDay.day == day)
+        return [area_id for area_id, in self.db.query(Area.id).filter(Area.id.notin_(completed))]
+
+    def get_latest_positions(self, before_day: date) -> tuple[date, dict] | None:
+        '''(день, координаты животных на его конец) для последнего сохранённого дня раньше before_day'''
+        snapshot = (
+            self.db.query(AnimalPositionDay)
+            .filter(AnimalPositionDay.day < before_day)
+            .order_by(AnimalPositionDay.day.desc())
+            .first()
+        )
+        if snapshot is None:
+            return None
+        return snapshot.day, {
+            animal_id: (latitude, longitude)
+            for animal_id, latitude, longitude in zip(snapshot.animal_ids, snapshot.latitudes, snapshot.longitudes)
+        }
+
+    def save_day(self, day: date, area_ids: List[int], presence: dict, positions: dict) -> None:
+        '''positions - координаты животных на конец дня'''
+        for area_id in area_ids:
+            for animal_id, (arrived, gone) in presence.get(area_id, {}).items():
+                self.db.add(AreaAnimalDay(area_id=area_id, day=day, animal_id=animal_id, arrived=arrived, gone=gone))
+            self.db.add(AreaRollupDay(area_id=area_id, day=day))
+        animal_ids = sorted(positions)
+        self.db.merge(AnimalPositionDay(
+            day=day,
+            animal_ids=animal_ids,
+            latitudes=[positions[animal_id][0] for animal_id in animal_ids],
+            longitudes=[positions[animal_id][1] for animal_id in animal_ids]
+        ))
+        self.db.commit()
+
+    def invalidate_days(self, start_date: date, end_date: date = None, area_id: int = None) -> None:
+        self.lock()
+        # координаты животных от зон не зависят и сбрасываются только вместе с агрегатами всех зон
+        models = (AreaRollupDay, AreaAnimalDay) if area_id is not None else (AreaRollupDay, AreaAnimalDay, AnimalPositionDay)
+        for model in models:
+            query = self.db.query(model).filter(model.day >= start_date)
+            if end_date is not None:
+                query = query.filter(model.day <= end_date)
+            if area_id is not None:
+                query = query.filter(model.area_id == area_id)
+            query.delete(synchronize_session=False)
+        self.db.commit()
+
+    def invalidate_area(self, area_id: int) -> None:
+        self.invalidate_days(date.min, area_id=area_id)
+
+    def invalidate_animal_track(self, animal_id: int, since: datetime) -> None:
+        '''Сбрасывает агрегаты с момента since до следующего перемещения животного'''
+        next_visit = (
+            self.db.query(AnimalLocation.dateTimeOfVisitLocationPoint)
+            .filter(
+                AnimalLocation.animalId == animal_id,
+                AnimalLocation.dateTimeOfVisitLocationPoint > since
+            )
+            .order_by(AnimalLocation.dateTimeOfVisitLocationPoint.asc())
+            .first()
+        )
+        self.invalidate_days(local_date(since), local_date(next_visit[0]) if next_visit else None)
@@ -1,10 +1,15 @@
+from app.core.cache import animal_type_cache
 from app.crud.base import CRUDBase
 from app.models.animals import AnimalType, AnimalTypeAnimal
 
 
 class AnimalTypeCRUD(CRUDBase):
     def get_animal_type_by_id(self, id: int) -> AnimalType | None:
-        return self.db.query(AnimalType).filter(AnimalType.id == id).first()
+        return animal_type_cache.get(
+            self.db, id, lambda: self.db.query(AnimalType).filter(AnimalType.id == id).first())
+
+    def get_animal_types_by_ids(self, ids: list[int]) -> list[AnimalType]:
+        return self.db.query(AnimalType).filter(AnimalType.id.in_(ids)).all()
 
     def get_animal_type_by_name(self, name: str) -> AnimalType | None:
         return self.db.query(AnimalType).filter(AnimalType.type == name).first()
@@ -18,7 +23,9 @@ class AnimalTypeCRUD(CRUDBase):
 
     def update_animal_type(self, db_animal_type: AnimalType, name: str) -> AnimalType:
         db_animal_type.type = name
-        return self.update(db_animal_type)
+        db_animal_type = self.update(db_animal_type)
+        animal_type_cache.put(db_animal_type)
+        return db_animal_type
 
     def is_allow_delete_animal_type(self, db_animal_type: AnimalType) -> bool:
         return self.db.query(AnimalTypeAnimal).filter(AnimalTypeAnimal.type_id == db_animal_type.id).first() is None
@@ -1,4 +1,5 @@
 from typing import List
+from app.core.cache import user_cache
 from app.crud.base import CRUDBase
 from app.models.user import User, UserRoles
 from app.models.animals import Animal
@@ -12,10 +13,11 @@ class UserCRUD(CRUDBase):
         self.pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
     def get_user_by_id(self, user_id: int) -> User | None:
-        return self.db.query(User).filter(User.id == user_id).first()
+        return user_cache.get(self.db, user_id, lambda: self.db.query(User).filter(User.id == user_id).first())
 
     def get_user_by_email(self, email: str) -> User | None:
-        return self.db.query(User).filter(User.email == email).first()
+        return user_cache.get_by(
+            self.db, "email", email, lambda: self.db.query(User).filter(User.email == email).first())
 
     def search_users(self, firstName: str, lastName: str, email: str, from_: int, size: int) -> List[User]:
         query = self.db.query(User)
@@ -48,7 +50,9 @@ class UserCRUD(CRUDBase):
         db_user.email = email
         db_user.hashed_password = self.get_password_hash(password)
         db_user.role = role
-        return self.update(db_user)
+        db_user = self.update(db_user)
+        user_cache.put(db_user)
+        return db_user
 
     def login(self, email: str, password: str) -> User | None:
         db_user = self.get_user_by_email(email=email)
@@ -1,4 +1,5 @@
 import typing as t
+from sqlalchemy import Column, Integer, literal_column
 from sqlalchemy.ext.declarative import as_declarative, declared_attr
 class_registry: t.Dict = {}
 
@@ -12,3 +13,8 @@ class Base:
     @declared_attr
     def __tablename__(cls) -> str:
         return cls.__name__.lower()
+
+
+def version_column() -> Column:
+    '''Версия строки: увеличивается каждым UPDATE, выполненным через ORM'''
+    return Column(Integer, nullable=False, server_default="1", onupdate=literal_column("version + 1"))
@@ -1,9 +1,87 @@
-from app.db.session import SessionLocal
+import hashlib
+import itertools
+import threading
+import time
 
+from fastapi import Request
+from sqlalchemy.orm import Session
 
-def get_db():
-    db = SessionLocal()
+from app.core.cache import change_notifier
+from app.core.config import settings
+from app.db.session import ReplicaSessionLocals, SessionLocal
+
+READ_METHODS = ("GET", "HEAD")
+
+
+def client_key(request: Request) -> int:
+    '''Ключ клиента: заголовок Authorization, для анонимных запросов - адрес клиента'''
+    client = request.headers.get("Authorization") or (request.client.host if request.client else "")
+    return int.from_bytes(hashlib.blake2b(client.encode(), digest_size=7).digest(), "big")
+
+
+class ReplicaRouter:
+    '''
+    Распределяет читающие запросы по репликам. Клиент после записи READ_YOUR_WRITES_WINDOW секунд
+    читает с основной базы, чтобы видеть свои изменения; закрепление рассылается всем процессам
+    '''
+
+    def __init__(self, replicas: list, pin_window: float, max_pins: int = 100000):
+        self.replicas = replicas
+        self.pin_window = pin_window
+        self.max_pins = max_pins
+        self._next = itertools.count()
+        self._pinned: dict[int, float] = {}
+        self._pinned_all_until = 0.0
+        self._lock = threading.Lock()
+
+    def pin(self, keys: list[int] | None) -> None:
+        '''keys=None - закрепления могли быть пропущены, на основную базу переводятся все клиенты'''
+        now = time.monotonic()
+        with self._lock:
+            if keys is None:
+                self._pinned_all_until = now + self.pin_window
+                return
+            if len(self._pinned) >= self.max_pins:
+                self._pinned = {key: until for key, until in self._pinned.items() if until > now}
+            for key in keys:
+                self._pinned[key] = now + self.pin_window
+
+    def is_pinned(self, key: int) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            return now < self._pinned_all_until or now < self._pinned.get(key, 0.0)
+
+    def read_session(self) -> Session:
+        if not self.replicas:
+            return SessionLocal()
+        return self.replicas[next(self._next) % len(self.replicas)]()
+
+    def is_write(self, request: Request) -> bool:
+        return bool(self.replicas) and request.method not in READ_METHODS
+
+    def session(self, request: Request) -> Session:
+        if not self.replicas:
+            return SessionLocal()
+        key = client_key(request)
+        if self.is_write(request):
+            # закрепление до записи: ответ клиенту не может опередить его
+            change_notifier.publish("client_pins", [key])
+            return SessionLocal()
+        if self.is_pinned(key):
+            return SessionLocal()
+        return self.read_session()
+
+
+replica_router = ReplicaRouter(ReplicaSessionLocals, pin_window=settings.READ_YOUR_WRITES_WINDOW)
+change_notifier.subscribe("client_pins", replica_router.pin)
+
+
+def get_db(request: Request):
+    db = replica_router.session(request)
     try:
         yield db
     finally:
         db.close()
+        if replica_router.is_write(request):
+            # окно отсчитывается от завершения записи
+            change_notifier.publish("client_pins", [client_key(request)])
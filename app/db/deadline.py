@@ -0,0 +1,41 @@
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import Pool
+
+# отмена не должна попасть в соединение, которое уже вернулось в пул и выдано другому запросу
+_cancel_lock = threading.Lock()
+
+
+def set_deadline(db: Session, deadline: float) -> None:
+    '''Срок по time.monotonic(): каждая транзакция сессии получает statement_timeout на оставшееся время'''
+    db.info["deadline"] = deadline
+
+
+def cancel_statement(db: Session) -> None:
+    '''Прерывает выполняющийся запрос сессии, не занимая соединение из пула'''
+    with _cancel_lock:
+        connection_info = db.info.get("connection_info")
+        if connection_info is not None and connection_info.get("owner") is db:
+            db.info["dbapi_connection"].cancel()
+
+
+@event.listens_for(Session, "after_begin")
+def _set_statement_timeout(session: Session, transaction, connection) -> None:
+    deadline = session.info.get("deadline")
+    if deadline is None:
+        return
+    remaining = max(int((deadline - time.monotonic()) * 1000), 1)
+    connection.exec_driver_sql(f"SET LOCAL statement_timeout = {remaining}")
+    with _cancel_lock:
+        connection.connection.info["owner"] = session
+        session.info["connection_info"] = connection.connection.info
+        session.info["dbapi_connection"] = connection.connection.dbapi_connection
+
+
+@event.listens_for(Pool, "checkin")
+def _release_owner(dbapi_connection, connection_record) -> None:
+    with _cancel_lock:
+        connection_record.info.pop("owner", None)
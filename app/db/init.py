@@ -1,25 +1,47 @@
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
 from app.crud.crud_user import UserCRUD
-from app.db.session import SessionLocal
+from app.db.base_class import Base
+from app.db.partitions import copy_unpartitioned_table, maintain_partitions, rename_unpartitioned_table
+from app.db.session import engine
 from app.core.config import settings
 from app.models.user import User
 import time
 
-def init_db() -> None:
-    """Добавление начальных данных"""
-    session = SessionLocal()
-    for user in settings.INITIAL_USERS:
+INIT_LOCK_KEY = 37001
 
-        user_crud = UserCRUD(session)
-        password_hash = user_crud.get_password_hash(user.get("password"))
-        user = User(
-            firstName=user.get("firstName"),
-            lastName=user.get("lastName"),
-            email=user.get("email"),
-            hashed_password=password_hash,
-            role=user.get("role")
-        )
-        session.add(user)
 
-    session.flush()
-    session.commit()
+def init_db() -> None:
+    """
+    Создание схемы и добавление начальных данных. Выполняется под блокировкой, поэтому процессы,
+    запущенные одновременно, не пересоздают схему друг у друга; существующие пользователи не добавляются повторно
+    """
+    with engine.begin() as connection:
+        connection.execute(select(func.pg_advisory_xact_lock(INIT_LOCK_KEY)))
+        if settings.DB_RESET_ON_START:
+            Base.metadata.drop_all(connection)
+        unpartitioned = rename_unpartitioned_table(connection)
+        Base.metadata.create_all(connection)
+        if unpartitioned:
+            copy_unpartitioned_table(connection)
+        session = Session(bind=connection)
+        user_crud = UserCRUD(session)
+        emails = {user.get("email") for user in settings.INITIAL_USERS}
+        existing = {email for email, in session.query(User.email).filter(User.email.in_(emails))}
+        for user in settings.INITIAL_USERS:
+            if user.get("email") in existing:
+                continue
+            password_hash = user_crud.get_password_hash(user.get("password"))
+            user = User(
+                firstName=user.get("firstName"),
+                lastName=user.get("lastName"),
+                email=user.get("email"),
+                hashed_password=password_hash,
+                role=user.get("role")
+            )
+            session.add(user)
+        session.flush()
+        session.close()
+    maintain_partitions(settings.LOCATION_PARTITION_MONTHS_AHEAD, settings.LOCATION_PARTITION_RETENTION_MONTHS,
+                        wait=True)
     time.sleep(3)
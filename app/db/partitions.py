@@ -0,0 +1,192 @@
+import logging
+import threading
+from datetime import date, datetime, timezone
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+from app.db.session import engine
+from app.models.animals import AnimalLocation
+
+logger = logging.getLogger(__name__)
+
+PARTITION_LOCK_KEY = 44001
+TABLE = AnimalLocation.__tablename__
+KEY = AnimalLocation.dateTimeOfVisitLocationPoint.key
+DEFAULT_PARTITION = f"{TABLE}_default"
+UNPARTITIONED_TABLE = f"{TABLE}_unpartitioned"
+
+
+def month_start(value: date) -> date:
+    return date(value.year, value.month, 1)
+
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"{TABLE}_{month:%Y%m}"
+
+
+def _bound(month: date) -> str:
+    # границы месяцев по UTC, чтобы не зависеть от часового пояса соединения
+    return f"'{month.isoformat()} 00:00:00+00'"
+
+
+def get_partitions(connection: Connection) -> set[str]:
+    return set(connection.execute(text(
+        "SELECT child.relname FROM pg_inherits "
+        "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+        "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+        "WHERE parent.relname = :table"
+    ), {"table": TABLE}).scalars())
+
+
+def get_table_kind(connection: Connection, table: str) -> str | None:
+    '''r - обычная таблица, p - секционированная, None - таблицы нет'''
+    return connection.execute(text(
+        "SELECT relkind FROM pg_class WHERE relname = :table AND relnamespace = 'public'::regnamespace"
+    ), {"table": table}).scalar()
+
+
+def create_default_partition(connection: Connection) -> None:
+    '''Секция для посещений вне созданных месяцев: вставка не падает, если секция месяца ещё не создана'''
+    connection.execute(text(f'CREATE TABLE IF NOT EXISTS {DEFAULT_PARTITION} PARTITION OF {TABLE} DEFAULT'))
+
+
+def create_partition(connection: Connection, month: date) -> str:
+    '''
+    Секция месяца. Таблица создаётся отдельно и присоединяется после переноса в неё строк этого месяца
+    из секции по умолчанию: иначе присоединение невозможно
+    '''
+    name = partition_name(month)
+    start, end = _bound(month), _bound(add_months(month, 1))
+    connection.execute(text(f'CREATE TABLE {name} (LIKE {TABLE} INCLUDING CONSTRAINTS)'))
+    connection.execute(text(
+        f'WITH moved AS (DELETE FROM {DEFAULT_PARTITION} WHERE "{KEY}" >= {start} AND "{KEY}" < {end} RETURNING *) '
+        f'INSERT INTO {name} SELECT * FROM moved'
+    ))
+    connection.execute(text(f'ALTER TABLE {TABLE} ATTACH PARTITION {name} FOR VALUES FROM ({start}) TO ({end})'))
+    return name
+
+
+def ensure_partitions(connection: Connection, today: date, months_ahead: int) -> list[str]:
+    '''
+    Создаёт секции с текущего месяца на months_ahead месяцев вперёд, а также секции месяцев,
+    посещения которых попали в секцию по умолчанию
+    '''
+    create_default_partition(connection)
+    existing = get_partitions(connection)
+    months = {add_months(month_start(today), i) for i in range(months_ahead + 1)}
+    months.update(month.date() for month in connection.execute(text(
+        f"SELECT DISTINCT date_trunc('month', \"{KEY}\" AT TIME ZONE 'UTC') FROM {DEFAULT_PARTITION}"
+    )).scalars())
+    # месяц отсоединённой секции не создаётся заново, его посещения остаются в секции по умолчанию
+    return [
+        create_partition(connection, month) for month in sorted(months)
+        if partition_name(month) not in existing and get_table_kind(connection, partition_name(month)) is None
+    ]
+
+
+def detach_partitions(connection: Connection, before: date) -> list[str]:
+    '''
+    Отсоединяет секции месяцев раньше before. Они остаются отдельными таблицами для архивации или удаления;
+    их посещения больше не видны API, уже посчитанные дневные агрегаты зон сохраняются
+    '''
+    names = sorted(
+        name for name in get_partitions(connection)
+        if name != DEFAULT_PARTITION and name < partition_name(month_start(before))
+    )
+    for name in names:
+        connection.execute(text(f'ALTER TABLE {TABLE} DETACH PARTITION {name}'))
+        # архив не должен зависеть от основной схемы: последовательность id и внешние ключи
+        # мешали бы удалять животных, точки и саму таблицу посещений
+        connection.execute(text(f'ALTER TABLE {name} ALTER COLUMN id DROP DEFAULT'))
+        foreign_keys = connection.execute(text(
+            "SELECT conname FROM pg_constraint WHERE conrelid = CAST(:table AS regclass) AND contype = 'f'"
+        ), {"table": name}).scalars().all()
+        for foreign_key in foreign_keys:
+            connection.execute(text(f'ALTER TABLE {name} DROP CONSTRAINT "{foreign_key}"'))
+    return names
+
+
+def rename_unpartitioned_table(connection: Connection) -> bool:
+    '''
+    Таблица посещений, созданная до секционирования, переименовывается вместе с индексами и последовательностью,
+    чтобы на её месте создать секционированную
+    '''
+    if get_table_kind(connection, TABLE) != "r":
+        return False
+    sequence = connection.execute(text(f"SELECT pg_get_serial_sequence('{TABLE}', 'id')")).scalar()
+    indexes = connection.execute(text("SELECT indexname FROM pg_indexes WHERE tablename = :table"),
+                                 {"table": TABLE}).scalars().all()
+    connection.execute(text(f'ALTER TABLE {TABLE} RENAME TO {UNPARTITIONED_TABLE}'))
+    for index in indexes:
+        connection.execute(text(f'ALTER INDEX "{index}" RENAME TO "{index}_unpartitioned"'))
+    if sequence is not None:
+        connection.execute(text(f'ALTER SEQUENCE {sequence} RENAME TO {UNPARTITIONED_TABLE}_id_seq'))
+    return True
+
+
+def copy_unpartitioned_table(connection: Connection) -> None:
+    '''Переносит посещения из переименованной таблицы в секции, продолжая последовательность id'''
+    months = connection.execute(text(
+        f"SELECT DISTINCT date_trunc('month', \"{KEY}\" AT TIME ZONE 'UTC') FROM {UNPARTITIONED_TABLE}"
+    )).scalars().all()
+    create_default_partition(connection)
+    existing = get_partitions(connection)
+    for month in sorted(month.date() for month in months):
+        if partition_name(month) not in existing:
+            create_partition(connection, month)
+    columns = ", ".join(f'"{column.name}"' for column in AnimalLocation.__table__.columns)
+    connection.execute(text(f'INSERT INTO {TABLE} ({columns}) SELECT {columns} FROM {UNPARTITIONED_TABLE}'))
+    connection.execute(text(
+        f"SELECT setval(pg_get_serial_sequence('{TABLE}', 'id'), "
+        f"(SELECT coalesce(max(id), 0) + 1 FROM {UNPARTITIONED_TABLE}), false)"
+    ))
+    connection.execute(text(f'DROP TABLE {UNPARTITIONED_TABLE}'))
+
+
+def maintain_partitions(months_ahead: int, retention_months: int, wait: bool = False) -> None:
+    '''Обслуживание секций одним процессом: создание будущих месяцев и отсоединение старых'''
+    with engine.begin() as connection:
+        lock = "pg_advisory_xact_lock" if wait else "pg_try_advisory_xact_lock"
+        if connection.execute(text(f"SELECT {lock}({PARTITION_LOCK_KEY})")).scalar() is False:
+            return
+        today = datetime.now(timezone.utc).date()
+        created = ensure_partitions(connection, today, months_ahead)
+        detached = []
+        if retention_months:
+            detached = detach_partitions(connection, add_months(month_start(today), -retention_months))
+    if created or detached:
+        logger.info("Секции посещений: созданы %s, отсоединены %s", created, detached)
+
+
+class PartitionWorker:
+    '''Фоновый поток, заранее создающий секции посещений на следующие месяцы'''
+
+    def __init__(self, interval: int, months_ahead: int, retention_months: int):
+        self.interval = interval
+        self.months_ahead = months_ahead
+        self.retention_months = retention_months
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="location-partitions", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                maintain_partitions(self.months_ahead, self.retention_months)
+            except Exception:
+                logger.exception("Ошибка при обслуживании секций посещений")
+            self._stop.wait(self.interval)
@@ -7,12 +7,29 @@ from app.models.user import *
 from app.models.animals import *
 from app.models.points import *
 from app.models.areas import *
+from app.models.idempotency import *
+from app.models.jobs import *
 
 
-engine = create_engine(settings.DATABASE_URI)
-Base.metadata.drop_all(engine)
-Base.metadata.create_all(engine)
+def make_engine(uri: str):
+    # пул на процесс: при нескольких воркерах соединений к базе открывается в workers раз больше
+    return create_engine(
+        uri,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_pre_ping=True
+    )
+
+
+engine = make_engine(settings.DATABASE_URI)
+replica_engines = [make_engine(uri) for uri in settings.DATABASE_REPLICA_URIS]
 
 
 SessionLocal = sessionmaker(
     autocommit=False, autoflush=False, bind=engine)
+# сессии реплик только для чтения, данные в них могут отставать от основной базы
+ReplicaSessionLocals = [
+    sessionmaker(autocommit=False, autoflush=False, bind=replica_engine, info={"replica": True})
+    for replica_engine in replica_engines
+]
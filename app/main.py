@@ -1,24 +1,86 @@
 
 from fastapi import FastAPI
 from app.api.api import api_router
-from fastapi import Request
+from fastapi import Request, status
+from fastapi.responses import JSONResponse
+from psycopg2.errors import QueryCanceled
+from sqlalchemy.exc import OperationalError
 
+from app.core.cache import change_notifier
+from app.core.config import settings
+from app.core.idempotency import IdempotencyCleanupWorker, IdempotencyMiddleware
+from app.core.jobs import analytics_jobs
+from app.core.rollups import RollupWorker
+from app.core.visits import visit_batcher
 from app.db.init import init_db
+from app.db.partitions import PartitionWorker
+from app.db.session import engine
+
+class ModifyResponseMiddleware:
+    '''
+    Ответы 422 отдаются с кодом 400. ASGI-обёртка вместо @middleware("http"): та подменяет receive,
+    и обработчики перестают узнавать об отключении клиента
+    '''
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        async def modify_response(message):
+            if message["type"] == "http.response.start" and message["status"] == 422:
+                message = {**message, "status": 400}
+            await send(message)
+
+        await self.app(scope, receive, modify_response)
+
 
 main_router = FastAPI()
+main_router.add_middleware(ModifyResponseMiddleware)
+main_router.add_middleware(IdempotencyMiddleware, ttl=settings.IDEMPOTENCY_KEY_TTL,
+                           lock_timeout=settings.IDEMPOTENCY_LOCK_TIMEOUT)
+rollup_worker = RollupWorker(interval=settings.ROLLUP_INTERVAL, max_days=settings.ROLLUP_MAX_DAYS)
+partition_worker = PartitionWorker(interval=settings.LOCATION_PARTITION_INTERVAL,
+                                   months_ahead=settings.LOCATION_PARTITION_MONTHS_AHEAD,
+                                   retention_months=settings.LOCATION_PARTITION_RETENTION_MONTHS)
+idempotency_worker = IdempotencyCleanupWorker(interval=settings.IDEMPOTENCY_CLEANUP_INTERVAL,
+                                              batch_size=settings.IDEMPOTENCY_CLEANUP_BATCH_SIZE)
 
 
-@main_router.middleware("http")
-async def modify_response(request: Request, call_next):
-    response = await call_next(request)
-    if response.status_code == 422:
-        response.status_code = 400
-    return response
+@main_router.exception_handler(OperationalError)
+def database_error(request: Request, error: OperationalError):
+    if isinstance(error.orig, QueryCanceled):
+        # запрос прерван по statement_timeout или после отключения клиента
+        return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            content={"detail": "Превышено время выполнения запроса"})
+    raise error
 
 
 @main_router.on_event("startup")
 def startup():
-    init_db()
+    if settings.DB_INIT_ON_STARTUP:
+        init_db()
+    change_notifier.start()
+    partition_worker.start()
+    idempotency_worker.start()
+    if settings.ROLLUP_ENABLED:
+        rollup_worker.start()
+    if settings.VISIT_GROUP_COMMIT:
+        visit_batcher.start()
+    analytics_jobs.start()
+
+
+@main_router.on_event("shutdown")
+def shutdown():
+    visit_batcher.stop()
+    analytics_jobs.shutdown()
+    rollup_worker.stop()
+    partition_worker.stop()
+    idempotency_worker.stop()
+    change_notifier.stop()
+    engine.dispose()
 
 
 main_router.include_router(api_router)
@@ -1,4 +1,4 @@
-from app.db.base_class import Base
+from app.db.base_class import Base, version_column
 from sqlalchemy import Column, Integer, FLOAT, String, Enum, ForeignKey, DateTime, func
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.hybrid import hybrid_property
@@ -24,6 +24,7 @@ class AnimalType(Base):
         index=True
     )
     type = Column(String, nullable=False)
+    version = version_column()
 
 
 class Animal(Base):
@@ -43,9 +44,12 @@ class Animal(Base):
     chipperId = Column(Integer, ForeignKey("user.id"), nullable=False)
     chippingLocationId = Column(
         Integer, ForeignKey("point.id"), nullable=False)
+    # последняя посещённая точка, а если посещений нет - точка чипирования
+    currentPointId = Column(Integer, ForeignKey("point.id"), index=True)
     deathDateTime = Column(DateTime(
         timezone=True
     ))
+    version = version_column()
     AnimalTypes = relationship(
         "AnimalType", secondary="animaltypeanimal", primaryjoin="Animal.id == AnimalTypeAnimal.animal_id")
     VisitedLocations = relationship(
@@ -63,16 +67,20 @@ class Animal(Base):
 class AnimalTypeAnimal(Base):
     id = Column(Integer, primary_key=True, index=True)
     type_id = Column(Integer, ForeignKey(AnimalType.id), nullable=False)
-    animal_id = Column(Integer, ForeignKey(Animal.id), nullable=False)
+    animal_id = Column(Integer, ForeignKey(Animal.id), nullable=False, index=True)
     animal = relationship(Animal, foreign_keys=[
                           animal_id], overlaps="AnimalTypes")
 
 
 class AnimalLocation(Base):
-    id = Column(Integer, primary_key=True, index=True)
+    # секционирование по месяцам посещения (app/db/partitions.py): ключ секционирования входит в первичный ключ,
+    # для ORM строка по-прежнему определяется только id
+    __table_args__ = {"postgresql_partition_by": 'RANGE ("dateTimeOfVisitLocationPoint")'}
+    id = Column(Integer, primary_key=True, autoincrement=True)
     dateTimeOfVisitLocationPoint = Column(
-        DateTime(timezone=True), server_default=func.now())
+        DateTime(timezone=True), primary_key=True, server_default=func.now())
     locationPointId = Column(Integer, ForeignKey('point.id'), nullable=False)
-    animalId = Column(Integer, ForeignKey(Animal.id), nullable=False)
+    animalId = Column(Integer, ForeignKey(Animal.id), nullable=False, index=True)
     animal = relationship(Animal, foreign_keys=[
                           animalId], overlaps="VisitedLocations")
+    __mapper_args__ = {"primary_key": [id]}
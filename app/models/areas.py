@@ -1,9 +1,12 @@
 from sqlalchemy.ext.hybrid import hybrid_property
 
-from app.db.base_class import Base
-from sqlalchemy import Column, Integer,  ForeignKey, String, Float
+from app.db.base_class import Base, version_column
+from sqlalchemy import Column, Integer,  ForeignKey, String, Float, Date, Boolean, DateTime, Enum, Index, func, text
+from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.orm import relationship, object_session, events
 
+import enum
+
 
 class Area(Base):
     __tablename__ = "areas"
@@ -13,6 +16,8 @@ class Area(Base):
         index=True
     )
     name = Column(String, nullable=False)
+    fingerprint = Column(String(64), index=True)
+    version = version_column()
     areaPoints = relationship("AreaPoint", primaryjoin="Area.id == AreaPoint.area_id", cascade="all, delete-orphan")
 
 
@@ -29,6 +34,50 @@ class AreaPoint(Base):
     next_id = Column(Integer, ForeignKey('area_point.id', ondelete='SET NULL'), nullable=True)
 
 
+class AreaAnimalDay(Base):
+    '''Дневной агрегат: животное находилось в зоне в этот день, прибыло в неё и/или ушло из неё'''
+    __tablename__ = "area_animal_day"
+    area_id = Column(Integer, ForeignKey('areas.id', ondelete='CASCADE'), primary_key=True)
+    day = Column(Date, primary_key=True)
+    animal_id = Column(Integer, ForeignKey('animal.id', ondelete='CASCADE'), primary_key=True)
+    arrived = Column(Boolean, nullable=False, default=False)
+    gone = Column(Boolean, nullable=False, default=False)
+
+
+class AreaRollupDay(Base):
+    '''Отметка о том, что агрегаты зоны за день посчитаны и актуальны'''
+    __tablename__ = "area_rollup_day"
+    area_id = Column(Integer, ForeignKey('areas.id', ondelete='CASCADE'), primary_key=True)
+    day = Column(Date, primary_key=True)
+
 
+class AnimalPositionDay(Base):
+    '''Последние известные координаты всех животных на конец дня: с них начинается расчёт следующих дней'''
+    __tablename__ = "animal_position_day"
+    day = Column(Date, primary_key=True)
+    animal_ids = Column(ARRAY(Integer), nullable=False)
+    latitudes = Column(ARRAY(Float), nullable=False)
+    longitudes = Column(ARRAY(Float), nullable=False)
 
 
+class GeofenceEventType(enum.Enum):
+    ENTER = "ENTER"
+    EXIT = "EXIT"
+
+
+class GeofenceEvent(Base):
+    '''Вход животного в зону или выход из неё при смене текущей точки; хранится для повторной выдачи подписчикам'''
+    __tablename__ = "geofence_event"
+    __table_args__ = (
+        Index("ix_geofence_event_area_id_sequence", "area_id", "sequence"),
+        Index("ix_geofence_event_unpublished", "id", postgresql_where=text("sequence IS NULL")),
+    )
+    id = Column(Integer, primary_key=True)
+    # номер в порядке публикации, по нему события выдаются подписчикам; NULL, пока событие не опубликовано
+    sequence = Column(Integer, unique=True)
+    area_id = Column(Integer, ForeignKey('areas.id', ondelete='CASCADE'), nullable=False)
+    animal_id = Column(Integer, ForeignKey('animal.id', ondelete='CASCADE'), nullable=False, index=True)
+    event_type = Column(Enum(GeofenceEventType), nullable=False)
+    # точка, в которую переместилось животное
+    location_point_id = Column(Integer, ForeignKey('point.id', ondelete='SET NULL'))
+    event_time = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
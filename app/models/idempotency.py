@@ -0,0 +1,19 @@
+from app.db.base_class import Base
+from sqlalchemy import Column, DateTime, LargeBinary, SmallInteger, String, Text
+
+
+class IdempotencyKey(Base):
+    '''
+    Результат запроса с заголовком Idempotency-Key. Пока запрос выполняется, status пуст, а expires_at -
+    срок, после которого зависшую заявку можно занять заново
+    '''
+    __tablename__ = "idempotency_key"
+    # хэш заголовка Authorization: ключи разных клиентов не пересекаются
+    client = Column(LargeBinary(16), primary_key=True)
+    key = Column(String(255), primary_key=True)
+    # хэш метода, пути и тела запроса
+    fingerprint = Column(LargeBinary(32), nullable=False)
+    status = Column(SmallInteger)
+    headers = Column(Text)
+    body = Column(LargeBinary)
+    expires_at = Column(DateTime(timezone=True), nullable=False, index=True)
@@ -0,0 +1,38 @@
+from app.db.base_class import Base
+from sqlalchemy import Column, Date, DateTime, Enum, ForeignKey, Index, Integer, String, Text, func
+from sqlalchemy.dialects.postgresql import JSONB
+
+import enum
+
+
+class AnalyticsJobStatus(enum.Enum):
+    PENDING = "PENDING"
+    RUNNING = "RUNNING"
+    DONE = "DONE"
+    FAILED = "FAILED"
+    CANCELLED = "CANCELLED"
+
+
+class AnalyticsJob(Base):
+    '''
+    Задача расчёта аналитики зоны. Хранится в базе, чтобы её видели и отменяли все процессы;
+    выполняет её процесс, первым занявший задачу
+    '''
+    __tablename__ = "analytics_job"
+    __table_args__ = (Index("ix_analytics_job_status_created", "status", "createdDateTime"),)
+    id = Column(String(32), primary_key=True)
+    ownerId = Column(Integer, ForeignKey("user.id", ondelete="CASCADE"), nullable=False, index=True)
+    areaId = Column(Integer, ForeignKey("areas.id", ondelete="CASCADE"), nullable=False)
+    startDate = Column(Date, nullable=False)
+    endDate = Column(Date, nullable=False)
+    status = Column(Enum(AnalyticsJobStatus), nullable=False, default=AnalyticsJobStatus.PENDING)
+    createdDateTime = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    startedDateTime = Column(DateTime(timezone=True))
+    finishedDateTime = Column(DateTime(timezone=True))
+    result = Column(JSONB)
+    error = Column(Text)
+    # метка занятия задачи: исполнитель, у которого задачу забрали, не перезапишет её после повторного занятия
+    claim_token = Column(String(32))
+    # соединение, в котором выполняется расчёт: pid и номер реплики (None - основная база)
+    backend_pid = Column(Integer)
+    backend_replica = Column(Integer)
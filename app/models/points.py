@@ -1,4 +1,4 @@
-from app.db.base_class import Base
+from app.db.base_class import Base, version_column
 from sqlalchemy import Column, Integer, FLOAT
 
 
@@ -11,3 +11,4 @@ class Point(Base):
     latitude = Column(FLOAT, nullable=False)
     longitude = Column(FLOAT, nullable=False)
 
+    version = version_column()
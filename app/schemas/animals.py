@@ -2,7 +2,7 @@ from fastapi import Query
 from pydantic import BaseModel, validator
 from app.models.animals import AnimalGender, AnimalAlive
 
-from app.schemas.types import ISODateTime, NotEmtyOrWhitespased
+from app.schemas.types import ISODateTime, NotEmtyOrWhitespased, format_datetime
 
 
 class AnimalTypeBase(BaseModel):
@@ -73,6 +73,26 @@ class AnimalLocation(BaseModel):
         orm_mode = True
 
 
+class TrajectoryPoint(BaseModel):
+    locationPointId: int
+    visits: int
+    dwellTime: float
+
+
+class TrajectoryArea(BaseModel):
+    areaId: int
+    dwellTime: float
+
+
+class Trajectory(BaseModel):
+    '''Расстояния в метрах, скорость в м/с, время в секундах'''
+    animalId: int
+    totalDistance: float
+    maxSpeed: float
+    points: list[TrajectoryPoint]
+    areas: list[TrajectoryArea]
+
+
 class UpdateAnimalType(BaseModel):
     oldTypeId: int = Query(..., ge=1)
     newTypeId: int = Query(..., ge=1)
@@ -81,3 +101,33 @@ class UpdateAnimalType(BaseModel):
 class UpdateAnimalLocation(BaseModel):
     visitedLocationPointId: int = Query(..., ge=1)
     locationPointId: int = Query(..., ge=1)
+
+
+def animal_from_row(row) -> dict:
+    '''Словарь в формате схемы Animal из строки AnimalCRUD.search_animals_rows, без валидации pydantic'''
+    (weight, height, length, gender, chipper_id, chipping_location_id, id, life_status,
+     chipping_date_time, death_date_time, visited_locations, animal_types) = row
+    return {
+        "weight": weight,
+        "height": height,
+        "length": length,
+        "gender": gender.value,
+        "chipperId": chipper_id,
+        "chippingLocationId": chipping_location_id,
+        "id": id,
+        "lifeStatus": life_status.value,
+        "chippingDateTime": format_datetime(chipping_date_time),
+        "deathDateTime": format_datetime(death_date_time),
+        "visitedLocations": visited_locations,
+        "animalTypes": animal_types,
+    }
+
+
+def animal_location_from_row(row) -> dict:
+    id, date_time_of_visit, location_point_id = row
+    return {
+        "id": id,
+        "dateTimeOfVisitLocationPoint": format_datetime(date_time_of_visit),
+        "locationPointId": location_point_id,
+    }
+
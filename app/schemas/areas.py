@@ -1,6 +1,12 @@
+import enum
+from datetime import date
+from typing import Literal
+
 from pydantic import BaseModel
 
+from app.models.jobs import AnalyticsJobStatus
 from app.schemas.locations import LocationBase
+from app.schemas.types import ISODateTime
 
 
 class CreateArea(BaseModel):
@@ -15,6 +21,40 @@ class Area(CreateArea):
         orm_mode = True
 
 
+class GeoJSONFeature(BaseModel):
+    type: str
+    properties: dict | None = None
+    geometry: dict | None = None
+
+    def to_area(self) -> CreateArea:
+        '''Зона из объекта с геометрией Polygon из одного кольца; имя берётся из properties.name'''
+        if self.type != "Feature":
+            raise ValueError("Ожидается объект типа Feature")
+        name = (self.properties or {}).get("name")
+        if not isinstance(name, str) or not name.strip():
+            raise ValueError("Не указано имя зоны в properties.name")
+        geometry = self.geometry or {}
+        if geometry.get("type") != "Polygon":
+            raise ValueError("Поддерживается только геометрия Polygon")
+        rings = geometry.get("coordinates")
+        if not isinstance(rings, list) or len(rings) != 1:
+            raise ValueError("Полигон должен состоять из одного кольца, без вырезов")
+        ring = rings[0]
+        # в GeoJSON кольцо замкнуто: последняя позиция повторяет первую
+        if isinstance(ring, list) and len(ring) > 1 and ring[0] == ring[-1]:
+            ring = ring[:-1]
+        try:
+            points = [LocationBase(latitude=position[1], longitude=position[0]) for position in ring]
+        except (TypeError, IndexError, KeyError, ValueError):
+            raise ValueError("Неверные координаты")
+        return CreateArea(name=name, areaPoints=points)
+
+
+class GeoJSONFeatureCollection(BaseModel):
+    type: Literal["FeatureCollection"]
+    features: list[GeoJSONFeature]
+
+
 class animalsAnalytic(BaseModel):
     animalType: str
     animalTypeId: int
@@ -28,3 +68,34 @@ class AreaAnalytics(BaseModel):
     totalAnimalsArrived: int
     totalAnimalsGone: int
     animalsAnalytics: list[animalsAnalytic]
+
+
+class AreaAnalyticsItem(AreaAnalytics):
+    areaId: int
+
+
+class OccupancyBucket(enum.Enum):
+    HOUR = "hour"
+    DAY = "day"
+
+
+class AreaOccupancy(BaseModel):
+    start: ISODateTime
+    quantityAnimals: int
+    animalsArrived: int
+    animalsGone: int
+
+
+class AnalyticsJob(BaseModel):
+    id: str
+    areaId: int
+    startDate: date
+    endDate: date
+    status: AnalyticsJobStatus
+    createdDateTime: ISODateTime
+    finishedDateTime: ISODateTime = None
+    result: AreaAnalytics = None
+    error: str = None
+
+    class Config:
+        orm_mode = True
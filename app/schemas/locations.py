@@ -1,6 +1,8 @@
-from fastapi import Query
+from fastapi import HTTPException, Query, status
 from pydantic import BaseModel
 
+from app.schemas.types import BBox
+
 
 class LocationBase(BaseModel):
     latitude: float = Query(..., ge=-90, le=90)
@@ -15,3 +17,33 @@ class Location(LocationBase):
 
     class Config:
         orm_mode = True
+
+
+class NearestLocation(Location):
+    distance: float
+
+
+class Region:
+    '''Параметры запроса: прямоугольник bbox либо круг с центром (latitude, longitude) и радиусом radius в метрах'''
+
+    def __init__(
+        self,
+        bbox: BBox = None,
+        latitude: float = Query(None, ge=-90, le=90),
+        longitude: float = Query(None, ge=-180, le=180),
+        radius: float = Query(None, gt=0)
+    ):
+        circle = (latitude, longitude, radius)
+        if not (bbox is not None and circle == (None, None, None) or bbox is None and None not in circle):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                detail="Нужно указать либо bbox, либо latitude, longitude и radius")
+        self.bbox = bbox
+        self.latitude = latitude
+        self.longitude = longitude
+        self.radius = radius
+
+    def find_point_ids(self, point_index) -> list[int]:
+        if self.bbox is not None:
+            min_lon, min_lat, max_lon, max_lat = self.bbox
+            return point_index.within_bbox(min_lat, min_lon, max_lat, max_lon).tolist()
+        return point_index.within_radius(self.latitude, self.longitude, self.radius).tolist()
@@ -1,6 +1,61 @@
-from datetime import datetime
+from datetime import date, datetime, time, tzinfo
+import os
 import re
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from dateutil import tz
 from dateutil.parser import parse
+from fastapi import HTTPException, status
+from typing import Generic, TypeVar
+from pydantic.generics import GenericModel
+
+from app.core.config import settings
+
+LOCALTIME_PATH = "/etc/localtime"
+
+
+def resolve_local_timezone() -> tzinfo:
+    '''
+    Часовой пояс сервера с правилами перехода на летнее время: из TZ, иначе из /etc/localtime.
+    Смещение берётся для каждой даты отдельно, поэтому пояс определяется один раз при запуске
+    '''
+    name = os.environ.get("TZ", "").lstrip(":")
+    try:
+        if name:
+            return ZoneInfo(name)
+        with open(LOCALTIME_PATH, "rb") as file:
+            return ZoneInfo.from_file(file, key="localtime")
+    except (OSError, ValueError, ZoneInfoNotFoundError):
+        # TZ в формате POSIX или система без базы часовых поясов; tzlocal медленнее, но следует правилам libc
+        return tz.tzlocal()
+
+
+local_timezone = resolve_local_timezone()
+
+
+def day_start(day: date) -> datetime:
+    '''
+    Начало дня по местному времени сервера. Общая граница дней для агрегатов, аналитики и заполненности
+    зон: от часового пояса сессии базы она не зависит
+    '''
+    return datetime.combine(day, time.min, tzinfo=local_timezone)
+
+
+def local_date(value: datetime) -> date:
+    '''Дата момента времени по местному времени сервера'''
+    return value.astimezone(local_timezone).date()
+
+
+def format_datetime(value: datetime | None) -> str | None:
+    if value is None:
+        return None
+    return value.astimezone(local_timezone).isoformat()
+
+
+def parse_datetime(value: str) -> datetime:
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return parse(value)
 
 
 class NotEmtyOrWhitespased(str):
@@ -27,14 +82,50 @@ class ISODateTime(str):
         if not v:
             raise ValueError('Значение не должно быть пустым')
         if isinstance(v, datetime):
-            current_tz = datetime.now().astimezone().tzinfo
-            local_time = v.astimezone(current_tz)
-            return local_time.isoformat()
+            return format_datetime(v)
         try:
-            return parse(v)
+            return parse_datetime(v)
         except ValueError:
             raise ValueError('Значение не соответствует формату ISO 8601')
 
+class IdList(str):
+    '''Список идентификаторов через запятую: "1,2,3"'''
+    @classmethod
+    def __get_validators__(cls):
+        yield cls.validate
+
+    @classmethod
+    def validate(cls, v):
+        if isinstance(v, list):
+            return v
+        try:
+            ids = [int(item) for item in v.split(",") if item.strip()]
+        except ValueError:
+            raise ValueError('Значение должно быть списком целых чисел через запятую')
+        if not ids or any(id <= 0 for id in ids):
+            raise ValueError('Идентификаторы должны быть положительными целыми числами')
+        return list(dict.fromkeys(ids))
+
+
+class BBox(str):
+    '''Прямоугольник "minLon,minLat,maxLon,maxLat"; minLon > maxLon - прямоугольник через 180-й меридиан'''
+    @classmethod
+    def __get_validators__(cls):
+        yield cls.validate
+
+    @classmethod
+    def validate(cls, v):
+        if isinstance(v, tuple):
+            return v
+        try:
+            min_lon, min_lat, max_lon, max_lat = (float(item) for item in v.split(","))
+        except ValueError:
+            raise ValueError('Значение должно состоять из четырёх чисел через запятую: minLon,minLat,maxLon,maxLat')
+        if not (-180 <= min_lon <= 180 and -180 <= max_lon <= 180 and -90 <= min_lat <= max_lat <= 90):
+            raise ValueError('Неверные координаты прямоугольника')
+        return min_lon, min_lat, max_lon, max_lat
+
+
 class ISO8601DatePattern(str):
     '''pattern "yyyy-MM-dd"'''
     @classmethod
@@ -46,10 +137,27 @@ class ISO8601DatePattern(str):
         if not v:
             raise ValueError('Значение не должно быть пустым')
         if isinstance(v, datetime):
-            current_tz = datetime.now().astimezone().tzinfo
-            local_time = v.astimezone(current_tz)
-            return local_time.isoformat()
+            return format_datetime(v)
         try:
             return datetime.strptime(v, '%Y-%m-%d').date()
         except ValueError:
             raise ValueError('Значение не соответствует формату ISO 8601 (pattern "yyyy-MM-dd")')
+
+
+BatchItem = TypeVar("BatchItem")
+
+
+class Batch(GenericModel, Generic[BatchItem]):
+    '''Ответ на запрос нескольких объектов по id: найденные в порядке запроса и id, которых нет'''
+    items: list[BatchItem]
+    missing: list[int]
+
+    @staticmethod
+    def check_size(ids: list[int]) -> None:
+        if len(ids) > settings.MULTI_GET_LIMIT:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                detail=f"Можно запросить не больше {settings.MULTI_GET_LIMIT} объектов")
+
+    @staticmethod
+    def split(ids: list[int], found: dict) -> dict:
+        return {"items": [found[id] for id in ids if id in found], "missing": [id for id in ids if id not in found]}
@@ -0,0 +1,123 @@
+'''
+Сверка проверки самопересечения колец заметающей прямой с попарной проверкой и замер их времени.
+Запуск из корня репозитория: python -m benchmarks.geometry --fuzz 100000 --sizes 10 1000 100000
+'''
+import argparse
+import math
+import random
+import time
+from typing import List
+
+import numpy as np
+
+from app.core.geometry import all_collinear, has_duplicates, has_spikes, ring_self_intersects
+
+
+def pairwise_self_intersects(x: np.ndarray, y: np.ndarray) -> bool:
+    '''Прежняя проверка: каждая пара несмежных рёбер, O(n^2). Эталон для сверки заметающей прямой'''
+    n = len(x)
+
+    def orientation(ax, ay, bx, by, cx, cy):
+        value = (bx - ax) * (cy - ay) - (by - ay) * (cx - ax)
+        return (value > 0) - (value < 0)
+
+    def on_segment(ax, ay, bx, by, px, py):
+        return min(ax, bx) <= px <= max(ax, bx) and min(ay, by) <= py <= max(ay, by)
+
+    xs, ys = x.tolist(), y.tolist()
+    for i in range(n):
+        ax, ay, bx, by = xs[i], ys[i], xs[(i + 1) % n], ys[(i + 1) % n]
+        for j in range(i + 2, n):
+            if i == 0 and j == n - 1:
+                continue
+            cx, cy, dx, dy = xs[j], ys[j], xs[(j + 1) % n], ys[(j + 1) % n]
+            o1, o2 = orientation(ax, ay, bx, by, cx, cy), orientation(ax, ay, bx, by, dx, dy)
+            o3, o4 = orientation(cx, cy, dx, dy, ax, ay), orientation(cx, cy, dx, dy, bx, by)
+            if o1 != o2 and o3 != o4:
+                return True
+            if (o1 == 0 and on_segment(ax, ay, bx, by, cx, cy)) or (o2 == 0 and on_segment(ax, ay, bx, by, dx, dy)) \
+                    or (o3 == 0 and on_segment(cx, cy, dx, dy, ax, ay)) \
+                    or (o4 == 0 and on_segment(cx, cy, dx, dy, bx, by)):
+                return True
+    return False
+
+
+def star_ring(n: int, jagged: bool, seed: int = 1) -> tuple[np.ndarray, np.ndarray]:
+    '''Звёздчатое кольцо на всю карту: гладкое - на эллипсе, зубчатое - со случайным радиусом вершин'''
+    generator = np.random.default_rng(seed)
+    angles = np.arange(n) * 2 * math.pi / n
+    radius = generator.uniform(0.5, 1.0, n) if jagged else np.ones(n)
+    return np.cos(angles) * radius * 170, np.sin(angles) * radius * 80
+
+
+def comb_ring(n: int) -> tuple[np.ndarray, np.ndarray]:
+    '''Гребёнка: горизонтальные зубцы одновременно пересекают заметающую прямую, статус растёт до n/2 рёбер'''
+    teeth = max(1, n // 4)
+    step = 160 / teeth
+    x, y = [-170.0], [-80.0]
+    for tooth in range(teeth):
+        bottom = -80 + step * (tooth + 0.25)
+        top = -80 + step * (tooth + 0.75)
+        x += [-169.0, 170.0 - tooth % 7, 170.0 - tooth % 5, -169.0]
+        y += [bottom, bottom, top, top]
+    x.append(-170.0)
+    y.append(80.0)
+    return np.array(x), np.array(y)
+
+
+def fuzz(rounds: int, seed: int) -> int:
+    '''
+    Сверяет заметающую прямую с попарной проверкой на случайных кольцах с малыми целыми координатами,
+    где часты касания, вертикальные и лежащие на одной прямой рёбра. Кольца, которые AreaValidator
+    отклоняет раньше (точки на одной прямой, складки, повторы вершин), пропускаются. Возвращает число расхождений
+    '''
+    generator = random.Random(seed)
+    mismatches = 0
+    for _ in range(rounds):
+        n = generator.randint(3, 12)
+        grid = generator.choice((2, 3, 4, 6, 20))
+        x = np.array([generator.randint(0, grid) for _ in range(n)], dtype=float)
+        y = np.array([generator.randint(0, grid) for _ in range(n)], dtype=float)
+        order = np.lexsort((y, x))
+        if all_collinear(x, y) or has_spikes(x, y) or has_duplicates(x, y, order):
+            continue
+        if ring_self_intersects(x, y, order) != pairwise_self_intersects(x, y):
+            mismatches += 1
+            print("расхождение:", list(zip(x.tolist(), y.tolist())))
+    return mismatches
+
+
+def benchmark(sizes: List[int], repeat: int = 3, pairwise_limit: int = 1000) -> List[dict]:
+    '''Лучшее из repeat время проверки колец разной формы; попарная проверка - только до pairwise_limit вершин'''
+
+    def best_time(check, *args) -> float:
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            check(*args)
+            timings.append(time.perf_counter() - started)
+        return round(min(timings) * 1000, 2)
+
+    results = []
+    for n in sizes:
+        shapes = (("smooth", star_ring(n, False)), ("jagged", star_ring(n, True)), ("comb", comb_ring(n)))
+        for shape, (x, y) in shapes:
+            order = np.lexsort((y, x))
+            results.append({
+                "vertices": len(x),
+                "shape": shape,
+                "sweepMs": best_time(ring_self_intersects, x, y, order),
+                "pairwiseMs": best_time(pairwise_self_intersects, x, y) if n <= pairwise_limit else None,
+            })
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Сверка и замер проверки самопересечения колец")
+    parser.add_argument("--fuzz", type=int, default=100000, help="число случайных колец для сверки")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 1000, 100000])
+    arguments = parser.parse_args()
+    print({"fuzzRounds": arguments.fuzz, "mismatches": fuzz(arguments.fuzz, arguments.seed)})
+    for result in benchmark(arguments.sizes):
+        print(result)
@@ -0,0 +1,146 @@
+'''
+Замер стоимости строки ответов со списками животных и посещений. Запуск из корня репозитория:
+python -m benchmarks.serialization --rows 2000
+'''
+import argparse
+import asyncio
+import json
+import time
+from datetime import datetime, timedelta, timezone
+
+import orjson
+from dateutil.parser import parse
+from fastapi.encoders import jsonable_encoder
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+from sqlalchemy import insert
+
+from app.crud.crud_animal import AnimalCRUD
+from app.db.session import SessionLocal
+from app.models.animals import Animal as AnimalModel, AnimalAlive, AnimalGender, \
+    AnimalLocation as AnimalLocationModel, AnimalType as AnimalTypeModel, AnimalTypeAnimal
+from app.models.points import Point
+from app.models.user import User
+from app.schemas.animals import Animal, AnimalLocation, animal_from_row, animal_location_from_row
+from app.schemas.types import format_datetime, parse_datetime
+
+
+def benchmark(rows: int, repeat: int = 5) -> dict:
+    '''
+    Стоимость строки ответа, мкс: посещения животного и поиск животных через объекты ORM и response_model
+    против строк SQL, animal_from_row и orjson; отдельно - форматирование и разбор дат. Данные создаются
+    и удаляются самим замером
+    '''
+    # животные замера чипированы в отдельном промежутке времени, поиск находит только их
+    chipped_from = datetime(1971, 1, 1, tzinfo=timezone.utc)
+    chipped_to = chipped_from + timedelta(seconds=rows)
+    visited_from = datetime.now(timezone.utc)
+    with SessionLocal() as db:
+        chipper_id = db.query(User.id).order_by(User.id).limit(1).scalar()
+        point_ids = db.execute(insert(Point).values([
+            {"latitude": -89.5, "longitude": -179.5}, {"latitude": -89.5, "longitude": -179.4}
+        ]).returning(Point.id)).scalars().all()
+        type_id = db.execute(insert(AnimalTypeModel).values(type=f"benchmark-{time.time_ns()}")
+                             .returning(AnimalTypeModel.id)).scalar()
+        animal_ids = db.execute(insert(AnimalModel).values([
+            {"weight": 1, "height": 1, "length": 1, "gender": AnimalGender.OTHER, "lifeStatus": AnimalAlive.ALIVE,
+             "chippingDateTime": chipped_from + timedelta(seconds=number), "chipperId": chipper_id,
+             "chippingLocationId": point_ids[0], "currentPointId": point_ids[1]}
+            for number in range(rows)
+        ]).returning(AnimalModel.id)).scalars().all()
+        db.execute(insert(AnimalTypeAnimal).values([
+            {"type_id": type_id, "animal_id": animal_id} for animal_id in animal_ids
+        ]))
+        # у первого животного rows посещений, у остальных по одному
+        db.execute(insert(AnimalLocationModel).values(
+            [{"animalId": animal_ids[0], "locationPointId": point_ids[number % 2],
+              "dateTimeOfVisitLocationPoint": visited_from + timedelta(seconds=number)} for number in range(rows)]
+            + [{"animalId": animal_id, "locationPointId": point_ids[1], "dateTimeOfVisitLocationPoint": visited_from}
+               for animal_id in animal_ids[1:]]
+        ))
+        db.commit()
+
+    location_field = create_response_field(name="response", type_=list[AnimalLocation])
+    animal_field = create_response_field(name="response", type_=list[Animal])
+
+    def through_response_model(field, objects) -> bytes:
+        content = asyncio.run(serialize_response(field=field, response_content=objects, is_coroutine=False))
+        return json.dumps(jsonable_encoder(content)).encode()
+
+    def per_row(measure, count: int) -> float:
+        measure()
+        started = time.perf_counter()
+        for _ in range(repeat):
+            measure()
+        return round((time.perf_counter() - started) / repeat / count * 1e6, 2)
+
+    try:
+        with SessionLocal() as db:
+            animal_crud = AnimalCRUD(db)
+            search = (chipped_from, chipped_to, None, None, None, 0, rows)
+
+            def visits_orm():
+                through_response_model(location_field,
+                                       animal_crud.get_animal_locations(animal_ids[0], None, None, 0, rows))
+                db.expunge_all()
+
+            def visits_rows():
+                orjson.dumps([animal_location_from_row(row)
+                              for row in animal_crud.get_animal_locations_rows(animal_ids[0], None, None, 0, rows)])
+
+            def search_orm():
+                through_response_model(animal_field, animal_crud.search_animals(*search))
+                db.expunge_all()
+
+            def search_rows():
+                orjson.dumps([animal_from_row(row) for row in animal_crud.search_animals_rows(*search)])
+
+            values = [visited_from + timedelta(seconds=number) for number in range(rows)]
+            strings = [value.isoformat() for value in values]
+
+            def format_per_value_lookup():
+                # прежний ISODateTime: часовой пояс сервера заново для каждого значения
+                for value in values:
+                    value.astimezone(datetime.now().astimezone().tzinfo).isoformat()
+
+            def format_resolved():
+                for value in values:
+                    format_datetime(value)
+
+            def parse_dateutil():
+                for string in strings:
+                    parse(string)
+
+            def parse_fromisoformat():
+                for string in strings:
+                    parse_datetime(string)
+
+            return {
+                "rows": rows,
+                "visitsOrmUs": per_row(visits_orm, rows),
+                "visitsRowsUs": per_row(visits_rows, rows),
+                "searchOrmUs": per_row(search_orm, rows),
+                "searchRowsUs": per_row(search_rows, rows),
+                "formatPerValueLookupUs": per_row(format_per_value_lookup, rows),
+                "formatResolvedUs": per_row(format_resolved, rows),
+                "parseDateutilUs": per_row(parse_dateutil, rows),
+                "parseFromisoformatUs": per_row(parse_fromisoformat, rows),
+            }
+    finally:
+        with SessionLocal() as db:
+            db.query(AnimalLocationModel).filter(AnimalLocationModel.animalId.in_(animal_ids)) \
+                .delete(synchronize_session=False)
+            db.query(AnimalTypeAnimal).filter(AnimalTypeAnimal.animal_id.in_(animal_ids)) \
+                .delete(synchronize_session=False)
+            db.query(AnimalModel).filter(AnimalModel.id.in_(animal_ids)).delete(synchronize_session=False)
+            db.query(AnimalTypeModel).filter(AnimalTypeModel.id == type_id).delete(synchronize_session=False)
+            db.query(Point).filter(Point.id.in_(point_ids)).delete(synchronize_session=False)
+            db.commit()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Замер стоимости строки ответов со списками животных и посещений")
+    parser.add_argument("--rows", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=5)
+    arguments = parser.parse_args()
+    print(benchmark(arguments.rows, arguments.repeat))
@@ -0,0 +1,86 @@
+'''
+Замер пропускной способности записи посещений с групповой фиксацией и без неё. Запуск из корня репозитория:
+python -m benchmarks.visits --animals 1000 --visits 20000 --threads 64
+'''
+import argparse
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app.core.visits import visit_batcher
+from app.crud.crud_animal import AnimalCRUD
+from app.crud.crud_point import PointCRUD
+from app.db.session import SessionLocal
+from app.models.animals import Animal, AnimalGender, AnimalLocation
+from app.models.points import Point
+from app.models.user import User
+
+
+def benchmark(animals: int, visits: int, threads: int, group_commit: bool) -> dict:
+    '''
+    Пропускная способность записи посещений: threads потоков добавляют visits посещений животным,
+    переходящим между двумя точками. Данные создаются и удаляются самим замером
+    '''
+    with SessionLocal() as db:
+        first = PointCRUD(db).create_point(latitude=-89.5, longitude=-179.5)
+        second = PointCRUD(db).create_point(latitude=-89.5, longitude=-179.4)
+        point_ids = (first.id, second.id)
+        chipper_id = db.query(User.id).order_by(User.id).limit(1).scalar()
+        animal_ids = [
+            AnimalCRUD(db).create_animal(types=[], weight=1, length=1, height=1, gender=AnimalGender.OTHER,
+                                         chipperId=chipper_id, chippingLocationId=first.id).id
+            for _ in range(animals)
+        ]
+    animal_locks = {animal_id: threading.Lock() for animal_id in animal_ids}
+    steps = {animal_id: 0 for animal_id in animal_ids}
+
+    def add_visit(number: int) -> float:
+        # посещения одного животного чередуют точки, поэтому для него записи идут по очереди
+        animal_id = animal_ids[number % len(animal_ids)]
+        with animal_locks[animal_id]:
+            steps[animal_id] += 1
+            point_id = point_ids[steps[animal_id] % 2]
+            started = time.perf_counter()
+            if group_commit:
+                visit_batcher.add(animal_id, point_id)
+            else:
+                with SessionLocal() as db:
+                    AnimalCRUD(db).add_animal_location(animalId=animal_id, locationPointId=point_id)
+            return time.perf_counter() - started
+
+    if group_commit:
+        visit_batcher.start()
+    try:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(threads) as executor:
+            latencies = sorted(executor.map(add_visit, range(visits)))
+        elapsed = time.perf_counter() - started
+    finally:
+        if group_commit:
+            visit_batcher.stop()
+        with SessionLocal() as db:
+            db.query(AnimalLocation).filter(AnimalLocation.animalId.in_(animal_ids)).delete(synchronize_session=False)
+            db.query(Animal).filter(Animal.id.in_(animal_ids)).delete(synchronize_session=False)
+            db.query(Point).filter(Point.id.in_(point_ids)).delete(synchronize_session=False)
+            db.commit()
+    return {
+        "mode": "group" if group_commit else "single",
+        "visits": visits,
+        "threads": threads,
+        "seconds": round(elapsed, 3),
+        "visitsPerSecond": round(visits / elapsed, 1),
+        "p50Ms": round(latencies[len(latencies) // 2] * 1000, 2),
+        "p99Ms": round(latencies[int(len(latencies) * 0.99)] * 1000, 2),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Замер пропускной способности записи посещений")
+    parser.add_argument("--animals", type=int, default=1000)
+    parser.add_argument("--visits", type=int, default=20000)
+    parser.add_argument("--threads", type=int, default=64)
+    parser.add_argument("--mode", choices=("single", "group", "both"), default="both")
+    arguments = parser.parse_args()
+    modes = [False, True] if arguments.mode == "both" else [arguments.mode == "group"]
+    for mode in modes:
+        print(benchmark(arguments.animals, arguments.visits, arguments.threads, mode))
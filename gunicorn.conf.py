@@ -0,0 +1,25 @@
+import multiprocessing
+import os
+
+# Запуск: gunicorn app.main:main_router -c gunicorn.conf.py
+# Соединений к базе открывается до workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW + 1), это должно помещаться в max_connections
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_class = "uvicorn.workers.UvicornWorker"
+# при остановке воркер перестаёт принимать соединения и дожидается текущих запросов
+graceful_timeout = int(os.environ.get("GUNICORN_GRACEFUL_TIMEOUT", 30))
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 60))
+keepalive = 5
+
+
+def on_starting(server):
+    '''Схема и начальные данные создаются один раз в master-процессе до запуска воркеров'''
+    from app.core.config import settings
+    from app.db.init import init_db
+    from app.db.session import engine
+
+    init_db()
+    # соединения master-процесса не должны достаться воркерам после fork
+    engine.dispose()
+    settings.DB_INIT_ON_STARTUP = False